@@ -0,0 +1,92 @@
+"""Benchmark the BGAPI backend path against a virtual dongle.
+
+Connects a `Streamer` through the real `pygatt.BGAPIBackend` to a
+`ble2lsl.virtual.VirtualDongle`, and reports the time to connect (adapter
+reset, scan, connection, discovery and subscription), and the throughput of
+notifications decoded when the dongle sends them as fast as they are read.
+
+Usage:
+    python benchmarks/bgapi.py [device] [n_connects] [duration]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import ble2lsl.devices
+from ble2lsl import Streamer
+from ble2lsl.sinks import BaseSink
+from ble2lsl.virtual import VirtualDongle
+
+SCAN_TIMEOUT = 0.2
+
+
+class CountingSink(BaseSink):
+    """Counts pushed samples."""
+
+    def __init__(self):
+        super().__init__()
+        self.n_samples = {}
+
+    def open(self, name, info):
+        self.n_samples[name] = 0
+
+    def push_chunk(self, name, chunk, timestamp):
+        self.n_samples[name] += chunk.shape[0]
+
+    def close(self, name):
+        pass
+
+
+def bench_connect(device, n_connects):
+    """Return the time (s) to connect for each of `n_connects` attempts."""
+    durations = []
+    for _ in range(n_connects):
+        dongle = VirtualDongle(device)
+        streamer = Streamer(device, interface=dongle.port,
+                            scan_timeout=SCAN_TIMEOUT, sinks=[CountingSink()],
+                            subscriptions=['EEG'], autostart=False)
+        start = time.perf_counter()
+        streamer.connect()
+        durations.append(time.perf_counter() - start)
+        streamer.disconnect()
+        dongle.close()
+    return np.array(durations)
+
+
+def bench_throughput(device, duration):
+    """Return notifications and EEG samples per second, decoded unpaced."""
+    dongle = VirtualDongle(device, speed=None)
+    sink = CountingSink()
+    streamer = Streamer(device, interface=dongle.port,
+                        scan_timeout=SCAN_TIMEOUT, sinks=[sink],
+                        subscriptions=['EEG'])
+    start = time.perf_counter()
+    n_notifications = dongle.n_notifications
+    time.sleep(duration)
+    elapsed = time.perf_counter() - start
+    n_notifications = dongle.n_notifications - n_notifications
+    n_samples = sink.n_samples['EEG']
+    streamer.disconnect()
+    dongle.close()
+    return n_notifications / elapsed, n_samples / elapsed
+
+
+def main():
+    device = getattr(ble2lsl.devices,
+                     sys.argv[1] if len(sys.argv) > 1 else 'muse2016')
+    n_connects = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    durations = bench_connect(device, n_connects)
+    print("connect ({} s scan): median {:.3f} s, max {:.3f} s".format(
+        SCAN_TIMEOUT, np.median(durations), np.max(durations)))
+    notification_rate, sample_rate = bench_throughput(device, duration)
+    print("unpaced: {:.0f} notifications/s, {:.0f} EEG samples/s "
+          "(nominal {} Hz)".format(
+              notification_rate, sample_rate,
+              device.PARAMS['streams']['nominal_srate']['EEG']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark packet decoding throughput in-process and in a `DecoderPool`.
+
+Decodes the same Muse EEG packets for several simulated devices, first on a
+single thread as a `Streamer` does by default, then forwarded to a pool of
+worker processes, and reports the packets decoded per second. The decoded
+chunks are published to shared memory, from which completion is detected.
+
+Usage:
+    python benchmarks/decoder_pool.py [n_devices] [n_workers]
+"""
+
+import sys
+import time
+
+import bitstring
+
+from ble2lsl import Streamer
+from ble2lsl.devices import muse2016
+from ble2lsl.sharedmem import SharedMemoryReader
+from ble2lsl.sinks import SharedMemorySink
+from ble2lsl.workers import DecoderPool
+
+N_CHUNKS = 2000
+NAME = 'EEG'
+
+
+def make_packets():
+    """Return the packets of `N_CHUNKS` Muse EEG chunks."""
+    packets = []
+    for packet_id in range(N_CHUNKS):
+        for handle in muse2016.EEG_HANDLE_RECEIVE_ORDER:
+            packet = bitstring.pack(muse2016.PACKET_FORMATS[NAME],
+                                    packet_id % muse2016.PACKET_ID_MODULUS,
+                                    *range(2048, 2060))
+            packets.append((handle, packet.bytes))
+    return packets
+
+
+def make_streamer(i, pool=None):
+    streamer = Streamer(muse2016, subscriptions=[NAME], autostart=False,
+                        sinks=[SharedMemorySink(duration=10)], pool=pool)
+    streamer._device_id = 'BENCH{}'.format(i)
+    streamer._address = streamer._device_id
+    return streamer
+
+
+def bench_in_process(n_devices, packets):
+    """Return the time (s) to decode and push all packets on one thread."""
+    streamers = [make_streamer(i) for i in range(n_devices)]
+    handlers = []
+    for streamer in streamers:
+        streamer._init_sinks()
+        handlers.append(muse2016.PacketHandler(streamer))
+    start = time.perf_counter()
+    for streamer, handler in zip(streamers, handlers):
+        for handle, packet in packets:
+            handler.process_packet(handle, packet)
+            while not streamer._transmit_queue.empty():
+                streamer._transmit_chunk(*streamer._transmit_queue.get())
+    duration = time.perf_counter() - start
+    for streamer in streamers:
+        streamer._close_sinks()
+    return duration
+
+
+def bench_pool(n_devices, n_workers, packets):
+    """Return the time (s) to decode and push all packets in a pool."""
+    pool = DecoderPool(n_workers=n_workers)
+    streamers = [make_streamer(i, pool) for i in range(n_devices)]
+    callbacks = [pool.register(streamer) for streamer in streamers]
+    readers = []
+    for streamer in streamers:
+        while True:
+            try:
+                readers.append(SharedMemoryReader(streamer._device_id, NAME))
+                break
+            except FileNotFoundError:
+                time.sleep(0.01)
+    n_samples = N_CHUNKS * muse2016.PARAMS['streams']['chunk_size'][NAME]
+    start = time.perf_counter()
+    for handle, packet in packets:
+        for callback in callbacks:
+            callback(handle, packet)
+    while any(reader.n_written < n_samples for reader in readers):
+        time.sleep(0.001)
+    duration = time.perf_counter() - start
+    for reader in readers:
+        reader.close()
+    pool.close()
+    return duration
+
+
+def main():
+    n_devices = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else n_devices
+    packets = make_packets()
+    n_packets = n_devices * len(packets)
+    print("{} devices, {} packets each".format(n_devices, len(packets)))
+    duration = bench_in_process(n_devices, packets)
+    print("{:>18}: {:10.0f} packets/s".format("in-process",
+                                               n_packets / duration))
+    duration = bench_pool(n_devices, n_workers, packets)
+    print("{:>18}: {:10.0f} packets/s".format(
+        "{} workers".format(n_workers), n_packets / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark reconstruction of Ganglion samples from compressed deltas.
+
+Compares the per-sample update that `ganglion.PacketHandler` previously
+performed (subtract each delta, copy, scale in place) with the cumulative
+difference over a whole packet, and over a batch of packets as when decoding
+a capture.
+
+Usage:
+    python benchmarks/ganglion_deltas.py
+"""
+
+import timeit
+
+import numpy as np
+
+from ble2lsl.devices.ganglion.ganglion import (SCALE_FACTOR,
+                                              samples_from_deltas)
+
+N_PACKETS = 10000
+SCALE = SCALE_FACTOR["EEG"]
+
+
+def per_sample(last_sample, packet_deltas):
+    """Reconstruct the samples of each packet one sample at a time."""
+    chunk = np.zeros((1, 4), dtype=np.float32)
+    chunks = []
+    for deltas in packet_deltas:
+        for delta_id in [0, 1]:
+            last_sample -= np.array(deltas[delta_id])
+            chunk[0, :] = np.copy(last_sample)
+            chunk *= SCALE
+            chunks.append(np.copy(chunk))
+    return chunks
+
+
+def per_packet(last_sample, packet_deltas):
+    """Reconstruct the samples of each packet in one operation."""
+    blocks = []
+    for deltas in packet_deltas:
+        samples = samples_from_deltas(last_sample, deltas)
+        last_sample[:] = samples[-1]
+        samples *= SCALE
+        blocks.append(samples)
+    return blocks
+
+
+def batched(last_sample, packet_deltas):
+    """Reconstruct the samples of all packets in one operation."""
+    samples = samples_from_deltas(last_sample, packet_deltas)
+    last_sample[:] = samples[-1]
+    samples *= SCALE
+    return samples
+
+
+def main():
+    deltas = np.random.randint(-2 ** 18, 2 ** 18,
+                               (N_PACKETS, 2, 4)).astype(float)
+    last_sample = np.random.randint(-2 ** 23, 2 ** 23, 4).astype(float)
+
+    reference = np.concatenate(per_sample(np.copy(last_sample), deltas))
+    for func in [per_packet, batched]:
+        samples = func(np.copy(last_sample), deltas)
+        assert np.allclose(np.concatenate(samples) if func is per_packet
+                           else samples, reference)
+
+    print("{} packets ({} samples)".format(N_PACKETS, 2 * N_PACKETS))
+    for func in [per_sample, per_packet, batched]:
+        duration = min(timeit.repeat(
+            lambda: func(np.copy(last_sample), deltas), number=1, repeat=5))
+        print("{:>12}: {:8.2f} us/packet".format(func.__name__,
+                                                  1e6 * duration / N_PACKETS))
+
+
+if __name__ == '__main__':
+    main()
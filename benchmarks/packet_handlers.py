@@ -0,0 +1,55 @@
+"""Benchmark the decoding throughput of the device packet handlers.
+
+Encodes synthetic EEG with each device's `PacketEncoder`, then times the
+device's `PacketHandler` over the resulting packets, and reports the packets
+and samples decoded per second (compare with the devices' nominal rates).
+
+Usage:
+    python benchmarks/packet_handlers.py
+"""
+
+import time
+
+import numpy as np
+
+from ble2lsl import Streamer
+from ble2lsl.devices import ganglion, muse2016
+
+DURATION = 10
+"""Seconds of synthetic EEG to encode and decode."""
+
+
+def bench_handler(device, encoder):
+    """Return packets and EEG samples per second decoded by `device`."""
+    params = device.PARAMS['streams']
+    srate = params['nominal_srate']['EEG']
+    chunk_shape = (params['chunk_size']['EEG'],
+                   params['channel_count']['EEG'])
+    n_chunks = int(DURATION * srate / chunk_shape[0])
+    packets = []
+    for _ in range(n_chunks):
+        packets.extend(encoder.encode('EEG',
+                                      100 * np.random.randn(*chunk_shape)))
+
+    streamer = Streamer(device, subscriptions=['EEG'], autostart=False)
+    handler = device.PacketHandler(streamer)
+    start = time.perf_counter()
+    for handle, packet in packets:
+        handler.process_packet(handle, packet)
+    duration = time.perf_counter() - start
+    return len(packets) / duration, n_chunks * chunk_shape[0] / duration
+
+
+def main():
+    encoders = {'muse2016': (muse2016, muse2016.PacketEncoder()),
+                'ganglion (18-bit)': (ganglion, ganglion.PacketEncoder(18)),
+                'ganglion (19-bit)': (ganglion, ganglion.PacketEncoder(19))}
+    print("{} s of EEG per device".format(DURATION))
+    for name, (device, encoder) in encoders.items():
+        packet_rate, sample_rate = bench_handler(device, encoder)
+        print("{:>18}: {:9.0f} packets/s, {:9.0f} samples/s".format(
+            name, packet_rate, sample_rate))
+
+
+if __name__ == '__main__':
+    main()
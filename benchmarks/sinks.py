@@ -0,0 +1,40 @@
+"""Benchmark the cost of pushing chunks to each kind of sink.
+
+Pushes the same Muse EEG chunks through a `Dummy` streamer configured with
+one sink at a time, and reports the mean time per pushed chunk.
+
+Usage:
+    python benchmarks/sinks.py
+"""
+
+import timeit
+
+from ble2lsl import Dummy
+from ble2lsl.devices import muse2016
+from ble2lsl.sinks import LSLSink, SharedMemorySink
+
+N_CHUNKS = 10000
+NAME = 'EEG'
+
+
+def bench_sink(sink):
+    """Return the mean time (s) to push a chunk to `sink`."""
+    dummy = Dummy(muse2016, subscriptions=[NAME], sinks=[sink],
+                  autostart=False)
+    dummy._chunks[NAME][:] = next(iter(dummy._chunk_iter[NAME]))
+    duration = timeit.timeit(lambda: dummy._push_chunk(NAME, 0.0),
+                             number=N_CHUNKS)
+    dummy.close()
+    return duration / N_CHUNKS
+
+
+def main():
+    sinks = {'LSL': LSLSink, 'shared memory': SharedMemorySink}
+    print("{} chunks of Muse EEG".format(N_CHUNKS))
+    for sink_name, sink_class in sinks.items():
+        print("{:>14}: {:8.2f} us/chunk".format(
+            sink_name, 1e6 * bench_sink(sink_class())))
+
+
+if __name__ == '__main__':
+    main()
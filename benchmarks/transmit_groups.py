@@ -0,0 +1,71 @@
+"""Benchmark EEG push latency while the other streams are stalled.
+
+Streams all default streams from a virtual Muse, through a sink that stalls
+on each push of the non-EEG streams (as a slow outlet or a flood of chunks
+would), and reports the latency of EEG chunks from packet arrival to push,
+with all streams sharing one transmit queue, and with EEG in its own
+transmit group.
+
+Usage:
+    python benchmarks/transmit_groups.py
+"""
+
+import time
+
+import numpy as np
+
+from ble2lsl import Streamer
+from ble2lsl.devices import muse2016
+from ble2lsl.sinks import BaseSink
+from ble2lsl.tracing import Tracer
+from ble2lsl.virtual import VirtualDongle
+
+DURATION = 5.0
+"""Seconds to stream in each configuration."""
+
+STALL = 0.02
+"""Seconds each push of a non-EEG chunk takes."""
+
+
+class StallingSink(BaseSink):
+    """Discards chunks, stalling on those of streams other than EEG."""
+
+    def open(self, name, info):
+        pass
+
+    def push_chunk(self, name, chunk, timestamp):
+        if name != 'EEG':
+            time.sleep(STALL)
+
+    def close(self, name):
+        pass
+
+
+def eeg_latency(transmit_groups):
+    """Return the latencies (s) of the EEG chunks pushed."""
+    dongle = VirtualDongle(muse2016)
+    tracer = Tracer()
+    streamer = Streamer(muse2016, interface=dongle.port, scan_timeout=0.3,
+                        sinks=[StallingSink()], tracer=tracer,
+                        transmit_groups=transmit_groups)
+    time.sleep(DURATION)
+    latency = tracer.latencies()[(streamer._device_id, 'EEG')]['total']
+    streamer.disconnect()
+    dongle.close()
+    return latency
+
+
+def main():
+    print("EEG latency (ms) with {:g} ms stalls on other streams"
+          .format(1e3 * STALL))
+    print("{:>14}{:>8}{:>8}{:>8}{:>8}".format(
+        "queues", "chunks", "median", "p99", "max"))
+    for label, groups in [('shared', None), ('EEG separate', [['EEG']])]:
+        latency = 1e3 * eeg_latency(groups)
+        print("{:>14}{:>8}{:>8.2f}{:>8.2f}{:>8.2f}".format(
+            label, len(latency), np.median(latency),
+            np.percentile(latency, 99), np.max(latency)))
+
+
+if __name__ == '__main__':
+    main()
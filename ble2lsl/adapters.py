@@ -0,0 +1,156 @@
+"""Sharing of several BLE adapters among many devices.
+
+A single adapter (e.g. a BLED112 dongle) maintains a limited number of
+connections, and carries a limited number of notifications per second. An
+`AdapterPool` holds a `pygatt` backend for each of several adapters, and
+assigns each `Streamer` connecting through the pool to the least loaded
+adapter: that with the fewest connections, and then the lowest rate of
+notifications. Adapters are started when first assigned a device, and
+streamers on the same adapter connect one at a time.
+
+Example:
+    adapters = AdapterPool(['/dev/ttyACM0', '/dev/ttyACM1'])
+    streamers = [Streamer(muse2016, address=address, adapters=adapters)
+                 for address in addresses]
+    ...
+    adapters.report()
+"""
+
+import threading
+import time
+
+from ble2lsl.ble2lsl import make_adapter, start_adapter
+
+RATE_WINDOW = 1.0
+"""Minimum seconds over which to measure notification rates."""
+
+
+class AdapterPool:
+    """Assigns devices to several BLE adapters, balancing their load."""
+
+    def __init__(self, interfaces, backend='bgapi', max_connections=None):
+        """Construct the `pygatt` backends, without starting the adapters.
+
+        Args:
+            interfaces (Iterable[str]): The serial ports of BGAPI adapters,
+                or HCI interfaces for the `'gatt'` backend.
+            backend (str): Which `pygatt` backend to use for all adapters.
+            max_connections (int): Maximum number of devices per adapter.
+                By default, unlimited.
+        """
+        self._interfaces = list(interfaces)
+        self._backend = backend
+        self._max_connections = max_connections
+        self._adapters = [make_adapter(backend, interface)
+                          for interface in self._interfaces]
+        self._started = [False] * len(self._adapters)
+        # held while starting an adapter, connecting a device through it, or
+        # commanding it (reentrant, for commands sent while connecting)
+        self._adapter_locks = [threading.RLock() for _ in self._adapters]
+        self._lock = threading.Lock()
+        self._assignments = {}
+
+        self._n_notifications = [0] * len(self._adapters)
+        now = time.monotonic()
+        self._rate_samples = [(now, 0)] * len(self._adapters)
+        self._rates = [0.0] * len(self._adapters)
+
+    def acquire(self, streamer, max_attempts=20):
+        """Assign a streamer's device to the least loaded adapter.
+
+        Starts the adapter, if not yet started.
+
+        Args:
+            streamer (ble2lsl.Streamer): The streamer about to connect.
+            max_attempts (int): Attempts to start the adapter.
+
+        Returns:
+            pygatt.BLEBackend: The started adapter.
+            threading.RLock: Hold while connecting through the adapter, or
+                sending it commands.
+        """
+        with self._lock:
+            self._update_rates()
+            counts = self._connection_counts()
+            candidates = [idx for idx in range(len(self._adapters))
+                          if self._max_connections is None
+                          or counts[idx] < self._max_connections]
+            if not candidates:
+                raise IOError("No adapter with a free connection")
+            idx = min(candidates,
+                      key=lambda idx: (counts[idx], self._rates[idx]))
+            self._assignments[streamer] = idx
+        with self._adapter_locks[idx]:
+            if not self._started[idx]:
+                start_adapter(self._adapters[idx], max_attempts)
+                self._started[idx] = True
+        return self._adapters[idx], self._adapter_locks[idx]
+
+    def release(self, streamer):
+        """Free the connection of a disconnected streamer's adapter."""
+        with self._lock:
+            self._assignments.pop(streamer, None)
+
+    def count_notifications(self, streamer, callback):
+        """Wrap a streamer's notification callback to count notifications."""
+        idx = self._assignments[streamer]
+        counts = self._n_notifications
+
+        def process_packet(handle, packet):
+            # each adapter's notifications arrive on a single thread
+            counts[idx] += 1
+            callback(handle, packet)
+        return process_packet
+
+    def close(self):
+        """Stop the started adapters."""
+        for idx, adapter in enumerate(self._adapters):
+            if self._started[idx]:
+                adapter.stop()
+                self._started[idx] = False
+
+    def throughput(self):
+        """Return the load on each adapter.
+
+        Returns:
+            List[dict]: The `interface`, number of `connections`, total
+                number of `notifications`, and the notification `rate` (per
+                second; measured over at least `RATE_WINDOW` seconds) of
+                each adapter.
+        """
+        with self._lock:
+            self._update_rates()
+            counts = self._connection_counts()
+        return [dict(interface=interface, connections=counts[idx],
+                     notifications=self._n_notifications[idx],
+                     rate=self._rates[idx])
+                for idx, interface in enumerate(self._interfaces)]
+
+    def report(self):
+        """Print the load on each adapter."""
+        print("{:<24}{:>12}{:>15}{:>12}".format(
+            "adapter", "connections", "notifications", "rate (Hz)"))
+        for stats in self.throughput():
+            print("{interface:<24}{connections:>12}{notifications:>15}"
+                  "{rate:>12.1f}".format(**stats))
+
+    @property
+    def backend(self):
+        """The name of the `pygatt` backend used for all adapters."""
+        return self._backend
+
+    def _connection_counts(self):
+        counts = [0] * len(self._adapters)
+        for idx in self._assignments.values():
+            counts[idx] += 1
+        return counts
+
+    def _update_rates(self):
+        """Update the notification rates not measured within `RATE_WINDOW`."""
+        now = time.monotonic()
+        for idx, (sample_time, count) in enumerate(self._rate_samples):
+            if now - sample_time >= RATE_WINDOW:
+                n_notifications = self._n_notifications[idx]
+                self._rates[idx] = ((n_notifications - count)
+                                    / (now - sample_time))
+                self._rate_samples[idx] = (now, n_notifications)
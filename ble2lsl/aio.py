@@ -0,0 +1,123 @@
+"""Delivery of streamed chunks to asyncio consumers in the same process.
+
+`BaseStreamer.chunks` attaches an `AsyncSink` to a streamer, and yields the
+chunks pushed to it on an asyncio event loop, without passing through LSL,
+and without additional threads. Chunks are handed over from the streamer's
+transmit threads through a bounded buffer; the event loop is woken once for
+any number of chunks buffered since it last ran. When a consumer falls
+behind, the oldest buffered chunks are dropped, so that the transmit threads
+never wait for it. If the consumer's loop is closed without closing the
+iterator, the sink is detached from the streamer on the next chunk.
+
+Example:
+    async for name, timestamps, chunk in streamer.chunks(['EEG']):
+        ...
+"""
+
+import asyncio
+from collections import deque
+import threading
+from warnings import warn
+
+from ble2lsl.sinks import BaseSink, chunk_timestamps
+
+DEFAULT_MAX_CHUNKS = 1024
+"""Default number of chunks buffered for a consumer before dropping."""
+
+# Python 3.6 has no `get_running_loop`; there, `get_event_loop` returns the
+# running loop when called from a coroutine
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class AsyncSink(BaseSink):
+    """Buffers chunks for iteration on an asyncio event loop."""
+
+    def __init__(self, streams=None, max_chunks=DEFAULT_MAX_CHUNKS,
+                 loop=None, on_loop_closed=None):
+        """Construct an `AsyncSink`.
+
+        Args:
+            streams (Iterable[str]): Names of the streams to receive.
+            max_chunks (int): Maximum number of chunks buffered, beyond which
+                the oldest are dropped.
+            loop (asyncio.AbstractEventLoop): The loop on which chunks are
+                consumed. By default, the running loop; construct the sink
+                in a coroutine.
+            on_loop_closed (function): Called once with the sink, from the
+                pushing thread, if a chunk is pushed after the loop closed;
+                e.g. to detach the sink from its streamer.
+        """
+        super().__init__(streams=streams)
+        self._loop = _running_loop() if loop is None else loop
+        self._buffer = deque(maxlen=max_chunks)
+        self._srates = {}
+        self._available = asyncio.Event()
+        self._wake_pending = False
+        self._n_dropped = 0
+        self._on_loop_closed = on_loop_closed
+        self._closed_lock = threading.Lock()
+
+    def open(self, name, info):
+        self._srates[name] = info["nominal_srate"]
+
+    def push_chunk(self, name, chunk, timestamp):
+        """Buffer a copy of a chunk, and wake the loop if not yet woken.
+
+        Called from the streamer's transmit threads.
+        """
+        if self._loop.is_closed():
+            self._loop_closed()
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            if not self._n_dropped:
+                warn("Asyncio consumer falling behind; dropping chunks")
+            self._n_dropped += 1
+        self._buffer.append((name, chunk.copy(), timestamp))
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # closed since checked
+                self._loop_closed()
+
+    def close(self, name):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """Return the next chunk buffered, waiting until one is available.
+
+        Returns:
+            str: The name of the stream.
+            np.ndarray: The timestamps of the samples in the chunk.
+            np.ndarray: The chunk (samples by channels).
+        """
+        while not self._buffer:
+            self._available.clear()
+            if self._buffer:
+                break
+            await self._available.wait()
+        name, chunk, timestamp = self._buffer.popleft()
+        timestamps = chunk_timestamps(timestamp, chunk.shape[0],
+                                      self._srates[name])
+        return name, timestamps, chunk
+
+    @property
+    def dropped_chunks(self):
+        """Number of chunks dropped while the buffer was full."""
+        return self._n_dropped
+
+    def _loop_closed(self):
+        """Handle (once) the closing of the loop while chunks are pushed."""
+        with self._closed_lock:
+            on_loop_closed, self._on_loop_closed = self._on_loop_closed, None
+        if on_loop_closed is not None:
+            on_loop_closed(self)
+
+    def _wake(self):
+        """Run on the loop to signal chunks buffered since it last ran."""
+        self._wake_pending = False
+        self._available.set()
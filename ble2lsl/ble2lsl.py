@@ -28,20 +28,38 @@ from warnings import warn
 
 import numpy as np
 import pygatt
+from pygatt.backends.bgapi.bglib import ResponsePacketType
 from pygatt.backends.bgapi.exceptions import ExpectedResponseTimeout
-import pylsl as lsl
+from pygatt.backends.bgapi.packets import BGAPICommandPacketBuilder
 import serial
 
-INFO_ARGS = ['type', 'channel_count', 'nominal_srate', 'channel_format']
+from ble2lsl.aio import DEFAULT_MAX_CHUNKS, AsyncSink
+from ble2lsl.buffers import ChunkPool
+from ble2lsl.interval import (INTERVAL_MS, SUPERVISION_TIMEOUT,
+                              IntervalController)
+from ble2lsl.sinks import LSLSink, SharedMemorySink
+from ble2lsl.utils import missing_value
+
+STOP_TIMEOUT = 2.0
+"""Default maximum seconds to wait for each thread of a streamer to stop."""
+
+PRIORITY_TIMEOUT = 0.1
+"""Maximum seconds a transmit thread defers to those of higher priority."""
+
+_STOP = None
+"""Enqueued to stop the transmit thread, once it has pushed earlier chunks."""
 
 
 class BaseStreamer:
     """Base class for streaming data through an LSL outlet.
 
-    Prepares `pylsl.StreamInfo` and `pylsl.StreamOutlet` objects as well as
-    data buffers for handling of incoming chunks.
+    Prepares stream metadata and data buffers for handling of incoming chunks,
+    and pushes chunks to one or more sinks (see `ble2lsl.sinks`); by default,
+    a `pylsl.StreamOutlet` for each stream.
 
-    Subclasses must implement `start` and `stop` methods for stream control.
+    Subclasses must implement `start`, `stop` and `close` methods for stream
+    control. Streaming may be restarted after `stop`; after `close`, the
+    streamer holds no threads or open sinks.
 
     TODO:
         * Public access to outlets and stream info?
@@ -49,7 +67,8 @@ class BaseStreamer:
     """
 
     def __init__(self, device, subscriptions=None, time_func=time.time,
-                 ch_names=None, **kwargs):
+                 ch_names=None, sinks=None, shared_memory=False,
+                 processors=None, raw=None, **kwargs):
         """Construct a `BaseStreamer` object.
 
         Args:
@@ -59,6 +78,20 @@ class BaseStreamer:
                 Some subset of `SUBSCRIPTION_NAMES`.
             ch_names (dict[Iterable[str]]): User-defined channel names.
                 e.g. `{'EEG': ('Ch1', 'Ch2', 'Ch3', 'Ch4')}`.
+            sinks (Iterable[ble2lsl.sinks.BaseSink]): Destinations of the
+                streamed chunks. By default, a single `ble2lsl.sinks.LSLSink`.
+            shared_memory (bool): Whether to also publish numeric streams to
+                shared memory ring buffers, alongside the other sinks.
+                Local consumers can read them with
+                `ble2lsl.sharedmem.SharedMemoryReader`.
+            processors (dict[Iterable[ble2lsl.processing.BaseProcessor]]):
+                Processing stages deriving additional streams, by the name of
+                the stream they process. e.g. `{'EEG': [IIRFilter(notch=60)]}`.
+            raw (Iterable[str]): Streams to publish as native integer counts
+                from the device, rather than converting to physical units.
+                The scale factor and offset for conversion are included in
+                the stream metadata. Only streams with a `raw_channel_format`
+                in the device parameters are allowed.
         """
         self._device = device
         if subscriptions is None:
@@ -67,19 +100,26 @@ class BaseStreamer:
         self._time_func = time_func
         self._user_ch_names = ch_names if ch_names is not None else {}
         self._stream_params = self._device.PARAMS['streams']
+        self._raw = tuple(raw) if raw is not None else ()
+        raw_formats = self._stream_params.get("raw_channel_format", {})
+        for name in self._raw:
+            if raw_formats.get(name) is None:
+                raise ValueError("No raw format for {} stream".format(name))
+
+        self._sinks = [LSLSink()] if sinks is None else list(sinks)
+        if shared_memory:
+            self._sinks.append(SharedMemorySink())
+        self._sink_routes = {}
+        # metadata of the open streams, as passed to the sinks
+        self._stream_infos = {}
+        self._processors = {name: list(stages) for name, stages
+                            in (processors or {}).items()}
+        self._stage_routes = {}
+        self._push_source = {}
 
         self._chunk_idxs = stream_idxs_zeros(self._subscriptions)
         self._chunks = empty_chunks(self._stream_params,
-                                    self._subscriptions)
-
-        # StreamOutlet.push_chunk doesn't like single-sample chunks...
-        # but want to keep using push_chunk for intra-chunk timestamps
-        # doing this beforehand to avoid a chunk size check for each push
-        chunk_size = self._stream_params["chunk_size"]
-        self._push_func = {name: (self._push_chunk_as_sample
-                                  if chunk_size[name] == 1
-                                  else self._push_chunk)
-                           for name in self._subscriptions}
+                                    self._subscriptions, raw=self._raw)
 
     def start(self):
         """Begin streaming through the LSL outlet."""
@@ -89,70 +129,185 @@ class BaseStreamer:
         """Stop/pause streaming through the LSL outlet."""
         raise NotImplementedError()
 
-    def _init_lsl_outlets(self):
-        """Call in subclass after acquiring address."""
-        self._info = {}
-        self._outlets = {}
-        for name in self._subscriptions:
-            info = {arg: self._stream_params[arg][name] for arg in INFO_ARGS}
-            outlet_name = '{}-{}'.format(self._device_id, name)
-            self._info[name] = lsl.StreamInfo(outlet_name, **info,
-                                              source_id=self._device_id)
-            self._add_device_info(name)
-            chunk_size = self._stream_params["chunk_size"][name]
-            self._outlets[name] = lsl.StreamOutlet(self._info[name],
-                                                   chunk_size=chunk_size,
-                                                   max_buffered=360)
+    def close(self):
+        """Stop streaming, and release the streamer's threads and sinks."""
+        raise NotImplementedError()
 
-    def _push_chunk(self, name, timestamp):
-        self._outlets[name].push_chunk(self._chunks[name].tolist(),
-                                       timestamp)
+    def _init_sinks(self):
+        """Open each subscribed stream in its sinks.
 
-    def _push_chunk_as_sample(self, name, timestamp):
-        self._outlets[name].push_sample(self._chunks[name].tolist()[0],
-                                        timestamp)
+        Call in subclass after acquiring address.
+        """
+        for name in self._subscriptions:
+            self._open_stream(name, self._stream_info(name))
+
+    def _open_stream(self, name, info):
+        """Open a stream, and any streams derived from it, in the sinks."""
+        stage_routes = []
+        for processor in self._processors.get(name, []):
+            out_name = processor.output_name(name)
+            out_info = processor.open(info)
+            stage_routes.append((processor, out_name))
+            if out_name == name:
+                info = out_info
+            else:
+                self._open_stream(out_name, out_info)
+        self._stage_routes[name] = stage_routes
+        # source is not pushed when replaced by a processor's output
+        self._push_source[name] = all(not processor.replace
+                                      for processor in self._processors.get(
+                                          name, []))
+        self._stream_infos[name] = info
+        self._sink_routes[name] = [sink for sink in self._sinks
+                                   if sink.accepts(name)]
+        for sink in self._sink_routes[name]:
+            sink.open(name, info)
+
+    def _close_stream(self, name):
+        """Close a stream, and any streams derived from it, in the sinks."""
+        for _, out_name in self._stage_routes.pop(name, []):
+            if out_name != name:
+                self._close_stream(out_name)
+        self._stream_infos.pop(name, None)
+        for sink in self._sink_routes.pop(name, []):
+            sink.close(name)
+
+    def _close_sinks(self):
+        """Close the streams in each sink."""
+        routes, self._sink_routes = self._sink_routes, {}
+        self._stream_infos = {}
+        for name, sinks in routes.items():
+            for sink in sinks:
+                sink.close(name)
+
+    async def chunks(self, streams=None, max_chunks=DEFAULT_MAX_CHUNKS):
+        """Yield the chunks pushed by the streamer, on the running loop.
+
+        Chunks are handed over directly from the streamer's transmit path,
+        without passing through LSL (see `ble2lsl.aio`). Iteration continues
+        across `stop` and `start`, until the consumer stops iterating; to
+        stop receiving chunks immediately on `break`, call the iterator's
+        `aclose` (e.g. with `contextlib.aclosing`). If the loop is closed
+        without closing the iterator, the consumer is detached on the next
+        chunk pushed.
 
-    def _add_device_info(self, name):
-        """Adds device-specific parameters to `info`."""
-        desc = self._info[name].desc()
+        Args:
+            streams (Iterable[str]): Names of the streams to receive.
+                By default, all streams pushed, including those derived by
+                processors.
+            max_chunks (int): Maximum number of chunks buffered for the
+                consumer, beyond which the oldest are dropped.
+
+        Yields:
+            str: The name of the stream.
+            np.ndarray: The timestamps of the samples in the chunk.
+            np.ndarray: The chunk (samples by channels).
+        """
+        sink = AsyncSink(streams, max_chunks,
+                         on_loop_closed=self._detach_sink)
+        self._attach_sink(sink)
         try:
-            desc.append_child_value("manufacturer", self._device.MANUFACTURER)
-        except KeyError:
-            warn("Manufacturer not specified in device file")
+            async for item in sink:
+                yield item
+        finally:
+            self._detach_sink(sink)
+
+    def _attach_sink(self, sink):
+        """Add a sink, and open the streams already open in the others."""
+        self._sinks.append(sink)
+        for name, info in list(self._stream_infos.items()):
+            if sink.accepts(name):
+                sink.open(name, info)
+                # replaced, not modified, while chunks may be pushed
+                self._sink_routes[name] = (self._sink_routes.get(name, [])
+                                          + [sink])
+
+    def _detach_sink(self, sink):
+        """Remove a sink added by `_attach_sink`, closing its streams."""
+        if sink not in self._sinks:
+            # already detached
+            return
+        self._sinks.remove(sink)
+        for name, routes in list(self._sink_routes.items()):
+            if sink in routes:
+                self._sink_routes[name] = [other for other in routes
+                                           if other is not sink]
+                sink.close(name)
 
-        desc.append_child_value("address", self._address)
+    def _push_chunk(self, name, timestamp):
+        """Push the stream's current chunk to its sinks and processors."""
+        self._push(name, self._chunks[name], timestamp)
+
+    def _push(self, name, chunk, timestamp):
+        if self._push_source[name]:
+            for sink in self._sink_routes[name]:
+                sink.push_chunk(name, chunk, timestamp)
+        for processor, out_name in self._stage_routes[name]:
+            output = processor.process(chunk, timestamp)
+            if output is None:
+                continue
+            if out_name == name:
+                for sink in self._sink_routes[name]:
+                    sink.push_chunk(name, *output)
+            else:
+                self._push(out_name, *output)
 
-        channels = desc.append_child("channels")
+    def _stream_info(self, name):
+        """Return the metadata of a stream, as passed to the sinks."""
         try:
-            ch_names = self._stream_params["ch_names"][name]
-            # use user-specified ch_names if available and right no. channels
-            if name in self._user_ch_names:
-                user_ch_names = self._user_ch_names[name]
-                if len(user_ch_names) == len(ch_names):
-                    if len(user_ch_names) == len(set(user_ch_names)):
-                        ch_names = user_ch_names
-                    else:
-                        print("Non-unique names in user-defined {} ch_names; "
-                              .format(name), "using default ch_names.")
-                else:
-                    print("Wrong # of channels in user-defined {} ch_names; "
-                          .format(name), "using default ch_names.")
-
-            for c, ch_name in enumerate(ch_names):
-                unit = self._stream_params["units"][name][c]
-                type_ = self._stream_params["type"][name]
-                channels.append_child("channel") \
-                    .append_child_value("label", ch_name) \
-                    .append_child_value("unit", unit) \
-                    .append_child_value("type", type_)
+            manufacturer = self._device.MANUFACTURER
+        except AttributeError:
+            manufacturer = None
+            warn("Manufacturer not specified in device file")
+        try:
+            info = {arg: self._stream_params[arg][name]
+                    for arg in ['type', 'channel_count', 'nominal_srate',
+                                'channel_format', 'numpy_dtype', 'chunk_size',
+                                'units']}
+            info["ch_names"] = self._get_ch_names(name)
         except KeyError:
             raise ValueError("Channel names, units, or types not specified")
+        info.update(source_id=self._device_id, manufacturer=manufacturer,
+                    address=self._address, scale=None, offset=None)
+        if name in self._raw:
+            raw_format = self._stream_params["raw_channel_format"][name]
+            info.update(channel_format=raw_format, numpy_dtype=raw_format,
+                        scale=self._stream_params["raw_scale"][name],
+                        offset=self._stream_params["raw_offset"][name])
+        return info
+
+    def _get_ch_names(self, name):
+        """Return user-defined channel names if valid, otherwise defaults."""
+        ch_names = self._stream_params["ch_names"][name]
+        # use user-specified ch_names if available and right no. channels
+        if name in self._user_ch_names:
+            user_ch_names = self._user_ch_names[name]
+            if len(user_ch_names) == len(ch_names):
+                if len(user_ch_names) == len(set(user_ch_names)):
+                    ch_names = user_ch_names
+                else:
+                    print("Non-unique names in user-defined {} ch_names; "
+                          .format(name), "using default ch_names.")
+            else:
+                print("Wrong # of channels in user-defined {} ch_names; "
+                      .format(name), "using default ch_names.")
+        return tuple(ch_names)
 
     @property
     def subscriptions(self):
         """The names of the subscribed streams."""
         return self._subscriptions
 
+    @property
+    def raw(self):
+        """The names of the streams published as raw integer counts."""
+        return self._raw
+
+    @property
+    def sinks(self):
+        """The destinations of the streamed chunks."""
+        return tuple(self._sinks)
+
 
 class Streamer(BaseStreamer):
     """Streams data to an LSL outlet from a BLE device.
@@ -164,7 +319,9 @@ class Streamer(BaseStreamer):
 
     def __init__(self, device, address=None, backend='bgapi', interface=None,
                  autostart=True, scan_timeout=10.5, internal_timestamps=False,
-                 **kwargs):
+                 fill_missing=False, pool=None, tracer=None,
+                 adapt_interval=False, adapt_period=5.0, adapters=None,
+                 transmit_groups=None, **kwargs):
         """Construct a `Streamer` instance for a given device.
 
         Args:
@@ -187,75 +344,235 @@ class Streamer(BaseStreamer):
                 timestamps at the time of chunk retrieval, only using
                 nominal sample rate as need to determine timestamps within
                 chunks.
+            fill_missing (bool): Keep indexed streams uniformly sampled.
+                If `True`, chunks skipped by the device's chunk indices are
+                pushed as NaN-filled chunks with their nominal timestamps,
+                and duplicate or out-of-order chunks are dropped. If `False`
+                (default), missing chunks are only reported.
+            pool (ble2lsl.workers.DecoderPool): Worker processes in which to
+                decode packets and push chunks. By default, packets are
+                decoded on the BLE notification thread and pushed from a
+                transmit thread of this process. With a pool, `sinks` and
+                `processors` must be picklable, and are opened in a worker.
+            tracer (ble2lsl.tracing.Tracer): Records the latency of each
+                chunk from packet arrival to push, if given. Not supported
+                with a `pool`.
+            adapt_interval (bool): Whether to adapt the BLE connection
+                interval to the rate of missing chunks, within the device's
+                `interval_limits` (see `ble2lsl.interval`). Only supported
+                by the `'bgapi'` backend, and not with a `pool`.
+            adapt_period (float): Seconds over which to count missing chunks
+                between adaptations of the connection interval.
+            adapters (ble2lsl.adapters.AdapterPool): BLE adapters shared with
+                other streamers, to the least loaded of which the device is
+                assigned on connection. Overrides `backend` and `interface`.
+            transmit_groups (Iterable[Iterable[str]]): Groups of streams to
+                push from separate transmit threads, in decreasing order of
+                priority; e.g. `[['EEG']]` to isolate EEG, or one group per
+                stream. Each group has its own queue, so that slow or flooded
+                streams do not delay the others; streams in no group share a
+                last queue. Before each push, a thread waits (for up to
+                `PRIORITY_TIMEOUT`) until the groups of higher priority have
+                pushed all their enqueued chunks. By default, all streams
+                share one queue. Not supported with a `pool`.
         """
+        if adapters is not None:
+            backend = adapters.backend
+        if pool is not None and tracer is not None:
+            raise ValueError("Tracing is not supported with a DecoderPool")
+        if pool is not None and transmit_groups is not None:
+            raise ValueError("Transmit groups are not supported with a "
+                             "DecoderPool")
+        if adapt_interval and (pool is not None or backend != 'bgapi'):
+            raise ValueError("Adapting the connection interval requires the "
+                             "bgapi backend, without a DecoderPool")
         BaseStreamer.__init__(self, device=device, **kwargs)
-        self._transmit_queue = Queue()
+        self._init_transmit(internal_timestamps, fill_missing, tracer,
+                            transmit_groups)
         self._ble_params = self._device.PARAMS["ble"]
         self._address = address
-
-        # use internal timestamps if requested, or if stream is variable rate
-        # (LSL uses nominal_srate=0.0 for variable rates)
-        nominal_srates = self._stream_params["nominal_srate"]
-        self._internal_timestamps = {name: (internal_timestamps
-                                            if nominal_srates[name] else True)
-                                     for name in device.STREAMS}
-        self._start_time = stream_idxs_zeros(self._subscriptions)
-        self._first_chunk_idxs = stream_idxs_zeros(self._subscriptions)
-
-        # initialize gatt adapter
-        if backend == 'bgapi':
-            self._adapter = pygatt.BGAPIBackend(serial_port=interface)
-        elif backend in ['gatt', 'bluez']:
-            # only works on Linux
-            interface = self.interface or 'hci0'
-            self._adapter = pygatt.GATTToolBackend(interface)
+        self._pool = pool
+        self._ble_device = None
+        self._packet_handler = None
+        self._connection_interval = (self._ble_params["interval_min"],
+                                     self._ble_params["interval_max"])
+        if adapt_interval:
+            self._interval_controller = IntervalController.for_device(device)
         else:
-            raise(ValueError("Invalid backend specified; use bgapi or gatt."))
+            self._interval_controller = None
+        self._adapt_period = adapt_period
+        self._adapt_stop = threading.Event()
+
+        # initialize gatt adapter, or assign one from the pool on connection
+        self._adapters = adapters
+        if adapters is None:
+            self._adapter = make_adapter(backend, interface)
+            self._adapter_lock = threading.RLock()
+        else:
+            self._adapter = None
         self._backend = backend
+        self._interface = interface
         self._scan_timeout = scan_timeout
 
-        self._transmit_thread = threading.Thread(target=self._transmit_chunks)
+        # threads are created by each call to `start`
+        self._transmit_threads = []
+        self._adapt_thread = None
 
         if autostart:
             self.connect()
             self.start()
 
+    def _init_transmit(self, internal_timestamps, fill_missing, tracer=None,
+                       transmit_groups=None):
+        """Initialize the state used to timestamp and push enqueued chunks."""
+        self._init_transmit_queues(transmit_groups or [])
+        # chunks recycled from the transmit thread to the packet handler
+        self._chunk_pool = ChunkPool()
+        self._tracer = tracer
+
+        # use internal timestamps if requested, or if stream is variable rate
+        # (LSL uses nominal_srate=0.0 for variable rates)
+        nominal_srates = self._stream_params["nominal_srate"]
+        self._internal_timestamps = {name: (internal_timestamps
+                                            if nominal_srates[name] else True)
+                                     for name in self._device.STREAMS}
+        self._fill_missing = fill_missing
+        self._start_time = {}
+        self._first_chunk_idxs = {}
+        self._n_missing = {}
+        self._n_dropped = {}
+        self._chunk_period = {}
+        for name in self._subscriptions:
+            self._init_stream_transmit(name)
+        # held while pushing a chunk, so its stream is not closed mid-push
+        self._transmit_locks = {name: threading.Lock()
+                                for name in self._device.STREAMS}
+
+    def _init_transmit_queues(self, transmit_groups):
+        """Assign each stream the transmit queue of its group.
+
+        Queues are listed in decreasing order of priority; the last (also
+        `_transmit_queue`) is shared by the streams in no group.
+        """
+        self._transmit_queue = Queue()
+        self._group_queues = [Queue() for _ in transmit_groups]
+        # notified when a queue with lower-priority queues is done
+        self._transmit_done = threading.Condition()
+        self._group_queues.append(self._transmit_queue)
+        self._transmit_queues = dict.fromkeys(self._device.STREAMS,
+                                              self._transmit_queue)
+        for group, queue in zip(transmit_groups, self._group_queues):
+            for name in group:
+                if name not in self._device.STREAMS:
+                    raise ValueError("No {} stream for device {}"
+                                     .format(name, self._device.NAME))
+                if self._transmit_queues[name] is not self._transmit_queue:
+                    raise ValueError("Stream {} is in more than one transmit "
+                                     "group".format(name))
+                self._transmit_queues[name] = queue
+
+    def _init_stream_transmit(self, name):
+        """Initialize the timestamping state of a subscribed stream."""
+        self._start_time[name] = 0
+        self._first_chunk_idxs[name] = None
+        self._n_missing[name] = 0
+        self._n_dropped[name] = 0
+        # nominal duration of chunks for progressing non-internal timestamps
+        # and for timestamping missing chunks
+        nominal_srate = self._stream_params["nominal_srate"][name]
+        if nominal_srate:
+            self._chunk_period[name] = (self._stream_params["chunk_size"][name]
+                                        / nominal_srate)
+
     def _init_timestamp(self, name, chunk_idx):
         """Set the starting timestamp and chunk index for a subscription."""
         self._first_chunk_idxs[name] = chunk_idx
         self._start_time[name] = self._time_func()
 
     def start(self):
-        """Start streaming by writing to the send characteristic."""
-        self._transmit_thread.start()
-        self._ble_device.char_write(self._ble_params['send'],
-                                    value=self._ble_params['stream_on'],
-                                    wait_for_response=False)
+        """Start streaming by writing to the send characteristic.
 
-    def stop(self):
-        """Stop streaming by writing to the send characteristic."""
-        self._ble_device.char_write(self._ble_params["send"],
-                                    value=self._ble_params["stream_off"],
-                                    wait_for_response=False)
+        May be called again after `stop`, or after `disconnect` and
+        `connect`. Timestamps restart from the first chunk received.
+        """
+        if self._pool is None and not any(map(self._is_alive,
+                                              self._transmit_threads)):
+            # chunks received while stopped are not pushed
+            self._discard_queued()
+            for name in self._subscriptions:
+                self._first_chunk_idxs[name] = None
+            self._start_transmit()
+        if (self._interval_controller is not None
+                and not self._is_alive(self._adapt_thread)):
+            self._adapt_stop.clear()
+            self._adapt_thread = threading.Thread(target=self._adapt_interval,
+                                                  daemon=True)
+            self._adapt_thread.start()
+        self.send_command(self._ble_params['stream_on'])
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stop streaming by writing to the send characteristic.
+
+        Pushes the chunks already received (including any partly assembled),
+        and stops the streamer's threads. The sinks remain open, for streaming
+        to resume with `start`.
+
+        Args:
+            timeout (float): Maximum seconds to wait for each thread to stop.
+        """
+        # no connection updates after streaming stops
+        self._adapt_stop.set()
+        self._join(self._adapt_thread, timeout)
+        self.send_command(self._ble_params["stream_off"])
+        if self._packet_handler is not None:
+            self._packet_handler.flush()
+        self._stop_transmit()
+        for thread in self._transmit_threads:
+            self._join(thread, timeout)
+
+    def close(self):
+        """Stop streaming, disconnect, and release the threads and sinks."""
+        if self._ble_device is not None:
+            self.disconnect()
+
+    def chunks(self, streams=None, max_chunks=DEFAULT_MAX_CHUNKS):
+        """Yield the chunks pushed by the streamer, on the running loop.
+
+        See `BaseStreamer.chunks`. Not supported with a `pool`.
+        """
+        if self._pool is not None:
+            raise ValueError("Chunks are pushed in a worker process with a "
+                             "DecoderPool")
+        return BaseStreamer.chunks(self, streams, max_chunks)
 
     def send_command(self, value):
         """Write some value to the send characteristic."""
-        self._ble_device.char_write(self._ble_params["send"],
-                                    value=value,
-                                    wait_for_response=False)
+        with self._command_lock:
+            self._ble_device.char_write(self._ble_params["send"],
+                                        value=value,
+                                        wait_for_response=False)
 
     def disconnect(self):
         """Disconnect from the BLE device and stop the adapter.
 
-        Note:
-            After disconnection, `start` will not resume streaming.
-
-        TODO:
-            * enable device reconnect with `connect`
+        Stops streaming (see `stop`), and closes the sinks. To resume
+        streaming, `connect` and `start` again.
         """
         self.stop()  # stream_off command
-        self._ble_device.disconnect()  # BLE disconnect
-        self._adapter.stop()
+        with self._command_lock:
+            self._ble_device.disconnect()  # BLE disconnect
+        self._ble_device = None
+        self._packet_handler = None
+        if self._adapters is None:
+            self._adapter.stop()
+            # a stopped backend may hold part of a packet; reconnect afresh
+            self._adapter = make_adapter(self._backend, self._interface)
+        else:
+            self._adapters.release(self)
+        if self._pool is None:
+            self._close_sinks()
+        else:
+            self._pool.unregister(self)
 
     def connect(self, max_attempts=20):
         """Establish connection to BLE device (prior to `start`).
@@ -264,41 +581,33 @@ class Streamer(BaseStreamer):
         connects to the device, and subscribes to the channels specified in the
         device parameters.
         """
-        for _ in range(max_attempts):
-            try:
-                self._adapter.start()
-                break
-            except pygatt.exceptions.NotConnectedError as notconnected_error:
-                # dongle not connected
-                continue
-            except (ExpectedResponseTimeout, StructError):
-                continue
-            except OSError as os_error:
-                if os_error.errno == 6:
-                    # "device not configured"
-                    print(os_error)
-                    continue
-                else:
-                    raise os_error
-            except serial.serialutil.SerialException as serial_exception:
-                # NOTE: some of these may be raised (apparently harmlessly) by
-                # the self._adapter._receiver thread, which can't be captured
-                # here; maybe there is a way to prevent writing to stdout though
-                if serial_exception.errno == 6:
-                    # "couldn't open port"
-                    print(serial_exception)
-                    continue
-                else:
-                    raise serial_exception
-            except pygatt.backends.bgapi.exceptions.BGAPIError as bgapi_error:
-                # adapter not connected?
-                continue
-            time.sleep(0.1)
-
+        if self._adapters is None:
+            start_adapter(self._adapter, max_attempts)
+            adapter_lock = self._adapter_lock
+        else:
+            self._adapter, adapter_lock = self._adapters.acquire(
+                self, max_attempts)
+        # also held for each write to the device, and each command to the
+        # adapter until its response, which another thread could otherwise
+        # take from the adapter's shared receive queue
+        self._command_lock = adapter_lock
+        try:
+            # one device at a time connects through each adapter
+            with adapter_lock:
+                self._connect_device()
+        except Exception:
+            if self._adapters is not None:
+                self._adapters.release(self)
+            raise
+
+    def _connect_device(self):
+        """Connect to the device and subscribe, through a started adapter."""
         if self._address is None:
             # get the device address if none was provided
             self._device_id, self._address = \
                 self._resolve_address(self._device.NAME)
+        else:
+            self._device_id = "{}-{}".format(self._device.NAME, self._address)
         try:
             self._ble_device = self._adapter.connect(self._address,
                 address_type=self._ble_params['address_type'],
@@ -310,21 +619,146 @@ class Streamer(BaseStreamer):
                 .format(self._address)
             raise(IOError(e_msg))
 
-        # initialize LSL outlets and packet handler
-        self._init_lsl_outlets()
-        self._packet_handler = self._device.PacketHandler(self)
+        # initialize sinks and packet handler, here or in a worker process
+        if self._pool is None:
+            self._init_sinks()
+            self._packet_handler = self._device.PacketHandler(self)
+            if self._tracer is None:
+                self._process_packet = self._packet_handler.process_packet
+            else:
+                self._process_packet = self._packet_handler.trace_packet
+        else:
+            self._process_packet = self._pool.register(self)
+        if self._adapters is not None:
+            self._process_packet = self._adapters.count_notifications(
+                self, self._process_packet)
 
         # subscribe to receive characteristic notifications
-        process_packet = self._packet_handler.process_packet
-        for name in self._subscriptions:
+        for uuid in self._stream_uuids(self._subscriptions):
+            self._ble_device.subscribe(uuid, callback=self._process_packet)
+
+    def set_connection_interval(self, interval_min, interval_max):
+        """Request a new BLE connection interval range from the device.
+
+        Only supported by the `'bgapi'` backend.
+
+        Args:
+            interval_min (int): Minimum interval, in units of 1.25 ms.
+            interval_max (int): Maximum interval, in units of 1.25 ms.
+        """
+        if self._backend != 'bgapi':
+            raise NotImplementedError("Connection update only supported by "
+                                      "the bgapi backend")
+        with self._command_lock:
+            self._adapter.send_command(
+                BGAPICommandPacketBuilder.connection_update(
+                    self._ble_device._handle, interval_min, interval_max, 0,
+                    SUPERVISION_TIMEOUT))
+            self._adapter.expect(ResponsePacketType.connection_update)
+        self._connection_interval = (interval_min, interval_max)
+
+    def _adapt_interval(self):
+        """Run in thread to adapt the connection interval to chunk loss."""
+        last_idxs, last_missing = {}, {}
+        while not self._adapt_stop.wait(self._adapt_period):
+            idxs, missing = dict(self._chunk_idxs), dict(self._n_missing)
+            # chunk indices progress by both received and missing chunks
+            progress = {name: idxs[name] - last_idxs[name] for name in missing
+                        if name in last_idxs and name in idxs}
+            window_missing = {name: max(0, missing[name]
+                                        - last_missing.get(name, 0))
+                              for name in progress}
+            last_idxs, last_missing = idxs, missing
+            interval_range, loss = self._interval_controller.update(
+                progress, window_missing)
+            if interval_range is None:
+                continue
+            print("{:.1%} of chunks missing; requesting connection interval "
+                  "{:g}-{:g} ms".format(loss,
+                                        *(INTERVAL_MS * interval
+                                          for interval in interval_range)))
+            try:
+                self.set_connection_interval(*interval_range)
+            except ExpectedResponseTimeout as timeout_error:
+                warn("Connection update failed: {}".format(timeout_error))
+
+    def subscribe(self, name):
+        """Start streaming another of the device's streams.
+
+        May be called while connected and streaming, without interrupting
+        the other streams: opens the stream in the sinks, allocates its
+        buffers, and enables notifications of its BLE characteristics.
+
+        Args:
+            name (str): The name of the stream, in the device's `STREAMS`.
+        """
+        self._check_subscribable(name)
+        if name in self._subscriptions:
+            return
+        self._chunk_idxs[name] = 0
+        self._chunks.update(empty_chunks(self._stream_params, [name],
+                                         raw=self._raw))
+        self._init_stream_transmit(name)
+        if self._ble_device is None:
+            self._subscriptions += (name,)
+            return
+        with self._transmit_locks[name]:
+            self._open_stream(name, self._stream_info(name))
+        new_uuids = [uuid for uuid in self._stream_uuids([name])
+                     if uuid not in self._stream_uuids(self._subscriptions)]
+        self._packet_handler.add_stream(name)
+        self._subscriptions += (name,)
+        with self._command_lock:
+            for uuid in new_uuids:
+                _set_notifications(self._ble_device, uuid,
+                                   self._process_packet)
+
+    def unsubscribe(self, name):
+        """Stop streaming one of the subscribed streams.
+
+        May be called while connected and streaming, without interrupting
+        the other streams: disables notifications of BLE characteristics no
+        longer needed, and closes the stream in the sinks. Chunks of the
+        stream still awaiting transmission are discarded.
+
+        Args:
+            name (str): The name of the stream.
+        """
+        self._check_subscribable(name)
+        if name not in self._subscriptions:
+            return
+        self._subscriptions = tuple(other for other in self._subscriptions
+                                    if other != name)
+        if self._ble_device is None:
+            return
+        remaining_uuids = self._stream_uuids(self._subscriptions)
+        with self._command_lock:
+            for uuid in self._stream_uuids([name]):
+                if uuid not in remaining_uuids:
+                    _set_notifications(self._ble_device, uuid, None)
+        self._packet_handler.remove_stream(name)
+        with self._transmit_locks[name]:
+            self._close_stream(name)
+
+    def _check_subscribable(self, name):
+        if name not in self._device.STREAMS:
+            raise ValueError("No {} stream for device {}"
+                             .format(name, self._device.NAME))
+        if self._pool is not None:
+            raise ValueError("Cannot change subscriptions while decoding "
+                             "in a DecoderPool")
+
+    def _stream_uuids(self, names):
+        """Return the UUIDs of the characteristics providing some streams."""
+        uuids = []
+        for name in names:
             try:
-                uuids = [self._ble_params[name] + '']
+                stream_uuids = [self._ble_params[name] + '']
             except TypeError:
-                uuids = self._ble_params[name]
-            for uuid in uuids:
-                if uuid:
-                    self._ble_device.subscribe(uuid, callback=process_packet)
-            # subscribe to recieve simblee command from ganglion doc
+                stream_uuids = self._ble_params[name]
+            uuids.extend(uuid for uuid in stream_uuids
+                         if uuid and uuid not in uuids)
+        return uuids
 
     def _resolve_address(self, name):
         list_devices = self._adapter.scan(timeout=self._scan_timeout)
@@ -333,40 +767,166 @@ class Streamer(BaseStreamer):
                 return device['name'], device['address']
         raise(ValueError("No devices found with name `{}`".format(name)))
 
-    def _transmit_chunks(self):
-        """TODO: missing chunk vs. missing sample"""
-        # nominal duration of chunks for progressing non-internal timestamps
-        chunk_period = {name: (self._stream_params["chunk_size"][name]
-                               / self._stream_params["nominal_srate"][name])
-                        for name in self._subscriptions
-                        if not self._internal_timestamps[name]}
-        first_idx = self._first_chunk_idxs
+    def _start_transmit(self):
+        """Start a transmit thread for each queue."""
+        n_queues = len(self._group_queues)
+        self._transmit_threads = [
+            threading.Thread(target=self._transmit_chunks,
+                             args=(queue, self._group_queues[:idx],
+                                   idx < n_queues - 1),
+                             daemon=True)
+            for idx, queue in enumerate(self._group_queues)]
+        for thread in self._transmit_threads:
+            thread.start()
+
+    def _stop_transmit(self):
+        """Stop the transmit threads after the chunks already enqueued."""
+        for queue, thread in zip(self._group_queues, self._transmit_threads):
+            if thread.is_alive():
+                queue.put(_STOP)
+
+    def _transmit_chunks(self, queue, higher_queues=(), notify=False):
+        """Run in thread to push the chunks enqueued in `queue`.
+
+        Before each push, waits (for up to `PRIORITY_TIMEOUT`) until the
+        chunks put in `higher_queues` have all been pushed. Chunks count as
+        unfinished from when they are enqueued until their push returns.
+
+        Args:
+            queue (Queue): The queue of chunks to push.
+            higher_queues (List[Queue]): The queues of higher priority.
+            notify (bool): Whether threads of lower priority wait on `queue`.
+        """
+        def higher_done():
+            return not any(higher.unfinished_tasks for higher in higher_queues)
+
         while True:
-            name, chunk_idx, chunk = self._transmit_queue.get()
-            self._chunks[name][:, :] = chunk
-
-            # update chunk index records and report missing chunks
-            # passing chunk_idx=-1 to the queue averts this (ex. status stream)
-            if not chunk_idx == -1:
-                if self._chunk_idxs[name] == 0:
-                    self._init_timestamp(name, chunk_idx)
-                    self._chunk_idxs[name] = chunk_idx - 1
-                if not chunk_idx == self._chunk_idxs[name] + 1:
+            item = queue.get()
+            if item is _STOP:
+                queue.task_done()
+                break
+            if higher_queues:
+                with self._transmit_done:
+                    self._transmit_done.wait_for(higher_done,
+                                                 PRIORITY_TIMEOUT)
+            self._transmit_item(item)
+            queue.task_done()
+            if notify and not queue.unfinished_tasks:
+                with self._transmit_done:
+                    self._transmit_done.notify_all()
+
+    def _discard_queued(self):
+        """Discard the chunks awaiting transmission, recycling them."""
+        for queue in self._group_queues:
+            while not queue.empty():
+                item = queue.get_nowait()
+                queue.task_done()
+                if item is not _STOP:
+                    self._chunk_pool.give(item[0], item[2])
+
+    @staticmethod
+    def _is_alive(thread):
+        return thread is not None and thread.is_alive()
+
+    @staticmethod
+    def _join(thread, timeout):
+        """Wait for a thread (if any) to stop, warning on timeout."""
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                warn("Streamer thread did not stop within {} s"
+                     .format(timeout))
+
+    def _transmit_item(self, item):
+        """Push a dequeued chunk (stamping it, if tracing), and recycle it."""
+        if self._tracer is None:
+            name, chunk_idx, chunk = item
+            with self._transmit_locks[name]:
+                self._transmit_chunk(name, chunk_idx, chunk)
+        else:
+            dequeued = self._tracer.clock()
+            name, chunk_idx, chunk, (arrival, decoded) = item
+            with self._transmit_locks[name]:
+                self._transmit_chunk(name, chunk_idx, chunk)
+            self._tracer.record(self._device_id, name, chunk_idx, arrival,
+                                decoded, dequeued, self._tracer.clock())
+        self._chunk_pool.give(name, chunk)
+
+    def _transmit_chunk(self, name, chunk_idx, chunk):
+        """Timestamp and push a single dequeued chunk.
+
+        TODO:
+            * missing chunk vs. missing sample
+        """
+        if name not in self._sink_routes:
+            # unsubscribed since enqueued
+            return
+        # update chunk index records and report missing chunks
+        # passing chunk_idx=-1 to the queue averts this (ex. status stream)
+        if not chunk_idx == -1:
+            if self._first_chunk_idxs[name] is None:
+                self._init_timestamp(name, chunk_idx)
+                self._chunk_idxs[name] = chunk_idx - 1
+            n_missing = chunk_idx - self._chunk_idxs[name] - 1
+            if n_missing < 0 and self._fill_missing:
+                # duplicate or out-of-order chunk
+                self._n_dropped[name] += 1
+                return
+            if n_missing:
+                if n_missing > 0:
+                    self._n_missing[name] += n_missing
+                if self._fill_missing:
+                    self._push_missing(name, chunk_idx, n_missing)
+                else:
                     print("Missing {} chunk {}: {}"
                           .format(name, chunk_idx, self._chunk_idxs[name]))
-                self._chunk_idxs[name] = chunk_idx
-            else:
-                # track number of received chunks for non-indexed streams
-                self._chunk_idxs[name] += 1
+            self._chunk_idxs[name] = chunk_idx
+        else:
+            # track number of received chunks for non-indexed streams
+            self._chunk_idxs[name] += 1
 
-            # generate timestamp; either internally or
-            if self._internal_timestamps[name]:
-                timestamp = self._time_func()
-            else:
-                timestamp = chunk_period[name] * (chunk_idx - first_idx[name])
-                timestamp += self._start_time[name]
+        self._chunks[name][:, :] = chunk
+        self._push_chunk(name, self._get_timestamp(name, chunk_idx))
+
+    def _get_timestamp(self, name, chunk_idx):
+        """Generate a chunk timestamp; either internally or from its index."""
+        if self._internal_timestamps[name]:
+            return self._time_func()
+        timestamp = (self._chunk_period[name]
+                     * (chunk_idx - self._first_chunk_idxs[name]))
+        return timestamp + self._start_time[name]
+
+    def _push_missing(self, name, chunk_idx, n_missing):
+        """Push chunks of missing values in place of those preceding
+        `chunk_idx`.
 
-            self._push_func[name](name, timestamp)
+        Missing values are NaN, or the minimum integer for raw streams.
+        """
+        if not np.issubdtype(self._chunks[name].dtype, np.number):
+            return
+        self._chunks[name][:, :] = missing_value(self._chunks[name].dtype)
+        timestamp = self._get_timestamp(name, chunk_idx)
+        for i in range(n_missing, 0, -1):
+            missing_timestamp = timestamp - i * self._chunk_period[name]
+            self._push_chunk(name, missing_timestamp)
+
+    @property
+    def missing_chunks(self):
+        """Number of chunks skipped by the device, per indexed stream.
+
+        When decoding in a `pool`, updated on disconnection.
+        """
+        return dict(self._n_missing)
+
+    @property
+    def dropped_chunks(self):
+        """Number of duplicate or out-of-order chunks dropped, per stream."""
+        return dict(self._n_dropped)
+
+    @property
+    def connection_interval(self):
+        """The last requested connection interval range, in 1.25 ms units."""
+        return self._connection_interval
 
     @property
     def backend(self):
@@ -387,13 +947,16 @@ class Dummy(BaseStreamer):
     """
 
     def __init__(self, device, chunk_iterator=None, subscriptions=None,
-                 autostart=True, **kwargs):
+                 autostart=True, device_id=None, **kwargs):
         """Construct a `Dummy` instance.
 
         Args:
             device: BLE device to impersonate (i.e. from `ble2lsl.devices`).
             chunk_iterator (generator): Class that iterates through chunks.
             autostart (bool): Whether to start streaming on instantiation.
+            device_id (str): Source ID of the streams. By default,
+                `'<NAME>-DUMMY'`; give unique IDs to run several dummies of
+                the same device at once.
         """
         nominal_srate = device.PARAMS["streams"]["nominal_srate"]
         if subscriptions is None:
@@ -404,13 +967,15 @@ class Dummy(BaseStreamer):
         BaseStreamer.__init__(self, device=device, subscriptions=subscriptions,
                               **kwargs)
 
-        self._device_id = "{}-DUMMY".format(device.NAME)
+        if device_id is None:
+            device_id = "{}-DUMMY".format(device.NAME)
+        self._device_id = device_id
         self._address = "DUMMY"
-        self._init_lsl_outlets()
+        self._init_sinks()
 
         chunk_shapes = {name: self._chunks[name].shape
                         for name in self._subscriptions}
-        self._delays = {name: 1 / (nominal_srate[name] / chunk_shapes[name][1])
+        self._delays = {name: chunk_shapes[name][0] / nominal_srate[name]
                         for name in self._subscriptions}
 
         # generate or load fake data
@@ -420,44 +985,73 @@ class Dummy(BaseStreamer):
                                                  nominal_srate[name])
                             for name in self._subscriptions}
 
-        # threads to mimic incoming BLE data
-        self._threads = {name: threading.Thread(target=self._stream,
-                                                kwargs=dict(name=name))
-                         for name in self._subscriptions}
+        # threads to mimic incoming BLE data, created by each `start`
+        self._stop_event = threading.Event()
+        self._threads = {}
         if autostart:
             self.start()
 
     def start(self):
-        """Start pushing data into the LSL outlet."""
-        self._proceed = True
-        for name in self._subscriptions:
-            self._threads[name].start()
+        """Start pushing data into the LSL outlet.
 
-    def stop(self):
-        """Stop pushing data. Ends execution of chunk streaming threads.
+        May be called again after `stop`, or after `close`, reopening the
+        sinks.
+        """
+        if any(thread.is_alive() for thread in self._threads.values()):
+            return
+        if not self._sink_routes:
+            self._init_sinks()
+        self._stop_event.clear()
+        self._threads = {name: threading.Thread(target=self._stream,
+                                                args=(name,), daemon=True)
+                         for name in self._subscriptions}
+        for thread in self._threads.values():
+            thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stop pushing data, ending the chunk streaming threads.
+
+        The sinks remain open, for streaming to resume with `start`.
 
-        Restart requires a new `Dummy` instance.
+        Args:
+            timeout (float): Maximum seconds to wait for each thread to stop.
         """
-        self._proceed = False
+        self._stop_event.set()
+        for thread in self._threads.values():
+            if thread.is_alive():
+                thread.join(timeout)
+                if thread.is_alive():
+                    warn("Dummy thread did not stop within {} s"
+                         .format(timeout))
+
+    def close(self):
+        """Stop pushing data, and release the threads and sinks."""
+        self.stop()
+        self._close_sinks()
 
     def _stream(self, name):
         """Run in thread to mimic periodic hardware input."""
+        next_time = time.monotonic()
         for chunk in self._chunk_iter[name]:
-            if not self._proceed:
+            if self._stop_event.is_set():
                 # dummy has received stop signal
                 break
 
-            self._chunks[name] = chunk
+            if name in self._raw:
+                self._chunks[name][:, :] = np.round(
+                    chunk / self._stream_params["raw_scale"][name]
+                    + self._stream_params["raw_offset"][name])
+            else:
+                self._chunks[name] = chunk
             timestamp = time.time()
-            self._push_func[name](name, timestamp)
+            self._push_chunk(name, timestamp)
 
-            delay = self._delays[name]
-            # some threads may have long delays;
-            # subdivide these so threads can stop within ~1 s
-            while delay > 1 and self._proceed:
-                time.sleep(1)
-                delay -= 1
-            time.sleep(delay % 1)
+            # wait until the next chunk is due, so that pushing time does not
+            # accumulate; or until stopped
+            next_time += self._delays[name]
+            delay = next_time - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
 
     def make_chunk(self, chunk_ind):
         """Prepare a chunk from the totality of local data.
@@ -477,11 +1071,16 @@ def stream_idxs_zeros(subscriptions):
     return idxs
 
 
-def empty_chunks(stream_params, subscriptions):
-    """Initialize an empty chunk array for each subscription."""
+def empty_chunks(stream_params, subscriptions, raw=()):
+    """Initialize an empty chunk array for each subscription.
+
+    Streams named in `raw` are given their integer `raw_channel_format`.
+    """
     chunks = {name: np.zeros((stream_params["chunk_size"][name],
                               stream_params["channel_count"][name]),
-                             dtype=stream_params["numpy_dtype"][name])
+                             dtype=(stream_params["raw_channel_format"][name]
+                                    if name in raw
+                                    else stream_params["numpy_dtype"][name]))
               for name in subscriptions}
     return chunks
 
@@ -498,6 +1097,85 @@ def get_default_subscriptions(device, pos_rate=False):
     return subscriptions
 
 
+def make_adapter(backend='bgapi', interface=None):
+    """Construct a `pygatt` backend for a BLE adapter.
+
+    Args:
+        backend (str): Which `pygatt` backend to use; `'bgapi'` or `'gatt'`.
+        interface (str): The serial port of a BGAPI adapter, or the HCI
+            interface for the `'gatt'` backend (by default, `'hci0'`).
+    """
+    if backend == 'bgapi':
+        return pygatt.BGAPIBackend(serial_port=interface)
+    elif backend in ['gatt', 'bluez']:
+        # only works on Linux
+        return pygatt.GATTToolBackend(interface or 'hci0')
+    raise(ValueError("Invalid backend specified; use bgapi or gatt."))
+
+
+def start_adapter(adapter, max_attempts=20):
+    """Start a `pygatt` backend, retrying while the adapter is unavailable."""
+    for _ in range(max_attempts):
+        try:
+            adapter.start()
+            break
+        except pygatt.exceptions.NotConnectedError as notconnected_error:
+            # dongle not connected
+            continue
+        except (ExpectedResponseTimeout, StructError):
+            continue
+        except OSError as os_error:
+            if os_error.errno == 6:
+                # "device not configured"
+                print(os_error)
+                continue
+            else:
+                raise os_error
+        except serial.serialutil.SerialException as serial_exception:
+            # NOTE: some of these may be raised (apparently harmlessly) by
+            # the adapter._receiver thread, which can't be captured
+            # here; maybe there is a way to prevent writing to stdout though
+            if serial_exception.errno == 6:
+                # "couldn't open port"
+                print(serial_exception)
+                continue
+            else:
+                raise serial_exception
+        except pygatt.backends.bgapi.exceptions.BGAPIError as bgapi_error:
+            # adapter not connected?
+            continue
+        time.sleep(0.1)
+
+
+def _set_notifications(ble_device, uuid, callback):
+    """Enable or disable notifications of a characteristic while streaming.
+
+    `pygatt` holds its device lock while writing the characteristic's client
+    configuration descriptor, and acquires the lock to dispatch each
+    notification; so with the BGAPI backend, a notification received during
+    the write blocks the acknowledgement of the write, until timeout. Instead,
+    the descriptor is written here without the lock, and `pygatt` then
+    (un)registers the callback without writing again.
+
+    Args:
+        ble_device (pygatt.BLEDevice): The connected device.
+        uuid (str): The UUID of the characteristic.
+        callback (function): Called with each notification. If `None`,
+            notifications are disabled.
+    """
+    value_handle, config_handle = ble_device._notification_handles(uuid)
+    properties = bytearray([0x0 if callback is None else 0x1, 0x0])
+    ble_device.char_write_handle(config_handle, properties,
+                                 wait_for_response=True)
+    if callback is None:
+        ble_device._subscribed_handlers.pop(value_handle, None)
+        ble_device.unsubscribe(uuid)
+    else:
+        ble_device._subscribed_handlers[value_handle] = properties
+        ble_device._subscribed_uuids[uuid] = False
+        ble_device.subscribe(uuid, callback=callback)
+
+
 class ChunkIterator:
     """Generator object (i.e. iterator) that yields chunks.
 
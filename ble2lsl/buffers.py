@@ -0,0 +1,137 @@
+"""Preallocated buffers for stream samples and chunks.
+
+`RingBuffer` keeps the most recent samples (and their timestamps) of a stream
+in fixed arrays, which may be provided by the caller, e.g. to place them in
+shared memory. Each sample is written twice, to mirrored halves of the
+arrays, so that the latest samples can always be returned as contiguous
+views, without copying.
+
+`ChunkPool` recycles the chunk arrays passed from a packet handler to the
+transmit thread of a `Streamer`, so that chunks are not allocated once
+streaming steadily.
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+class RingBuffer:
+    """Mirrored ring buffer of samples and timestamps.
+
+    There should be a single writer. Readers obtain views into the buffer,
+    which remain valid until the writer has written another
+    `capacity - n_samples` samples.
+    """
+
+    def __init__(self, capacity, channel_count, dtype='float32', data=None,
+                 timestamps=None, cursor=None):
+        """Construct a `RingBuffer` instance.
+
+        Args:
+            capacity (int): Maximum number of recent samples available.
+            channel_count (int): Number of channels in each sample.
+            dtype (str or numpy.dtype): Datatype of the samples.
+            data (numpy.ndarray): Storage for samples.
+                Shape `(2 * capacity, channel_count)`; allocated by default.
+            timestamps (numpy.ndarray): Storage for timestamps.
+                Shape `(2 * capacity,)`; allocated by default.
+            cursor (numpy.ndarray): Storage for the total number of samples
+                written. Shape `(1,)`; allocated by default.
+        """
+        self._capacity = capacity
+        if data is None:
+            data = np.zeros((2 * capacity, channel_count), dtype=dtype)
+        if timestamps is None:
+            timestamps = np.zeros(2 * capacity, dtype=np.float64)
+        if cursor is None:
+            cursor = np.zeros(1, dtype=np.uint64)
+        self._data = data
+        self._timestamps = timestamps
+        self._cursor = cursor
+
+    def write(self, samples, timestamps):
+        """Append samples and their timestamps to the buffer.
+
+        Args:
+            samples (numpy.ndarray): Shape `(n_samples, channel_count)`.
+            timestamps (numpy.ndarray): One timestamp per sample.
+        """
+        n_samples = samples.shape[0]
+        if n_samples > self._capacity:
+            samples = samples[-self._capacity:]
+            timestamps = timestamps[-self._capacity:]
+            self._cursor[0] += n_samples - self._capacity
+            n_samples = self._capacity
+        capacity = self._capacity
+        pos = int(self._cursor[0]) % capacity
+        n_first = min(n_samples, capacity - pos)
+        n_rest = n_samples - n_first
+        for start in (pos, pos + capacity):
+            self._data[start:start + n_first] = samples[:n_first]
+            self._timestamps[start:start + n_first] = timestamps[:n_first]
+        for start in (0, capacity):
+            self._data[start:start + n_rest] = samples[n_first:]
+            self._timestamps[start:start + n_rest] = timestamps[n_first:]
+        # publish the samples only once they are written
+        self._cursor[0] += n_samples
+
+    def latest(self, n_samples=None):
+        """Return views of the most recent samples and their timestamps.
+
+        Args:
+            n_samples (int): Number of samples to return. By default (or if
+                more are requested than available) all available samples are
+                returned.
+
+        Returns:
+            numpy.ndarray: Samples, with shape `(n, channel_count)`.
+            numpy.ndarray: Timestamps, with shape `(n,)`.
+        """
+        n_written = int(self._cursor[0])
+        n_available = min(n_written, self._capacity)
+        if n_samples is None or n_samples > n_available:
+            n_samples = n_available
+        end = n_written % self._capacity + self._capacity
+        return (self._data[end - n_samples:end],
+                self._timestamps[end - n_samples:end])
+
+    @property
+    def capacity(self):
+        """Maximum number of recent samples available."""
+        return self._capacity
+
+    @property
+    def n_written(self):
+        """Total number of samples written to the buffer."""
+        return int(self._cursor[0])
+
+
+class ChunkPool:
+    """Free chunk arrays, per stream, for reuse between threads.
+
+    Chunks are taken (by the packet handler) and given back (by the transmit
+    thread, once pushed) from different threads; a `deque` is used for each
+    stream, as its `append` and `pop` are atomic.
+    """
+
+    def __init__(self):
+        self._free = {}
+
+    def take(self, name, like):
+        """Return a free chunk of a stream, or a new one shaped `like`."""
+        try:
+            return self._free[name].pop()
+        except (KeyError, IndexError):
+            return np.empty_like(like)
+
+    def give(self, name, chunk):
+        """Return a chunk to the pool, once no longer used."""
+        try:
+            self._free[name].append(chunk)
+        except KeyError:
+            self._free[name] = deque([chunk])
+
+    def n_free(self, name):
+        """Return the number of free chunks of a stream."""
+        return len(self._free.get(name, ()))
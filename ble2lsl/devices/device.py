@@ -31,13 +31,24 @@ include the following module-level attributes:
             ch_names (dict[Iterable[str]]): Name of each channel in the stream.
             chunk_size (dict[int]): No. of samples pushed at once through LSL.
 
+            The following are optional, and allow streams to be published as
+            the device's native integer counts (see `BaseStreamer`'s `raw`
+            argument). Use `None` for streams without an integer form.
+
+            raw_channel_format (dict[str]): The integer datatype of the
+                stream's raw data, e.g. `'int16'`. Used for both LSL and Numpy.
+            raw_scale (dict[float]): Multiplier from raw counts to `units`.
+            raw_offset (dict[float]): Subtracted from raw counts before
+                scaling, i.e. `value = raw_scale * (raw - raw_offset)`.
+
         ble (dict): Contains BLE-specific device parameters. Must contain
             keys for each of the streams named in `STREAMS`, with values of
             one or more characteristic UUIDs that `ble2lsl` must subscribe
             to when providing that stream. Some of these may be redundant or
             empty strings, as long as the device's `PacketHandler` separates
             incoming packets' data into respective streams (for example,
-            see `ganglion`).
+            see `ganglion`). A characteristic shared by several streams is
+            subscribed once, and while any of them is subscribed.
 
             address_type (BLEAddressType): One of `BLEAddressType.public` or
                 `BLEAddressType.random`, depending on the device.
@@ -46,6 +57,10 @@ include the following module-level attributes:
                 Connection intervals are multiples of 1.25 ms. A good choice of
                 `interval_min` and `interval_max` may be necessary to prevent
                 dropped packets.
+            interval_limits (Tuple[int, int]): Optional. Shortest and
+                longest intervals that are safe for the device, within which
+                `Streamer` may adapt the interval to the rate of missing
+                chunks (see `ble2lsl.interval`).
             send (str): UUID for the send/control characteristic.
                 Control commands (e.g. to start streaming) are written to this
                 characteristic.
@@ -61,7 +76,22 @@ received. This method should perform any necessary processing on the packets,
 delegating to other methods in the device file if necessary. After filling the
 `_chunks` and `_chunk_idxs` attributes for a given stream, the chunk may be
 enqueued for processing by `ble2lsl` by passing the stream name to
-`_enqueue_chunk()`.
+`_enqueue_chunk()`, which copies the chunk; the buffers may be reused for the
+next chunk. To keep the decoding of packets free of allocations, prefer
+writing into preallocated arrays (e.g. with the `out` argument of NumPy
+functions) over constructing new ones for each packet.
+
+Devices typically number their packets with a counter that rolls over after a
+fixed number of packets. Rather than storing these raw IDs in `_chunk_idxs`,
+pass them through `_unwrap_idx()` along with the counter's modulus, so that
+`ble2lsl` receives monotonic chunk indices over arbitrarily long recordings.
+
+Streams may be subscribed and unsubscribed while streaming (see
+`Streamer.subscribe`). Packet handlers should ignore the data of streams
+not in the streamer's current `subscriptions`, and may override
+`_init_stream()` and `_end_stream()` to prepare and release each stream, e.g.
+by writing commands to the device. Handlers that hold back partly assembled
+chunks should override `flush()` to enqueue them when streaming stops.
 
 Summary of necessary inclusions to support a data source provided by a device:
     * A name for the stream in `STREAMS`.
@@ -78,6 +108,11 @@ Summary of necessary inclusions to support a data source provided by a device:
       at the appropriate time (e.g. if multiple packets must be received to
       fill a single chunk.)
 
+Optionally, also include a `PacketEncoder` class, the inverse of the
+`PacketHandler`, whose `encode(name, chunk)` method returns the
+`(handle, packet)` pairs that the device would send for a chunk. This allows
+the `PacketHandler` to be tested and benchmarked without hardware.
+
 See `ble2lsl.devices.muse2016` for an example device implementation.
 
 When a user instantiates `ble2lsl.Streamer`, they may provide a list
@@ -90,8 +125,6 @@ some subset of the `STREAMS` attribute of the respective device file.
 
 from ble2lsl import empty_chunks, stream_idxs_zeros
 
-import numpy as np
-
 
 class BasePacketHandler:
     """Abstract parent for device-specific packet manager classes."""
@@ -105,19 +138,108 @@ class BasePacketHandler:
             streamer (ble2lsl.Streamer): The master `Streamer` instance.
         """
         self._streamer = streamer
-        self._transmit_queue = streamer._transmit_queue
+        self._transmit_queues = streamer._transmit_queues
+        self._chunk_pool = streamer._chunk_pool
+        self._tracer = streamer._tracer
+        self._arrival_time = None
 
         subscriptions = self._streamer.subscriptions
-        self._chunks = empty_chunks(stream_params, subscriptions)
+        self._chunks = empty_chunks(stream_params, subscriptions,
+                                    raw=self._streamer.raw)
         self._chunk_idxs = stream_idxs_zeros(subscriptions)
+        self._stream_params = stream_params
+
+        # last raw device ID and corresponding unwrapped index, per counter
+        self._raw_ids = {}
+        self._unwrapped_idxs = {}
 
     def process_packet(self, handle, packet):
         """BLE2LSL passes incoming BLE packets to this method for parsing."""
         raise NotImplementedError()
 
-    def _enqueue_chunk(self, name):
-        """Ensure copies are returned."""
-        self._transmit_queue.put((name,
-                                  self._chunk_idxs[name],
-                                  np.copy(self._chunks[name])
-                                  ))
+    def add_stream(self, name):
+        """Allocate the buffers of a stream subscribed while streaming."""
+        self._chunks.update(empty_chunks(self._stream_params, [name],
+                                         raw=self._streamer.raw))
+        self._chunk_idxs[name] = 0
+        self._init_stream(name)
+
+    def remove_stream(self, name):
+        """Release a stream unsubscribed while streaming."""
+        self._end_stream(name)
+
+    def flush(self):
+        """Enqueue any chunks still being assembled, e.g. on stopping."""
+        pass
+
+    def _init_stream(self, name):
+        """Prepare to handle a newly subscribed stream."""
+        pass
+
+    def _end_stream(self, name):
+        """Stop handling an unsubscribed stream."""
+        pass
+
+    def trace_packet(self, handle, packet):
+        """Stamp the arrival of a packet, then process it (when tracing)."""
+        self._arrival_time = self._tracer.clock()
+        self.process_packet(handle, packet)
+
+    def _enqueue_chunk(self, name, chunk=None, arrival_time=None):
+        """Enqueue a chunk for transmission by `ble2lsl`.
+
+        The stream's chunk buffer (or a `chunk` array of the same shape, if
+        given) is copied into a chunk recycled by the streamer once pushed,
+        so the caller may reuse it immediately, and no arrays are allocated
+        while streaming steadily.
+
+        When tracing, the chunk is stamped with the arrival of the packet
+        being processed, or with `arrival_time` (from the tracer's clock) for
+        a chunk completed by an earlier packet.
+        """
+        if chunk is None:
+            chunk = self._chunks[name]
+        queued = self._chunk_pool.take(name, self._chunks[name])
+        queued[...] = chunk
+        chunk = queued
+        if self._tracer is None:
+            self._transmit_queues[name].put((name, self._chunk_idxs[name],
+                                             chunk))
+        else:
+            if arrival_time is None:
+                arrival_time = self._arrival_time
+            stamps = (arrival_time, self._tracer.clock())
+            self._transmit_queues[name].put((name, self._chunk_idxs[name],
+                                             chunk, stamps))
+
+    def _unwrap_idx(self, key, raw_id, modulus, reorder_window=0):
+        """Map a rolling device packet ID to a monotonic sequence index.
+
+        The first ID received for `key` is taken as the starting index. Each
+        subsequent ID advances the index by its forward distance (modulo
+        `modulus`) from the previous ID, so that rollovers of the device
+        counter do not cause the index to jump backwards.
+
+        Args:
+            key (str): Identifies the counter; typically the stream name.
+            raw_id (int): The ID provided by the device, in `range(modulus)`.
+            modulus (int): The number of IDs before the counter rolls over.
+            reorder_window (int): IDs up to this many steps behind the latest
+                ID are treated as late arrivals, and mapped to indices before
+                the current index, rather than as a rollover.
+
+        Returns:
+            int: The unwrapped index, which does not overflow.
+        """
+        try:
+            step = (raw_id - self._raw_ids[key]) % modulus
+        except KeyError:
+            self._raw_ids[key] = raw_id
+            self._unwrapped_idxs[key] = raw_id
+            return raw_id
+        if step and step >= modulus - reorder_window:
+            # late packet; leave the counter where it is
+            return self._unwrapped_idxs[key] - (modulus - step)
+        self._raw_ids[key] = raw_id
+        self._unwrapped_idxs[key] += step
+        return self._unwrapped_idxs[key]
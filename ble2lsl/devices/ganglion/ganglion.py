@@ -22,6 +22,12 @@ DEFAULT_SUBSCRIPTIONS = ["EEG", "messages"]
 # for constructing dicts with STREAMS as keys
 streams_dict = dict_partial_from_keys(STREAMS)
 
+SCALE_FACTOR = streams_dict([1200 / (8388608.0 * 1.5 * 51.0),
+                             0.016,
+                             1  # not used (messages)
+                             ])
+"""Scale factors for conversion of EEG and accelerometer data."""
+
 PARAMS = dict(
     streams=dict(
         type=streams_dict(STREAMS),  # same as stream names
@@ -33,17 +39,22 @@ PARAMS = dict(
         ch_names=streams_dict([('A', 'B', 'C', 'D'), ('x', 'y', 'z'),
                                ('message',)]),
         chunk_size=streams_dict([1, 1, 1]),
+        raw_channel_format=streams_dict(['int32', 'int16', None]),
+        raw_scale=streams_dict([SCALE_FACTOR["EEG"],
+                                SCALE_FACTOR["accelerometer"], None]),
+        raw_offset=streams_dict([0, 0, None]),
     ),
     ble=dict(
         address_type=BLEAddressType.random,
         # service='fe84',
         interval_min=6,  # OpenBCI suggest 9
         interval_max=11,  # suggest 10
+        interval_limits=(6, 24),
 
-        # receive characteristic UUIDs
+        # receive characteristic UUIDs; all streams share one characteristic
         EEG=["2d30c082f39f4ce6923f3484ea480596"],
-        accelerometer='',  # placeholder; already subscribed through eeg
-        messages='',  # placeholder; subscription not required
+        accelerometer=["2d30c082f39f4ce6923f3484ea480596"],
+        messages=["2d30c082f39f4ce6923f3484ea480596"],
 
         # send characteristic UUID and commands
         send="2d30c083f39f4ce6923f3484ea480596",
@@ -61,15 +72,13 @@ PARAMS = dict(
 """OpenBCI Ganglion LSL- and BLE-related parameters."""
 
 INT_SIGN_BYTE = (b'\x00', b'\xff')
-SCALE_FACTOR = streams_dict([1200 / (8388608.0 * 1.5 * 51.0),
-                             0.016,
-                             1  # not used (messages)
-                             ])
-"""Scale factors for conversion of EEG and accelerometer data."""
 
 ID_TURNOVER = streams_dict([201, 10])
 """The number of samples processed before the packet ID cycles back to zero."""
 
+MESSAGE_PACKET_CHARS = 19
+"""Number of characters of a message carried by each packet."""
+
 
 class PacketHandler(BasePacketHandler):
     """Process packets from the OpenBCI Ganglion into chunks."""
@@ -77,18 +86,19 @@ class PacketHandler(BasePacketHandler):
     def __init__(self, streamer, **kwargs):
         super().__init__(PARAMS["streams"], streamer, **kwargs)
 
-        self._sample_ids = streams_dict([-1] * len(STREAMS))
+        # raw streams are enqueued as integer counts, without scaling
+        self._raw = self._streamer.raw
 
-        if "EEG" in self._streamer.subscriptions:
-            self._last_eeg_data = np.zeros(self._chunks["EEG"].shape[1])
-
-        if "messages" in self._streamer.subscriptions:
-            self._chunks["messages"][0] = ""
-            self._chunk_idxs["messages"] = -1
+        # EEG samples are reconstructed from deltas even when unsubscribed,
+        # so they are correct as soon as EEG is (re)subscribed
+        n_channels = PARAMS["streams"]["channel_count"]["EEG"]
+        self._last_eeg_data = np.zeros(n_channels)
+        # reused for the deltas and samples of each compressed packet
+        self._deltas = np.zeros((2, n_channels))
+        self._eeg_samples = np.zeros((2, n_channels))
 
-        if "accelerometer" in self._streamer.subscriptions:
-            # queue accelerometer_on command
-            self._streamer.send_command(PARAMS["ble"]["accelerometer_on"])
+        for name in self._streamer.subscriptions:
+            self._init_stream(name)
 
         # byte ID ranges for parsing function selection
         self._byte_id_ranges = {(101, 200): self._parse_compressed_19bit,
@@ -98,6 +108,18 @@ class PacketHandler(BasePacketHandler):
                                 (201, 205): self._parse_impedance,
                                 (208, -1): self._unknown_packet_warning}
 
+    def _init_stream(self, name):
+        if name == "messages":
+            self._chunks["messages"][0] = ""
+            self._chunk_idxs["messages"] = -1
+        elif name == "accelerometer":
+            # queue accelerometer_on command
+            self._streamer.send_command(PARAMS["ble"]["accelerometer_on"])
+
+    def _end_stream(self, name):
+        if name == "accelerometer":
+            self._streamer.send_command(PARAMS["ble"]["accelerometer_off"])
+
     def process_packet(self, handle, packet):
         """Process incoming data packet.
 
@@ -109,22 +131,27 @@ class PacketHandler(BasePacketHandler):
                 self._byte_id_ranges[r](start_byte, packet[1:])
                 break
 
-    def _update_counts_and_enqueue(self, name, sample_id):
-        """Update last packet ID and dropped packets"""
-        if self._sample_ids[name] == -1:
-            self._sample_ids[name] = sample_id
-            self._chunk_idxs[name] = 1
-            return
-        # sample IDs loops every 101 packets
-        self._chunk_idxs[name] += sample_id - self._sample_ids[name]
-        if sample_id < self._sample_ids[name]:
-            self._chunk_idxs[name] += ID_TURNOVER[name]
-        self._sample_ids[name] = sample_id
+    def _update_counts_and_enqueue(self, name, sample_id, chunk=None):
+        """Update chunk index from sample ID, and enqueue the chunk.
 
-        if name == "EEG":
-            self._chunks[name][0, :] = np.copy(self._last_eeg_data)
-        self._chunks[name] *= SCALE_FACTOR[name]
-        self._enqueue_chunk(name)
+        If a (scaled) `chunk` is not given, the stream's chunk buffer is
+        scaled and enqueued.
+        """
+        self._chunk_idxs[name] = self._unwrap_idx(name, sample_id,
+                                                  ID_TURNOVER[name])
+        if chunk is None and name not in self._raw:
+            self._chunks[name] *= SCALE_FACTOR[name]
+        self._enqueue_chunk(name, chunk)
+
+    def _enqueue_eeg(self, sample_id, sample):
+        """Enqueue an EEG sample, scaled to the stream's units or as is."""
+        chunk = self._chunks["EEG"]
+        if "EEG" in self._raw:
+            np.copyto(chunk[0], sample, casting='unsafe')
+        else:
+            np.multiply(sample, SCALE_FACTOR["EEG"], out=chunk[0],
+                        casting='same_kind')
+        self._update_counts_and_enqueue("EEG", sample_id, chunk)
 
     def _unknown_packet_warning(self, start_byte, packet):
         """Print if incoming byte ID is unknown."""
@@ -145,16 +172,21 @@ class PacketHandler(BasePacketHandler):
         # 4 channels of 24bits
         self._last_eeg_data[:] = [int_from_24bits(packet[i:i + 3])
                                   for i in range(0, 12, 3)]
-        # = np.array([chan_data], dtype=np.float32).T
-        self._update_counts_and_enqueue("EEG", packet_id)
+        if "EEG" not in self._streamer.subscriptions:
+            return
+        self._enqueue_eeg(packet_id, self._last_eeg_data)
 
     def _update_data_with_deltas(self, packet_id, deltas):
-        for delta_id in [0, 1]:
-            # convert from packet to sample ID
-            sample_id = (packet_id - 1) * 2 + delta_id + 1
-            # 19bit packets hold deltas between two samples
-            self._last_eeg_data -= np.array(deltas[delta_id])
-            self._update_counts_and_enqueue("EEG", sample_id)
+        """Reconstruct and enqueue the two samples encoded in a packet."""
+        samples = samples_from_deltas(self._last_eeg_data, deltas,
+                                      out=self._eeg_samples)
+        self._last_eeg_data[:] = samples[-1]
+        if "EEG" not in self._streamer.subscriptions:
+            return
+        # convert from packet to sample ID
+        sample_id = (packet_id - 1) * 2 + 1
+        for i in range(samples.shape[0]):
+            self._enqueue_eeg(sample_id + i, samples[i])
 
     def _parse_compressed_19bit(self, packet_id, packet):
         """Parse a 19-bit compressed packet without accelerometer data."""
@@ -163,7 +195,7 @@ class PacketHandler(BasePacketHandler):
 
         packet_id -= 100
         # should get 2 by 4 arrays of uncompressed data
-        deltas = decompress_deltas_19bit(packet)
+        deltas = decompress_deltas_19bit(packet, out=self._deltas)
         self._update_data_with_deltas(packet_id, deltas)
 
     def _parse_compressed_18bit(self, packet_id, packet):
@@ -173,7 +205,8 @@ class PacketHandler(BasePacketHandler):
 
         # set appropriate accelerometer byte
         id_ones = packet_id % 10 - 1
-        if id_ones in [0, 1, 2]:
+        if (id_ones in [0, 1, 2]
+                and "accelerometer" in self._streamer.subscriptions):
             value = int8_from_byte(packet[18])
             self._chunks["accelerometer"][0, id_ones] = value
             if id_ones == 2:
@@ -181,7 +214,7 @@ class PacketHandler(BasePacketHandler):
                                                 packet_id // 10)
 
         # deltas: should get 2 by 4 arrays of uncompressed data
-        deltas = decompress_deltas_18bit(packet[:-1])
+        deltas = decompress_deltas_18bit(packet[:-1], out=self._deltas)
         self._update_data_with_deltas(packet_id, deltas)
 
     def _parse_impedance(self, packet_id, packet):
@@ -202,6 +235,103 @@ class PacketHandler(BasePacketHandler):
                          self.last_accelerometer, self.last_impedance)
 
 
+class PacketEncoder:
+    """Encode chunks into Ganglion packets; the inverse of `PacketHandler`.
+
+    Produces byte-exact packets with the packet IDs of the board, e.g. to
+    exercise `PacketHandler` without hardware. Each cycle of packet IDs
+    starts with an uncompressed sample (ID 0), followed by 100 packets of two
+    delta-compressed samples (IDs 1-100 with 18-bit compression, or 101-200
+    with 19-bit compression), as expected by `PacketHandler`.
+
+    As the compression formats cannot represent all deltas (see
+    `quantize_deltas`), EEG samples are reconstructed from the encoded
+    deltas to within one count of the originals.
+
+    The Ganglion provides all data through a single characteristic, so the
+    handle of each packet is `None`.
+    """
+
+    def __init__(self, compression=18):
+        """Construct a `PacketEncoder`.
+
+        Args:
+            compression (int): 18 (with accelerometer data, which is sent
+                by the board when the accelerometer is enabled) or 19.
+        """
+        if compression not in (18, 19):
+            raise ValueError("Compression must be 18 or 19 (bits)")
+        self._n_bits = compression
+        self._packet_id = 0
+        self._pending = []
+        self._last_sample = None
+        self._accelerometer = np.zeros(3, dtype=np.int64)
+
+    def encode(self, name, chunk):
+        """Return the packets encoding a chunk of a stream.
+
+        EEG samples are buffered until they fill a packet. Accelerometer
+        samples are carried by subsequent 18-bit compressed EEG packets, so
+        no packets are returned for them.
+
+        Args:
+            name (str): The name of the stream.
+            chunk (np.ndarray or str): A chunk in the stream's units and
+                shape, or a message.
+
+        Returns:
+            List[Tuple[None, bytes]]: `(handle, packet)` for each packet.
+        """
+        if name == "messages":
+            return self._encode_message(chunk)
+        counts = np.round(np.asarray(chunk) / SCALE_FACTOR[name])
+        if name == "accelerometer":
+            self._accelerometer[:] = np.clip(counts[-1], -128, 127)
+            return []
+        self._pending.extend(counts.astype(np.int64))
+        packets = []
+        while self._pending:
+            if self._packet_id == 0:
+                sample = np.clip(self._pending.pop(0), -2 ** 23, 2 ** 23 - 1)
+                packets.append(bytes([0]) + b''.join(
+                    int(value).to_bytes(3, 'big', signed=True)
+                    for value in sample) + bytes(7))
+                self._last_sample = sample
+            elif len(self._pending) >= 2:
+                packets.append(self._encode_deltas(self._pending[:2]))
+                del self._pending[:2]
+            else:
+                break
+            self._packet_id = (self._packet_id + 1) % 101
+        return [(None, packet) for packet in packets]
+
+    def _encode_deltas(self, samples):
+        deltas = np.empty((2, 4), dtype=np.int64)
+        sample = self._last_sample
+        for i in range(2):
+            deltas[i] = quantize_deltas(sample - samples[i], self._n_bits)
+            sample = sample - deltas[i]
+        self._last_sample = sample
+        if self._n_bits == 19:
+            return bytes([self._packet_id + 100]) + compress_deltas(deltas, 19)
+        axis = self._packet_id % 10 - 1
+        accelerometer = self._accelerometer[axis] if axis in (0, 1, 2) else 0
+        return (bytes([self._packet_id]) + compress_deltas(deltas, 18)
+                + bytes([accelerometer % 256]))
+
+    def _encode_message(self, message):
+        if not isinstance(message, str):
+            message = np.asarray(message).flat[0]
+        message = message.encode()
+        packets = []
+        for i in range(0, len(message), MESSAGE_PACKET_CHARS):
+            start_byte = (207 if i + MESSAGE_PACKET_CHARS >= len(message)
+                          else 206)
+            packets.append((None, bytes([start_byte])
+                            + message[i:i + MESSAGE_PACKET_CHARS]))
+        return packets
+
+
 def int_from_24bits(unpacked):
     """Convert 24-bit data coded on 3 bytes to a proper integer."""
     if bad_data_size(unpacked, 3, "3-byte buffer"):
@@ -262,111 +392,106 @@ def int8_from_byte(byte):
         return byte
 
 
-def decompress_deltas_19bit(buffer):
-    """Parse packet deltas from 19-bit compression format."""
-    if bad_data_size(buffer, 19, "19-byte compressed packet"):
-        raise ValueError("Bad input size for byte conversion.")
+def samples_from_deltas(last_sample, deltas, out=None):
+    """Reconstruct samples from compressed packet deltas.
+
+    Each delta is subtracted from the preceding sample, so the samples are
+    obtained from a cumulative sum over all the deltas at once.
+
+    Args:
+        last_sample (np.ndarray): The sample preceding the first delta.
+        deltas (np.ndarray): Deltas from one packet, with shape `(2, 4)`, or
+            from consecutive packets, with shape `(n_packets, 2, 4)`.
+            Should have a float dtype, as returned by `decompress_deltas_*`.
+        out (np.ndarray): Array of shape `(n_samples, 4)` in which to store
+            the samples. By default, a new array is returned.
+
+    Returns:
+        np.ndarray: The reconstructed samples, with shape `(n_samples, 4)`.
+    """
+    samples = deltas.reshape((-1, deltas.shape[-1])).cumsum(axis=0, out=out)
+    np.subtract(last_sample, samples, out=samples)
+    return samples
+
 
-    deltas = np.zeros((2, 4))
-
-    # Sample 1 - Channel 1
-    minibuf = [(buffer[0] >> 5),
-               ((buffer[0] & 0x1F) << 3 & 0xFF) | (buffer[1] >> 5),
-               ((buffer[1] & 0x1F) << 3 & 0xFF) | (buffer[2] >> 5)]
-    deltas[0][0] = int32_from_19bit(minibuf)
-
-    # Sample 1 - Channel 2
-    minibuf = [(buffer[2] & 0x1F) >> 2,
-               (buffer[2] << 6 & 0xFF) | (buffer[3] >> 2),
-               (buffer[3] << 6 & 0xFF) | (buffer[4] >> 2)]
-    deltas[0][1] = int32_from_19bit(minibuf)
-
-    # Sample 1 - Channel 3
-    minibuf = [((buffer[4] & 0x03) << 1 & 0xFF) | (buffer[5] >> 7),
-               ((buffer[5] & 0x7F) << 1 & 0xFF) | (buffer[6] >> 7),
-               ((buffer[6] & 0x7F) << 1 & 0xFF) | (buffer[7] >> 7)]
-    deltas[0][2] = int32_from_19bit(minibuf)
-
-    # Sample 1 - Channel 4
-    minibuf = [((buffer[7] & 0x7F) >> 4),
-               ((buffer[7] & 0x0F) << 4 & 0xFF) | (buffer[8] >> 4),
-               ((buffer[8] & 0x0F) << 4 & 0xFF) | (buffer[9] >> 4)]
-    deltas[0][3] = int32_from_19bit(minibuf)
-
-    # Sample 2 - Channel 1
-    minibuf = [((buffer[9] & 0x0F) >> 1),
-               (buffer[9] << 7 & 0xFF) | (buffer[10] >> 1),
-               (buffer[10] << 7 & 0xFF) | (buffer[11] >> 1)]
-    deltas[1][0] = int32_from_19bit(minibuf)
-
-    # Sample 2 - Channel 2
-    minibuf = [((buffer[11] & 0x01) << 2 & 0xFF) | (buffer[12] >> 6),
-               (buffer[12] << 2 & 0xFF) | (buffer[13] >> 6),
-               (buffer[13] << 2 & 0xFF) | (buffer[14] >> 6)]
-    deltas[1][1] = int32_from_19bit(minibuf)
-
-    # Sample 2 - Channel 3
-    minibuf = [((buffer[14] & 0x38) >> 3),
-               ((buffer[14] & 0x07) << 5 & 0xFF) | ((buffer[15] & 0xF8) >> 3),
-               ((buffer[15] & 0x07) << 5 & 0xFF) | ((buffer[16] & 0xF8) >> 3)]
-    deltas[1][2] = int32_from_19bit(minibuf)
-
-    # Sample 2 - Channel 4
-    minibuf = [(buffer[16] & 0x07), buffer[17], buffer[18]]
-    deltas[1][3] = int32_from_19bit(minibuf)
+def quantize_deltas(deltas, n_bits):
+    """Round deltas to the nearest values representable when compressed.
 
+    The 18- and 19-bit compression formats indicate the sign of a delta by
+    its least significant bit, so only even non-negative deltas and odd
+    negative deltas can be represented; others are moved one count towards
+    zero. Deltas are also clipped to the range of the format.
+
+    Args:
+        deltas (np.ndarray): Integer deltas.
+        n_bits (int): 18 or 19, for the compression format.
+
+    Returns:
+        np.ndarray: The representable deltas, as `int64`.
+    """
+    limit = 2 ** n_bits
+    deltas = np.clip(np.round(deltas), 1 - limit, limit - 2).astype(np.int64)
+    wrong_sign = (deltas % 2).astype(bool) != (deltas < 0)
+    deltas[wrong_sign] -= np.sign(deltas[wrong_sign])
     return deltas
 
 
-def decompress_deltas_18bit(buffer):
-    """Parse packet deltas from 18-byte compression format."""
-    if bad_data_size(buffer, 18, "18-byte compressed packet"):
+def compress_deltas(deltas, n_bits):
+    """Pack deltas into the 18- or 19-bit compression format.
+
+    The inverse of `decompress_deltas_18bit` and `decompress_deltas_19bit`,
+    for deltas returned by `quantize_deltas`.
+
+    Args:
+        deltas (np.ndarray): Deltas with shape `(2, 4)`.
+        n_bits (int): 18 or 19, for the compression format.
+
+    Returns:
+        bytes: The `n_bits` bytes of packed deltas.
+    """
+    packed = 0
+    for delta in np.asarray(deltas, dtype=np.int64).ravel().tolist():
+        packed = (packed << n_bits) | (delta % 2 ** n_bits)
+    return packed.to_bytes(n_bits, 'big')
+
+
+def decompress_deltas_19bit(buffer, out=None):
+    """Parse packet deltas from 19-bit compression format."""
+    if bad_data_size(buffer, 19, "19-byte compressed packet"):
         raise ValueError("Bad input size for byte conversion.")
+    return _decompress_deltas(buffer, 19, out)
 
-    deltas = np.zeros((2, 4))
-
-    # Sample 1 - Channel 1
-    minibuf = [(buffer[0] >> 6),
-               ((buffer[0] & 0x3F) << 2 & 0xFF) | (buffer[1] >> 6),
-               ((buffer[1] & 0x3F) << 2 & 0xFF) | (buffer[2] >> 6)]
-    deltas[0][0] = int32_from_18bit(minibuf)
-
-    # Sample 1 - Channel 2
-    minibuf = [(buffer[2] & 0x3F) >> 4,
-               (buffer[2] << 4 & 0xFF) | (buffer[3] >> 4),
-               (buffer[3] << 4 & 0xFF) | (buffer[4] >> 4)]
-    deltas[0][1] = int32_from_18bit(minibuf)
-
-    # Sample 1 - Channel 3
-    minibuf = [(buffer[4] & 0x0F) >> 2,
-               (buffer[4] << 6 & 0xFF) | (buffer[5] >> 2),
-               (buffer[5] << 6 & 0xFF) | (buffer[6] >> 2)]
-    deltas[0][2] = int32_from_18bit(minibuf)
-
-    # Sample 1 - Channel 4
-    minibuf = [(buffer[6] & 0x03), buffer[7], buffer[8]]
-    deltas[0][3] = int32_from_18bit(minibuf)
-
-    # Sample 2 - Channel 1
-    minibuf = [(buffer[9] >> 6),
-               ((buffer[9] & 0x3F) << 2 & 0xFF) | (buffer[10] >> 6),
-               ((buffer[10] & 0x3F) << 2 & 0xFF) | (buffer[11] >> 6)]
-    deltas[1][0] = int32_from_18bit(minibuf)
-
-    # Sample 2 - Channel 2
-    minibuf = [(buffer[11] & 0x3F) >> 4,
-               (buffer[11] << 4 & 0xFF) | (buffer[12] >> 4),
-               (buffer[12] << 4 & 0xFF) | (buffer[13] >> 4)]
-    deltas[1][1] = int32_from_18bit(minibuf)
-
-    # Sample 2 - Channel 3
-    minibuf = [(buffer[13] & 0x0F) >> 2,
-               (buffer[13] << 6 & 0xFF) | (buffer[14] >> 2),
-               (buffer[14] << 6 & 0xFF) | (buffer[15] >> 2)]
-    deltas[1][2] = int32_from_18bit(minibuf)
-
-    # Sample 2 - Channel 4
-    minibuf = [(buffer[15] & 0x03), buffer[16], buffer[17]]
-    deltas[1][3] = int32_from_18bit(minibuf)
 
-    return deltas
+def decompress_deltas_18bit(buffer, out=None):
+    """Parse packet deltas from 18-byte compression format."""
+    if bad_data_size(buffer, 18, "18-byte compressed packet"):
+        raise ValueError("Bad input size for byte conversion.")
+    return _decompress_deltas(buffer, 18, out)
+
+
+def _decompress_deltas(buffer, n_bits, out=None):
+    """Unpack the eight consecutive `n_bits` deltas packed in `buffer`.
+
+    Each delta is negative if its least significant bit is set, as in
+    `int32_from_18bit` and `int32_from_19bit`.
+
+    Args:
+        buffer (bytes): The `n_bits` bytes of packed deltas.
+        n_bits (int): 18 or 19, for the compression format.
+        out (np.ndarray): Array of shape `(2, 4)` in which to store the
+            deltas. By default, a new (float) array is returned.
+
+    Returns:
+        np.ndarray: The deltas, with shape `(2, 4)`.
+    """
+    if out is None:
+        out = np.zeros((2, 4))
+    packed = int.from_bytes(buffer, 'big')
+    mask = (1 << n_bits) - 1
+    for i in range(7, -1, -1):
+        delta = packed & mask
+        if delta & 0x01:
+            delta -= 1 << n_bits
+        out[i >> 2, i & 3] = delta
+        packed >>= n_bits
+    return out
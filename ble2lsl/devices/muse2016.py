@@ -3,22 +3,26 @@
 More information on the data provided by the Muse 2016 headband can be found
 at `Available Data - Muse Direct`_
 
+Status messages (JSON objects sent over several packets) are published
+whole on the `status` string stream, and their numeric fields (see
+`STATUS_FIELDS`) on the `status_fields` stream.
+
 TODO:
-    * Figure out maximum string size for status messages, or split into fields
-      (can't send dict over LSL)
     * return standard acceleration units and not g's...
     * verify telemetry and IMU conversions and units
     * DRL/REF characteristic
-    * don't use lambdas for CONVERT_FUNCS?
     * save Muse address to minimize connect time?
-    * packet ID rollover (uint16) -- generalize in device file?
 
 .. _Available Data - Muse Direct:
    http://developer.choosemuse.com/tools/windows-tools/available-data-muse-direct
 """
 
 from ble2lsl.devices.device import BasePacketHandler
-from ble2lsl.utils import dict_partial_from_keys
+from ble2lsl.utils import dict_partial_from_keys, invert_map, missing_value
+
+import json
+import time
+from warnings import warn
 
 import bitstring
 import numpy as np
@@ -27,7 +31,8 @@ from pygatt import BLEAddressType
 NAME = 'Muse'
 MANUFACTURER = 'Interaxon'
 
-STREAMS = ['EEG', 'accelerometer', 'gyroscope', 'telemetry', 'status']
+STREAMS = ['EEG', 'accelerometer', 'gyroscope', 'telemetry', 'status',
+           'status_fields']
 """Data sources provided by the Muse 2016 headset."""
 
 DEFAULT_SUBSCRIPTIONS = STREAMS
@@ -39,30 +44,39 @@ streams_dict = dict_partial_from_keys(STREAMS)
 PARAMS = dict(
     streams=dict(
         type=streams_dict(STREAMS),  # identity mapping. best solution?
-        channel_count=streams_dict([5, 3, 3, 4, 1]),
-        nominal_srate=streams_dict([256, 52, 52, 0.1, 0.0]),
+        channel_count=streams_dict([5, 3, 3, 4, 1, 5]),
+        nominal_srate=streams_dict([256, 52, 52, 0.1, 0.0, 0.0]),
         channel_format=streams_dict(['float32', 'float32', 'float32',
-                                     'float32', 'string']),
+                                     'float32', 'string', 'float32']),
         numpy_dtype=streams_dict(['float32', 'float32', 'float32', 'float32',
-                                  'object']),
+                                  'object', 'float32']),
         units=streams_dict([('uV',) * 5,
                             ('g\'s',) * 3,
                             ('deg/s',) * 3,
                             ('%', 'mV', 'mV', 'C'),
-                            ('',)]),
+                            ('',),
+                            ('%', '', '', '', '')]),
         ch_names=streams_dict([('TP9', 'AF7', 'AF8', 'TP10', 'Right AUX'),
                                ('x', 'y', 'z'),
                                ('x', 'y', 'z'),
                                ('battery', 'fuel_gauge', 'adc_volt',
                                 'temperature'),
-                               ('message',)]),
-        chunk_size=streams_dict([12, 3, 3, 1, 1]),
+                               ('message',),
+                               ('battery', 'preset', 'return_code',
+                                'build_number', 'protocol_version')]),
+        chunk_size=streams_dict([12, 3, 3, 1, 1, 1]),
+        raw_channel_format=streams_dict(['int16', 'int16', 'int16',
+                                         None, None, None]),
+        raw_scale=streams_dict([0.48828125, 0.0000610352, 0.0074768,
+                                None, None, None]),
+        raw_offset=streams_dict([2048, 0, 0, None, None, None]),
     ),
 
     ble=dict(
         address_type=BLEAddressType.public,
         interval_min=60,  # pygatt default, seems fine
         interval_max=76,  # pygatt default
+        interval_limits=(12, 76),
 
         # receive characteristic UUIDs
         EEG=['273e0003-4c4d-454d-96be-f03bac821358',
@@ -75,6 +89,7 @@ PARAMS = dict(
         gyroscope='273e0009-4c4d-454d-96be-f03bac821358',
         telemetry='273e000b-4c4d-454d-96be-f03bac821358',
         status='273e0001-4c4d-454d-96be-f03bac821358',  # same as send
+        status_fields='273e0001-4c4d-454d-96be-f03bac821358',
 
         # send characteristic UUID and commands
         send='273e0001-4c4d-454d-96be-f03bac821358',
@@ -93,25 +108,103 @@ HANDLE_NAMES = {14: "status", 26: "telemetry", 23: "accelerometer",
                 44: "EEG"}
 """Stream name associated with each packet handle."""
 
+STREAM_HANDLES = invert_map({handle: name for handle, name
+                             in HANDLE_NAMES.items() if name != "EEG"})
+"""Packet handle associated with each (non-EEG) stream."""
+
 PACKET_FORMATS = streams_dict(['uint:16' + ',uint:12' * 12,
                                'uint:16' + ',int:16' * 9,
                                'uint:16' + ',int:16' * 9,
                                'uint:16' + ',uint:16' * 4,
+                               ','.join(['uint:8'] * 20),
                                ','.join(['uint:8'] * 20)])
 """Byte formats of the incoming packets."""
 
-CONVERT_FUNCS = streams_dict([lambda data: 0.48828125 * (data - 2048),
-                              lambda data: 0.0000610352 * data.reshape((3, 3)),
-                              lambda data: 0.0074768 * data.reshape((3, 3)),
-                              lambda data: np.array([data[0] / 512,
-                                                     2.2 * data[1],
-                                                     data[2], data[3]]).reshape((1, 4)),
-                              lambda data: None])
+PACKET_ID_MODULUS = 2 ** 16
+"""Number of packet IDs before rollover (IDs are `uint:16`)."""
+
+
+def _converter(scale, offset=0, shape=None):
+    """Return a function rendering unpacked data into shape and units.
+
+    The function writes into `out`, if given; otherwise, it returns a new
+    (`float64`) array.
+    """
+    def convert(data, out=None):
+        if shape is not None:
+            data = data.reshape(shape)
+        dtype = np.float64 if out is None else out.dtype
+        out = np.subtract(data, offset, out=out, dtype=dtype)
+        return np.multiply(out, scale, out=out)
+    return convert
+
+
+def _reshaper(shape=None):
+    """Return a function rendering unpacked data into shape, as is.
+
+    The function casts into `out`, if given; otherwise, it returns a view.
+    """
+    def reshape(data, out=None):
+        if shape is not None:
+            data = data.reshape(shape)
+        if out is None:
+            return data
+        np.copyto(out, data, casting='unsafe')
+        return out
+    return reshape
+
+
+CONVERT_FUNCS = streams_dict([_converter(0.48828125, 2048),
+                              _converter(0.0000610352, shape=(3, 3)),
+                              _converter(0.0074768, shape=(3, 3)),
+                              _converter(np.array([1 / 512, 2.2, 1, 1]),
+                                         shape=(1, 4)),
+                              None, None])
 """Functions to render unpacked data into the appropriate shape and units."""
 
+RAW_CONVERT_FUNCS = streams_dict([_reshaper(),
+                                  _reshaper((3, 3)),
+                                  _reshaper((3, 3)),
+                                  None,
+                                  None,
+                                  None])
+"""Functions to render unpacked data into shape, without unit conversion."""
+
+VALUE_DTYPES = streams_dict([None, np.dtype('>i2'), np.dtype('>i2'),
+                             np.dtype('>u2'), None, None])
+"""Datatypes of the values following the packet ID, in non-EEG data packets.
+
+EEG packets carry 12-bit values, unpacked by `PacketHandler._unpack_eeg`.
+"""
+
+ENCODE_FUNCS = streams_dict([
+    lambda chunk: np.clip(np.round(chunk / 0.48828125 + 2048), 0, 4095),
+    lambda chunk: np.clip(np.round(chunk / 0.0000610352), -32768, 32767),
+    lambda chunk: np.clip(np.round(chunk / 0.0074768), -32768, 32767),
+    lambda chunk: np.clip(np.round(np.array([chunk[0, 0] * 512,
+                                             chunk[0, 1] / 2.2,
+                                             chunk[0, 2], chunk[0, 3]])),
+                          0, 65535),
+    None, None])
+"""Functions to render chunks into packet values; inverse of `CONVERT_FUNCS`.
+"""
+
+STATUS_PACKET_CHARS = 19
+"""Number of characters of a status message carried by each packet."""
+
+STATUS_FIELDS = ['bp', 'ps', 'rc', 'bn', 'pv']
+"""Keys of the status message fields published on `status_fields`, in order
+of its channels. Fields absent from a message are NaN."""
+
 EEG_HANDLE_CH_IDXS = {32: 0, 35: 1, 38: 2, 41: 3, 44: 4}
 EEG_HANDLE_RECEIVE_ORDER = [44, 41, 38, 32, 35]
-"""Channel indices and receipt order of EEG packets."""
+"""Channel indices and usual receipt order of EEG packets."""
+
+EEG_REASSEMBLY_TIMEOUT = 0.1
+"""Seconds to wait for all channels of an EEG chunk before enqueuing it."""
+
+EEG_REASSEMBLY_WINDOW = 8
+"""Maximum number of incomplete EEG chunks awaiting their other channels."""
 
 
 class PacketHandler(BasePacketHandler):
@@ -120,50 +213,250 @@ class PacketHandler(BasePacketHandler):
     def __init__(self, streamer, **kwargs):
         super().__init__(PARAMS["streams"], streamer, **kwargs)
 
-        if "status" in self._streamer.subscriptions:
-            self._chunks["status"][0] = ""
-            self._chunk_idxs["status"] = -1
+        self._convert_funcs = {name: (RAW_CONVERT_FUNCS[name]
+                                      if name in self._streamer.raw
+                                      else CONVERT_FUNCS[name])
+                               for name in STREAMS}
+
+        # number of values per packet; each EEG packet carries one channel
+        n_values = {name: (PARAMS["streams"]["chunk_size"][name]
+                           * PARAMS["streams"]["channel_count"][name])
+                    for name in STREAMS}
+        n_values["EEG"] = PARAMS["streams"]["chunk_size"]["EEG"]
+        self._n_values = n_values
+
+        # preallocated for unpacking the 12-bit values of EEG packets, two
+        # from each three bytes, with views of the bytes and values
+        self._eeg_bytes = np.zeros((n_values["EEG"] // 2, 3), dtype=np.uint16)
+        self._eeg_values = np.zeros(n_values["EEG"], dtype=np.uint16)
+        self._eeg_scratch = np.zeros(n_values["EEG"] // 2, dtype=np.uint16)
+        self._eeg_pairs = self._eeg_values.reshape((-1, 2))
+        self._eeg_views = ([self._eeg_bytes[:, i] for i in range(3)]
+                           + [self._eeg_pairs[:, i] for i in range(2)])
+
+        # characters of the status message being received
+        self._status_buffer = bytearray()
+
+        self._eeg_pending = {}
+        self._n_partial_eeg = 0
+        for name in self._streamer.subscriptions:
+            self._init_stream(name)
+
+    def _init_stream(self, name):
+        if name in ("status", "status_fields"):
+            self._chunk_idxs[name] = -1
+        elif name == "EEG":
+            # EEG chunks being reassembled, by packet ID: [chunk, channel
+            # indices received, time of first packet, traced arrival of last
+            # packet]; entries are recycled once their chunks are enqueued
+            self._eeg_pending = {}
+            self._free_eeg = []
+            self._eeg_missing = missing_value(self._chunks["EEG"].dtype)
+            self._last_eeg_idx = None
+
+    def _end_stream(self, name):
+        if name == "EEG":
+            self.flush()
+
+    def flush(self):
+        """Enqueue the pending EEG chunks, with their missing channels."""
+        self._flush_eeg(float("inf"))
 
     def process_packet(self, handle, packet):
         """Unpack, convert, and return packet contents."""
         name = HANDLE_NAMES[handle]
-        unpacked = _unpack(packet, PACKET_FORMATS[name])
+        if self._eeg_pending and name != "EEG":
+            # expire incomplete EEG chunks even if EEG packets stop arriving
+            self._flush_eeg(time.monotonic())
+
+        if name == "status":
+            # also carries the status_fields stream
+            self._process_status(packet)
+            return
 
         if name not in self._streamer.subscriptions:
             return
+        packet_id = (packet[0] << 8) | packet[1]
+        if name == "EEG":
+            self._process_eeg(handle, packet_id, self._unpack_eeg(packet))
+            return
+        data = np.frombuffer(packet, VALUE_DTYPES[name],
+                             count=self._n_values[name], offset=2)
+        self._convert_funcs[name](data, out=self._chunks[name])
+        self._chunk_idxs[name] = self._unwrap_idx(name, packet_id,
+                                                  PACKET_ID_MODULUS)
+        self._enqueue_chunk(name)
 
-        if name == "status":
-            self._process_status(unpacked)
-        else:
-            data = np.array(unpacked[1:],
-                            dtype=PARAMS["streams"]["numpy_dtype"][name])
-
-            if name == "EEG":
-                idx = EEG_HANDLE_CH_IDXS[handle]
-                self._chunks[name][:, idx] = CONVERT_FUNCS[name](data)
-                if not handle == EEG_HANDLE_RECEIVE_ORDER[-1]:
-                    return
-            else:
-                try:
-                    self._chunks[name][:, :] = CONVERT_FUNCS[name](data)
-                except ValueError:
-                    print(name)
-
-            self._chunk_idxs[name] = unpacked[0]
-            self._enqueue_chunk(name)
-
-    def _process_status(self, unpacked):
-        message_chars = [chr(i) for i in unpacked[1:]]
-        status_message_partial = "".join(message_chars)[:unpacked[0]]
-        self._chunks["status"] += status_message_partial.replace('\n', '')
-        if status_message_partial[-1] == '}':
-            # ast.literal_eval(self._message))
-            # parse and enqueue dict
+    def _unpack_eeg(self, packet):
+        """Unpack the 12-bit values of an EEG packet, after its packet ID.
+
+        Returns:
+            np.ndarray: The values, in a buffer reused for each packet.
+        """
+        byte_0, byte_1, byte_2, first, second = self._eeg_views
+        scratch = self._eeg_scratch
+        np.copyto(self._eeg_bytes,
+                  np.frombuffer(packet, np.uint8, count=self._eeg_bytes.size,
+                                offset=2).reshape(self._eeg_bytes.shape))
+        # first value: 8 bits, then the high 4 bits of the middle byte
+        np.left_shift(byte_0, 4, out=first)
+        np.right_shift(byte_1, 4, out=scratch)
+        np.bitwise_or(first, scratch, out=first)
+        # second value: the low 4 bits of the middle byte, then 8 bits
+        np.bitwise_and(byte_1, 0x0F, out=scratch)
+        np.left_shift(scratch, 8, out=second)
+        np.bitwise_or(second, byte_2, out=second)
+        return self._eeg_values
+
+    def _process_eeg(self, handle, packet_id, data):
+        """Reassemble EEG chunks from the packets of the five EEG handles.
+
+        Each EEG handle provides one channel of a chunk, and the packets for a
+        chunk share a packet ID. Packets are buffered by ID so that chunks are
+        only enqueued (in order of ID) once all their channels have arrived,
+        regardless of the order in which the packets are received. A chunk
+        that is still incomplete after `EEG_REASSEMBLY_TIMEOUT`, or when more
+        than `EEG_REASSEMBLY_WINDOW` chunks are pending, is enqueued with
+        missing values (NaN, or the minimum integer for raw output) in place
+        of its missing channels and counted in `partial_chunks`.
+        """
+        idx = self._unwrap_idx("EEG", packet_id, PACKET_ID_MODULUS,
+                               reorder_window=EEG_REASSEMBLY_WINDOW)
+        now = time.monotonic()
+        try:
+            entry = self._eeg_pending[idx]
+        except KeyError:
+            if self._last_eeg_idx is not None and idx <= self._last_eeg_idx:
+                # too late; chunk already enqueued
+                return
+            try:
+                entry = self._free_eeg.pop()
+                entry[2] = now
+            except IndexError:
+                entry = [np.empty_like(self._chunks["EEG"]), set(), now, None]
+            entry[0].fill(self._eeg_missing)
+            entry[1].clear()
+            self._eeg_pending[idx] = entry
+        chunk, ch_idxs = entry[:2]
+        # traced arrival of the chunk's last packet, if tracing
+        entry[3] = self._arrival_time
+        ch_idx = EEG_HANDLE_CH_IDXS[handle]
+        self._convert_funcs["EEG"](data, out=chunk[:, ch_idx])
+        ch_idxs.add(ch_idx)
+        self._flush_eeg(now)
+
+    def _flush_eeg(self, now):
+        """Enqueue complete or expired EEG chunks, in order of packet ID."""
+        while self._eeg_pending:
+            idx = min(self._eeg_pending)
+            entry = self._eeg_pending[idx]
+            chunk, ch_idxs, first_time, last_arrival = entry
+            if len(ch_idxs) < len(EEG_HANDLE_CH_IDXS):
+                if (now - first_time < EEG_REASSEMBLY_TIMEOUT
+                        and len(self._eeg_pending) <= EEG_REASSEMBLY_WINDOW):
+                    break
+                self._n_partial_eeg += 1
+            del self._eeg_pending[idx]
+            self._last_eeg_idx = idx
+            self._chunk_idxs["EEG"] = idx
+            self._enqueue_chunk("EEG", chunk, arrival_time=last_arrival)
+            self._free_eeg.append(entry)
+
+    @property
+    def partial_chunks(self):
+        """Number of EEG chunks enqueued with missing channels."""
+        return self._n_partial_eeg
+
+    def _process_status(self, packet):
+        """Assemble the characters of status messages from their packets.
+
+        Each message is decoded once complete (when a packet's characters end
+        with `}`), and enqueued as a string and/or its numeric fields.
+        """
+        subscriptions = self._streamer.subscriptions
+        if not {"status", "status_fields"}.intersection(subscriptions):
+            return
+        # first byte is the number of characters that follow
+        n_chars = packet[0]
+        if n_chars and packet[1] == ord('{'):
+            # discard the rest of any message interrupted by this one
+            self._status_buffer.clear()
+        self._status_buffer += packet[1:n_chars + 1]
+        if not n_chars or packet[n_chars] != ord('}'):
+            return
+        # decoded once complete, as characters may span packets
+        message = self._status_buffer.replace(b'\n', b'')
+        message = message.decode('utf-8', errors='replace')
+        self._status_buffer.clear()
+        if "status" in subscriptions:
+            self._chunks["status"][0] = message
             self._enqueue_chunk("status")
-            self._chunks["status"][0] = ""
+        if "status_fields" in subscriptions:
+            try:
+                fields = json.loads(message)
+            except ValueError:
+                warn("Could not parse status message: {}".format(message))
+                return
+            chunk = self._chunks["status_fields"]
+            for ch_idx, key in enumerate(STATUS_FIELDS):
+                value = fields.get(key)
+                chunk[0, ch_idx] = (value if isinstance(value, (int, float))
+                                    else np.nan)
+            self._enqueue_chunk("status_fields")
+
+
+class PacketEncoder:
+    """Encode chunks into Muse 2016 packets; the inverse of `PacketHandler`.
+
+    Produces byte-exact packets with the handles and rolling packet IDs of
+    the headset, e.g. to exercise `PacketHandler` without hardware. Values
+    are rounded and clipped to the range of the packet formats.
+    """
+
+    def __init__(self, first_packet_id=0):
+        """Construct a `PacketEncoder`.
+
+        Args:
+            first_packet_id (int): Packet ID of the first chunk of each stream.
+        """
+        self._packet_ids = dict.fromkeys(STREAMS, first_packet_id)
+
+    def encode(self, name, chunk):
+        """Return the packets encoding a chunk of a stream.
+
+        Args:
+            name (str): The name of the stream.
+            chunk (np.ndarray or str): A chunk in the stream's units and
+                shape, or a status message (a JSON object string).
+
+        Returns:
+            List[Tuple[int, bytes]]: `(handle, packet)` for each packet, in
+                the usual order of receipt.
+        """
+        if name == "status":
+            return self._encode_status(chunk)
+        packet_id = self._packet_ids[name]
+        self._packet_ids[name] = (packet_id + 1) % PACKET_ID_MODULUS
+        values = ENCODE_FUNCS[name](np.asarray(chunk)).astype(int)
+        if name == "EEG":
+            return [(handle, _pack(PACKET_FORMATS[name], packet_id,
+                                   values[:, EEG_HANDLE_CH_IDXS[handle]]))
+                    for handle in EEG_HANDLE_RECEIVE_ORDER]
+        return [(STREAM_HANDLES[name],
+                 _pack(PACKET_FORMATS[name], packet_id, values.ravel()))]
+
+    def _encode_status(self, message):
+        if not isinstance(message, str):
+            message = np.asarray(message).flat[0]
+        message = message.encode('utf-8', errors='replace')
+        packets = []
+        for i in range(0, len(message), STATUS_PACKET_CHARS):
+            part = message[i:i + STATUS_PACKET_CHARS]
+            packets.append((STREAM_HANDLES["status"],
+                            bytes([len(part)])
+                            + part.ljust(STATUS_PACKET_CHARS, b'\0')))
+        return packets
 
 
-def _unpack(packet, packet_format):
-    packet_bits = bitstring.Bits(bytes=packet)
-    unpacked = packet_bits.unpack(packet_format)
-    return unpacked
+def _pack(packet_format, packet_id, values):
+    return bitstring.pack(packet_format, packet_id, *values.tolist()).bytes
@@ -0,0 +1,118 @@
+"""Adaptation of the BLE connection interval to the observed packet loss.
+
+The connection interval is the time between the exchanges of packets with a
+device; at each exchange, a limited number of packets may be transferred, so
+that with too long an interval, notifications are dropped. Shorter intervals
+cost more power. `IntervalController` tightens the interval while chunks are
+missing, and relaxes it again once the link has been clean for a while,
+within the limits given by the device's `PARAMS["ble"]["interval_limits"]`.
+When relaxing causes loss, the clean time required to relax again doubles.
+
+Intervals are in the BLE unit of 1.25 ms.
+"""
+
+import math
+
+LOSS_THRESHOLD = 0.01
+"""Fraction of missing chunks (of any stream) above which to tighten."""
+
+CLEAN_WINDOWS = 5
+"""Number of windows without missing chunks after which to relax."""
+
+STEP = 0.75
+"""Factor by which the interval is shortened (or lengthened, inversely)."""
+
+INTERVAL_MS = 1.25
+"""Duration of one unit of connection interval, in milliseconds."""
+
+SUPERVISION_TIMEOUT = 100
+"""Connection supervision timeout requested with new intervals (10 ms units),
+as `pygatt` requests on connection."""
+
+
+class IntervalController:
+    """Chooses BLE connection intervals from the rate of missing chunks."""
+
+    def __init__(self, limits, interval_min, interval_max,
+                 loss_threshold=LOSS_THRESHOLD, clean_windows=CLEAN_WINDOWS,
+                 step=STEP):
+        """Construct an `IntervalController`.
+
+        Args:
+            limits (Tuple[int, int]): Shortest and longest allowed intervals.
+            interval_min (int): Minimum of the initial interval range.
+            interval_max (int): Maximum of the initial interval range.
+                Requested ranges keep the width of the initial range.
+            loss_threshold (float): Fraction of missing chunks above which
+                the interval is shortened.
+            clean_windows (int): Number of consecutive windows without
+                missing chunks after which the interval is first lengthened.
+            step (float): Factor by which to shorten the interval.
+        """
+        self._limits = tuple(limits)
+        self._width = interval_max - interval_min
+        self._interval = interval_max
+        self._loss_threshold = loss_threshold
+        self._clean_windows = clean_windows
+        self._step = step
+        self._n_clean = 0
+        self._relaxed = False
+
+    @classmethod
+    def for_device(cls, device, **kwargs):
+        """Construct an `IntervalController` from a device's BLE parameters.
+
+        Without `interval_limits`, the interval is held at the default.
+        """
+        ble_params = device.PARAMS["ble"]
+        limits = ble_params.get("interval_limits",
+                                (ble_params["interval_min"],
+                                 ble_params["interval_max"]))
+        return cls(limits, ble_params["interval_min"],
+                   ble_params["interval_max"], **kwargs)
+
+    def update(self, progress, missing):
+        """Record a window of chunks, and return any change of interval.
+
+        Args:
+            progress (dict[str, int]): Chunks received or missing in the
+                window, per stream.
+            missing (dict[str, int]): Chunks missing in the window, per
+                stream.
+
+        Returns:
+            Tuple[int, int]: The new interval range to request, or `None` to
+                keep the current range.
+            float: The largest fraction of missing chunks of any stream.
+        """
+        loss = max([missing[name] / progress[name] for name in progress
+                    if progress[name] > 0] or [0.0])
+        interval = self._interval
+        # whether the interval was lengthened just before this window
+        relaxed, self._relaxed = self._relaxed, False
+        if loss > self._loss_threshold:
+            if relaxed:
+                # back off from relaxing into a lossy interval
+                self._clean_windows *= 2
+            self._n_clean = 0
+            interval = max(self._limits[0],
+                           math.floor(self._interval * self._step))
+        elif loss == 0:
+            self._n_clean += 1
+            if self._n_clean >= self._clean_windows:
+                self._n_clean = 0
+                interval = min(self._limits[1],
+                               math.ceil(self._interval / self._step))
+                self._relaxed = interval != self._interval
+        else:
+            self._n_clean = 0
+        if interval == self._interval:
+            return None, loss
+        self._interval = interval
+        return self.interval_range, loss
+
+    @property
+    def interval_range(self):
+        """The current interval range `(interval_min, interval_max)`."""
+        return (max(self._limits[0], self._interval - self._width),
+                self._interval)
@@ -0,0 +1,191 @@
+"""Load generator simulating a fleet of devices, for capacity planning.
+
+Runs `Dummy` streamers for many simulated devices, spread across several
+processes, for a fixed duration; each device publishes its streams under a
+unique source ID (e.g. `Muse-LOAD007`). Reports the achieved and nominal
+sample rates of each stream, the CPU time used per device, and percentiles
+of the push latency: the time from the creation of each chunk to the end of
+its push to the sinks.
+
+Usage:
+    python -m ble2lsl.loadgen --devices 24 --processes 4 --duration 60 \\
+        --device-types muse2016 ganglion
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+import ble2lsl.devices
+from ble2lsl.ble2lsl import Dummy
+from ble2lsl.sinks import BaseSink, LSLSink, SharedMemorySink
+
+SINKS = {'lsl': LSLSink, 'shared_memory': SharedMemorySink, 'none': None}
+"""Sinks to which the simulated devices may push, by command-line name."""
+
+PERCENTILES = [50, 90, 99, 99.9]
+"""Percentiles of push latency to report."""
+
+
+class _TimingSink(BaseSink):
+    """Wraps a sink to count pushed samples and time chunk pushes."""
+
+    def __init__(self, sink=None):
+        super().__init__()
+        self._sink = sink
+        self.n_samples = {}
+        self.latencies = []
+
+    def open(self, name, info):
+        self.n_samples[name] = 0
+        if self._sink is not None:
+            self._sink.open(name, info)
+
+    def push_chunk(self, name, chunk, timestamp):
+        if self._sink is not None:
+            self._sink.push_chunk(name, chunk, timestamp)
+        # Dummy timestamps chunks with time.time() as they are created
+        self.latencies.append(time.time() - timestamp)
+        self.n_samples[name] += chunk.shape[0]
+
+    def close(self, name):
+        if self._sink is not None:
+            self._sink.close(name)
+
+
+def run_devices(device_specs, duration, sink='lsl'):
+    """Run simulated devices in this process, and return their statistics.
+
+    Args:
+        device_specs (Iterable[Tuple[str, str]]): Device module name (in
+            `ble2lsl.devices`) and source ID of each simulated device.
+        duration (float): Seconds for which to stream.
+        sink (str): Name of the sink in `SINKS` to push to.
+
+    Returns:
+        dict: Per-device `(device name, {stream: samples per second})` by
+            source ID under `'rates'`; the push latencies (s) of all chunks
+            under `'latencies'`; and the CPU time (s) per device under
+            `'cpu_per_device'`.
+    """
+    sink_class = SINKS[sink]
+    dummies = {}
+    for device_name, device_id in device_specs:
+        device = getattr(ble2lsl.devices, device_name)
+        timing_sink = _TimingSink(sink_class() if sink_class else None)
+        dummies[device_id] = (device_name, timing_sink,
+                              Dummy(device, device_id=device_id,
+                                    sinks=[timing_sink], autostart=False))
+
+    cpu_start = time.process_time()
+    start = time.monotonic()
+    for _, _, dummy in dummies.values():
+        dummy.start()
+    time.sleep(duration)
+    # measure before stopping, which may wait for slow streams
+    elapsed = time.monotonic() - start
+    cpu_time = time.process_time() - cpu_start
+    rates = {device_id: (device_name,
+                         {name: n_samples / elapsed for name, n_samples
+                          in timing_sink.n_samples.items()})
+             for device_id, (device_name, timing_sink, _)
+             in dummies.items()}
+    for _, _, dummy in dummies.values():
+        dummy.close()
+
+    latencies = np.concatenate([timing_sink.latencies for _, timing_sink, _
+                                in dummies.values()])
+    return dict(rates=rates, latencies=latencies,
+                cpu_per_device=cpu_time / max(len(dummies), 1),
+                elapsed=elapsed)
+
+
+def run(n_devices, n_processes, duration, device_names=None, sink='lsl'):
+    """Run simulated devices across processes, and return their statistics.
+
+    Devices are assigned types from `device_names` and processes in turn.
+
+    Args:
+        n_devices (int): Number of simulated devices.
+        n_processes (int): Number of processes.
+        duration (float): Seconds for which to stream.
+        device_names (Iterable[str]): Names of the device modules from which
+            to choose. By default, all devices in `ble2lsl.devices`.
+        sink (str): Name of the sink in `SINKS` to push to.
+
+    Returns:
+        List[dict]: The statistics from each process (see `run_devices`).
+    """
+    device_names = list(device_names or ble2lsl.devices.DEVICE_NAMES)
+    specs = [[] for _ in range(n_processes)]
+    for i in range(n_devices):
+        device_name = device_names[i % len(device_names)]
+        device = getattr(ble2lsl.devices, device_name)
+        device_id = '{}-LOAD{:03d}'.format(device.NAME, i)
+        specs[i % n_processes].append((device_name, device_id))
+    specs = [process_specs for process_specs in specs if process_specs]
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(len(specs)) as pool:
+        return pool.starmap(run_devices,
+                            [(process_specs, duration, sink)
+                             for process_specs in specs])
+
+
+def report(results):
+    """Print a summary of the statistics returned by `run`."""
+    rates = {}
+    for result in results:
+        for device_name, stream_rates in result['rates'].values():
+            for name, rate in stream_rates.items():
+                rates.setdefault((device_name, name), []).append(rate)
+    n_devices = sum(len(result['rates']) for result in results)
+    print("{} devices in {} processes, {:.1f} s".format(
+        n_devices, len(results), max(result['elapsed'] for result in results)))
+
+    print("\n{:<12}{:<15}{:>8}{:>12}{:>12}{:>12}".format(
+        "device", "stream", "devices", "nominal Hz", "mean Hz", "min Hz"))
+    for (device_name, name), stream_rates in sorted(rates.items()):
+        nominal_srate = getattr(ble2lsl.devices, device_name) \
+            .PARAMS['streams']['nominal_srate'][name]
+        print("{:<12}{:<15}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}".format(
+            device_name, name, len(stream_rates), nominal_srate,
+            np.mean(stream_rates), np.min(stream_rates)))
+
+    cpu = [result['cpu_per_device'] / result['elapsed'] for result in results]
+    print("\nCPU per device: {:.2f}% of a core (mean over processes)"
+          .format(100 * np.mean(cpu)))
+
+    latencies = np.concatenate([result['latencies'] for result in results])
+    print("Push latency (ms): " + ", ".join(
+        "p{:g} {:.3f}".format(percentile, 1e3 * value) for percentile, value
+        in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)))
+        + ", max {:.3f}".format(1e3 * np.max(latencies)))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate a fleet of BLE devices streaming through LSL.")
+    parser.add_argument('--devices', type=int, default=8,
+                        help="number of simulated devices")
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of processes across which to spread "
+                             "the devices")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds to stream")
+    parser.add_argument('--device-types', nargs='+',
+                        choices=ble2lsl.devices.DEVICE_NAMES,
+                        default=ble2lsl.devices.DEVICE_NAMES,
+                        help="device modules to simulate, in turn")
+    parser.add_argument('--sink', choices=list(SINKS), default='lsl',
+                        help="where to push the simulated data")
+    args = parser.parse_args(args)
+    report(run(args.devices, args.processes, args.duration,
+               device_names=args.device_types, sink=args.sink))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,472 @@
+"""Processing stages that derive new streams from the chunks of others.
+
+Processors are attached to a streamer's streams by name, e.g.
+`BaseStreamer(..., processors={'EEG': [IIRFilter(notch=60, band=(1, 40))]})`.
+Each processor receives every chunk pushed by its source stream, maintaining
+any state it needs between chunks, and returns chunks of a derived stream.
+Derived streams are pushed to the streamer's sinks under the name
+`'<source>-<suffix>'` (for example, an LSL outlet `'Muse-1234-EEG-filtered'`)
+or, if the processor was constructed with `replace=True`, in place of the
+source stream. Processors may also be attached to derived streams by name.
+
+A processor instance keeps the state of a single stream, and should not be
+attached to more than one.
+
+All processors should subclass `BaseProcessor`, and implement:
+
+    open(info): Prepare to process a stream, given its metadata (see
+        `ble2lsl.sinks`), and return the metadata of the derived stream.
+    process(chunk, timestamp): Process a chunk from the source stream, and
+        return a `(chunk, timestamp)` tuple for the derived stream, or `None`
+        if no output is available yet. The timestamp is that of the chunk's
+        last sample.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from ble2lsl.buffers import RingBuffer
+from ble2lsl.sinks import chunk_timestamps
+from ble2lsl.utils import missing_value
+
+try:
+    from scipy.signal import sosfilt as _scipy_sosfilt
+except ImportError:
+    _scipy_sosfilt = None
+
+
+class BaseProcessor:
+    """Abstract parent for stream processing stages."""
+
+    def __init__(self, suffix, replace=False):
+        """Construct a processor.
+
+        Args:
+            suffix (str): Appended to the source stream's name to name the
+                derived stream.
+            replace (bool): Push the derived stream in place of the source.
+        """
+        self._suffix = suffix
+        self._replace = replace
+
+    def output_name(self, name):
+        """Return the name of the stream derived from stream `name`."""
+        if self._replace:
+            return name
+        return '{}-{}'.format(name, self._suffix)
+
+    def open(self, info):
+        """Prepare to process a stream; return the derived stream's info."""
+        raise NotImplementedError()
+
+    def process(self, chunk, timestamp):
+        """Process a chunk; return a derived `(chunk, timestamp)` or `None`."""
+        raise NotImplementedError()
+
+    @property
+    def replace(self):
+        """Whether the derived stream replaces the source stream."""
+        return self._replace
+
+
+class IIRFilter(BaseProcessor):
+    """Filters a stream with IIR filters, keeping state between chunks.
+
+    Filters are applied as cascaded second-order sections, to all channels at
+    once. Filter state is initialized on the first chunk to the steady state
+    for its first sample, to avoid a large transient from any DC offset.
+
+    Raw integer streams are converted to their units (by the `scale` and
+    `offset` of their metadata) before filtering, so the filtered stream is
+    never raw.
+    """
+
+    def __init__(self, notch=None, band=None, order=4, notch_q=30, sos=None,
+                 suffix='filtered', replace=False):
+        """Construct an `IIRFilter`.
+
+        Filters are designed when the stream's sample rate is known.
+
+        Args:
+            notch (float or Iterable[float]): Frequencies (Hz) to notch out,
+                e.g. `60` for mains interference.
+            band (tuple[float]): `(low, high)` cutoff frequencies (Hz) of a
+                Butterworth bandpass filter. Either may be `None` to apply
+                only a lowpass or highpass filter.
+            order (int): Order of each of the Butterworth filters.
+            notch_q (float): Quality factor of the notch filters.
+            sos (numpy.ndarray): Additional second-order sections, with shape
+                `(n_sections, 6)`, e.g. from `scipy.signal.butter`.
+            suffix (str): Appended to the source stream's name.
+            replace (bool): Push the filtered stream in place of the source.
+        """
+        super().__init__(suffix=suffix, replace=replace)
+        if notch is None:
+            notch = []
+        elif np.isscalar(notch):
+            notch = [notch]
+        self._notch = list(notch)
+        self._band = band if band is not None else (None, None)
+        self._order = order
+        self._notch_q = notch_q
+        self._extra_sos = sos
+
+    def open(self, info):
+        srate = info["nominal_srate"]
+        if not srate:
+            raise ValueError("Cannot filter an irregularly sampled stream")
+        sections = [notch_sos(freq, srate, q=self._notch_q)
+                    for freq in self._notch]
+        low, high = self._band
+        if low is not None:
+            sections.append(butter_sos(self._order, low, srate, 'highpass'))
+        if high is not None:
+            sections.append(butter_sos(self._order, high, srate, 'lowpass'))
+        if self._extra_sos is not None:
+            sections.append(np.atleast_2d(self._extra_sos))
+        if not sections:
+            raise ValueError("No filters specified")
+        self._sos = np.concatenate(sections).astype(np.float64)
+        self._zi = None
+        self._scale, self._offset = info.get("scale"), info.get("offset")
+        self._int_missing = _integer_missing(info)
+
+        out_info = dict(info)
+        out_info.update(numpy_dtype='float32', channel_format='float32',
+                        scale=None, offset=None)
+        return out_info
+
+    def process(self, chunk, timestamp):
+        if self._int_missing is not None:
+            missing = np.any(chunk == self._int_missing)
+        else:
+            missing = not np.all(np.isfinite(chunk))
+        if missing:
+            # e.g. a missing chunk; restart filtering from the next chunk
+            self._zi = None
+            return np.full(chunk.shape, np.nan, dtype=np.float32), timestamp
+        if self._scale is not None:
+            chunk = (chunk - (self._offset or 0)) * self._scale
+        if self._zi is None:
+            self._zi = sosfilt_zi(self._sos)[:, :, np.newaxis] * chunk[0]
+        filtered = sosfilt(self._sos, chunk, self._zi)
+        return filtered.astype(np.float32, copy=False), timestamp
+
+
+class Decimator(IIRFilter):
+    """Reduces the sample rate of a stream by an integer factor.
+
+    The stream is lowpass filtered before downsampling to prevent aliasing,
+    with a Butterworth filter whose cutoff is 80% of the new Nyquist rate
+    (similarly to `scipy.signal.decimate`). Filter state and the phase of the
+    downsampling are kept between chunks, so that the output is uniformly
+    sampled at the new rate.
+    """
+
+    def __init__(self, factor, order=8, suffix='decimated', replace=False):
+        """Construct a `Decimator`.
+
+        Args:
+            factor (int): The factor by which to reduce the sample rate.
+            order (int): Order of the anti-aliasing filter.
+            suffix (str): Appended to the source stream's name.
+            replace (bool): Push the decimated stream in place of the source.
+        """
+        if factor < 1 or factor != int(factor):
+            raise ValueError("Decimation factor must be a positive integer")
+        super().__init__(order=order, suffix=suffix, replace=replace)
+        self._factor = int(factor)
+
+    def open(self, info):
+        srate = info["nominal_srate"]
+        if not srate:
+            raise ValueError("Cannot decimate an irregularly sampled stream")
+        self._srate = srate
+        self._band = (None, 0.8 * srate / (2 * self._factor))
+        out_info = super().open(info)
+
+        # index in the next chunk of the next sample to keep
+        self._phase = 0
+        chunk_size = info["chunk_size"]
+        out_info["nominal_srate"] = srate / self._factor
+        # chunks are of a fixed size only if the factor divides the input's
+        out_info["chunk_size"] = (chunk_size // self._factor
+                                  if chunk_size % self._factor == 0 else 0)
+        return out_info
+
+    def process(self, chunk, timestamp):
+        filtered, _ = super().process(chunk, timestamp)
+        n_samples = filtered.shape[0]
+        phase = self._phase
+        self._phase = (phase - n_samples) % self._factor
+        if phase >= n_samples:
+            return None
+        decimated = filtered[phase::self._factor]
+        # timestamp of the last sample kept
+        last_idx = phase + (decimated.shape[0] - 1) * self._factor
+        return decimated, timestamp - (n_samples - 1 - last_idx) / self._srate
+
+
+EEG_BANDS = {'delta': (1, 4), 'theta': (4, 8), 'alpha': (8, 13),
+             'beta': (13, 30), 'gamma': (30, 45)}
+"""Default frequency bands (Hz) for band power features."""
+
+
+class BandPower(BaseProcessor):
+    """Computes sliding-window band powers of all channels of a stream.
+
+    Recent samples are kept in a ring buffer. Every `hop` seconds, the power
+    in each frequency band is estimated for each channel from the latest
+    `window` seconds of samples, by Welch's method (or a single periodogram),
+    for all channels in a single vectorized computation. The derived stream
+    has one channel per source channel and band, named `'<channel>_<band>'`,
+    and a nominal rate of one sample per hop.
+    """
+
+    def __init__(self, window=1.0, hop=0.25, bands=None, segment=None,
+                 suffix='bandpower', replace=False):
+        """Construct a `BandPower` processor.
+
+        Args:
+            window (float): Duration (s) of the window of recent samples.
+            hop (float): Interval (s) between successive windows.
+            bands (dict[tuple[float]]): `(low, high)` frequency limits (Hz)
+                by band name. Defaults to `EEG_BANDS`.
+            segment (float): Duration (s) of the 50%-overlapping segments
+                averaged within each window (Welch's method). By default,
+                the whole window is used as a single segment.
+            suffix (str): Appended to the source stream's name.
+            replace (bool): Push band powers in place of the source stream.
+        """
+        super().__init__(suffix=suffix, replace=replace)
+        self._window = window
+        self._hop = hop
+        self._bands = dict(bands if bands is not None else EEG_BANDS)
+        self._segment = segment if segment is not None else window
+
+    def open(self, info):
+        srate = info["nominal_srate"]
+        if not srate:
+            raise ValueError("Band powers require a regularly sampled stream")
+        self._srate = srate
+        self._n_window = int(round(self._window * srate))
+        self._n_hop = max(1, int(round(self._hop * srate)))
+        self._n_segment = min(int(round(self._segment * srate)),
+                              self._n_window)
+        self._n_step = max(1, self._n_segment // 2)
+        self._n_segments = ((self._n_window - self._n_segment)
+                            // self._n_step + 1)
+        self._until_hop = self._n_hop
+        self._int_missing = _integer_missing(info)
+        n_channels = info["channel_count"]
+        self._ring = RingBuffer(self._n_window, n_channels, dtype=np.float64)
+
+        # one-sided power spectral density scaling, with a Hann window
+        self._taper = np.hanning(self._n_segment + 1)[:-1, np.newaxis]
+        freqs = np.fft.rfftfreq(self._n_segment, 1 / srate)
+        scale = np.full(freqs.shape, 2 / (srate * np.sum(self._taper ** 2)))
+        scale[0] /= 2
+        if self._n_segment % 2 == 0:
+            scale[-1] /= 2
+        # integrates the PSD over each band
+        df = freqs[1] - freqs[0]
+        self._band_weights = np.stack(
+            [scale * df * ((freqs >= low) & (freqs < high))
+             for low, high in self._bands.values()], axis=1)
+
+        out_info = dict(info)
+        ch_names = ['{}_{}'.format(ch_name, band)
+                    for ch_name in info["ch_names"] for band in self._bands]
+        units = ['{}^2'.format(unit) for unit in info["units"]
+                 for _ in self._bands]
+        out_info.update(type=self._suffix,
+                        channel_count=len(ch_names),
+                        nominal_srate=srate / self._n_hop,
+                        channel_format='float32',
+                        numpy_dtype='float32',
+                        chunk_size=(1 if self._n_hop >= info["chunk_size"]
+                                    else 0),
+                        ch_names=tuple(ch_names),
+                        units=tuple(units))
+        if info.get("scale") is not None:
+            # power of raw counts; the offset contributes only at 0 Hz
+            out_info.update(scale=info["scale"] ** 2, offset=0)
+        return out_info
+
+    def process(self, chunk, timestamp):
+        if self._int_missing is not None:
+            # missing raw samples propagate as NaN, as in float streams
+            chunk = np.where(chunk == self._int_missing, np.nan, chunk)
+        n_samples = chunk.shape[0]
+        timestamps = chunk_timestamps(timestamp, n_samples, self._srate)
+        powers = []
+        start = 0
+        # split the chunk at hop boundaries
+        while start < n_samples:
+            stop = min(n_samples, start + self._until_hop)
+            self._ring.write(chunk[start:stop], timestamps[start:stop])
+            self._until_hop -= stop - start
+            start = stop
+            if not self._until_hop:
+                self._until_hop = self._n_hop
+                if self._ring.n_written >= self._n_window:
+                    powers.append(self.band_powers(self._ring.latest()[0]))
+                    last_timestamp = timestamps[stop - 1]
+        if not powers:
+            return None
+        return np.array(powers, dtype=np.float32), last_timestamp
+
+    def band_powers(self, window):
+        """Return the band powers of all channels in a window of samples.
+
+        Args:
+            window (numpy.ndarray): Samples, with shape
+                `(n_window, n_channels)`.
+
+        Returns:
+            numpy.ndarray: Band powers ordered by channel, then band.
+        """
+        window = np.ascontiguousarray(window)
+        strides = window.strides
+        segments = as_strided(window, shape=(self._n_segments,
+                                             self._n_segment,
+                                             window.shape[1]),
+                              strides=(self._n_step * strides[0],) + strides,
+                              writeable=False)
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        spectra = np.fft.rfft(segments * self._taper, axis=1)
+        psd = np.mean(spectra.real ** 2 + spectra.imag ** 2, axis=0)
+        return (psd.T @ self._band_weights).ravel()
+
+
+def butter_sos(order, cutoff, srate, btype='lowpass'):
+    """Design a digital Butterworth lowpass or highpass filter.
+
+    The filter is constructed from bilinear-transformed (and prewarped)
+    sections, and is equivalent to `scipy.signal.butter(..., output='sos')`.
+
+    Args:
+        order (int): Order of the filter.
+        cutoff (float): Cutoff (-3 dB) frequency in Hz.
+        srate (float): Sample rate in Hz.
+        btype (str): `'lowpass'` or `'highpass'`.
+
+    Returns:
+        numpy.ndarray: Second-order sections, with shape `(n_sections, 6)`.
+    """
+    if btype not in ('lowpass', 'highpass'):
+        raise ValueError("btype must be 'lowpass' or 'highpass'")
+    if not 0 < cutoff < srate / 2:
+        raise ValueError("Cutoff must be between 0 Hz and the Nyquist rate")
+    w0 = 2 * np.pi * cutoff / srate
+    sections = []
+    for k in range(order // 2):
+        q = 1 / (2 * np.sin((2 * k + 1) * np.pi / (2 * order)))
+        sections.append(_biquad(btype, w0, q))
+    if order % 2:
+        # first-order section
+        K = np.tan(w0 / 2)
+        if btype == 'lowpass':
+            b = [K, K, 0]
+        else:
+            b = [1, -1, 0]
+        sections.append(np.array(b + [1 + K, K - 1, 0]) / (1 + K))
+    return np.array(sections)
+
+
+def notch_sos(freq, srate, q=30):
+    """Design a second-order notch filter.
+
+    Args:
+        freq (float): Frequency to remove, in Hz.
+        srate (float): Sample rate in Hz.
+        q (float): Quality factor; `freq` divided by the -3 dB bandwidth.
+
+    Returns:
+        numpy.ndarray: A single second-order section, with shape `(1, 6)`.
+    """
+    if not 0 < freq < srate / 2:
+        raise ValueError("Notch frequency must be below the Nyquist rate")
+    return _biquad('notch', 2 * np.pi * freq / srate, q)[np.newaxis]
+
+
+def _biquad(btype, w0, q):
+    """Return the normalized coefficients of a second-order section.
+
+    From R. Bristow-Johnson's "Cookbook formulae for audio EQ biquad filter
+    coefficients".
+    """
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    if btype == 'lowpass':
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+    elif btype == 'highpass':
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    elif btype == 'notch':
+        b = [1, -2 * cos_w0, 1]
+    a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    return np.array(b + a) / a[0]
+
+
+def sosfilt_zi(sos):
+    """Return the steady-state filter state for a unit step input.
+
+    Multiply by the initial input value to start filtering without a
+    transient. Equivalent to `scipy.signal.sosfilt_zi`.
+
+    Args:
+        sos (numpy.ndarray): Second-order sections, with shape
+            `(n_sections, 6)`.
+
+    Returns:
+        numpy.ndarray: Filter state, with shape `(n_sections, 2)`.
+    """
+    zi = np.empty((sos.shape[0], 2))
+    scale = 1.0
+    for s, (b0, b1, b2, _, a1, a2) in enumerate(sos):
+        gain = (b0 + b1 + b2) / (1 + a1 + a2)
+        zi[s, 1] = scale * (b2 - a2 * gain)
+        zi[s, 0] = scale * (b1 - a1 * gain) + zi[s, 1]
+        scale *= gain
+    return zi
+
+
+def sosfilt(sos, x, zi):
+    """Filter a chunk along its first axis with second-order sections.
+
+    Uses `scipy.signal.sosfilt` if available.
+
+    Args:
+        sos (numpy.ndarray): Second-order sections, with shape
+            `(n_sections, 6)`.
+        x (numpy.ndarray): Chunk to filter, with shape
+            `(n_samples, n_channels)`.
+        zi (numpy.ndarray): Filter state, with shape
+            `(n_sections, 2, n_channels)`. Updated in place.
+
+    Returns:
+        numpy.ndarray: The filtered chunk, as `float64`.
+    """
+    if _scipy_sosfilt is not None:
+        y, zi[...] = _scipy_sosfilt(sos, x, axis=0, zi=zi)
+        return y
+    # transposed direct form II, vectorized over channels
+    y = np.array(x, dtype=np.float64)
+    for (b0, b1, b2, _, a1, a2), z in zip(sos, zi):
+        for i in range(y.shape[0]):
+            x_i = y[i].copy()
+            y[i] = b0 * x_i + z[0]
+            z[0] = b1 * x_i - a1 * y[i] + z[1]
+            z[1] = b2 * x_i - a2 * y[i]
+    return y
+
+
+def _integer_missing(info):
+    """Return the value marking missing samples of an integer stream.
+
+    Returns `None` for floating point streams, which mark them with NaN.
+    """
+    dtype = np.dtype(info["numpy_dtype"])
+    if np.issubdtype(dtype, np.integer):
+        return missing_value(dtype)
+    return None
@@ -0,0 +1,196 @@
+"""Reception of a device's LSL streams into preallocated NumPy buffers.
+
+`Receiver` resolves the LSL outlets of a device by their source ID (the
+device ID, e.g. `'Muse-1234'`) and names (`'<source_id>-<stream>'`), as
+published by `ble2lsl.sinks.LSLSink`. For each stream, a background thread
+pulls chunks directly into a preallocated staging array, then copies them
+into a `ble2lsl.buffers.RingBuffer`, from which the latest samples are
+returned as views, without locking or copying.
+
+String streams (e.g. the Ganglion's messages) cannot be pulled into NumPy
+buffers, and are not received. A stream whose source is lost beyond recovery
+stops being received, and is listed in `lost`.
+
+Requires pylsl 1.18.4 or later.
+
+Example:
+    receiver = Receiver('Muse-1234')
+    samples, timestamps = receiver.latest('EEG', 256)
+    ...
+    receiver.close()
+"""
+
+import inspect
+import threading
+from warnings import warn
+
+import numpy as np
+import pylsl as lsl
+
+try:
+    from pylsl.util import LostError
+except ImportError:
+    # pylsl < 1.17; `Receiver` is unsupported, but the module imports
+    from pylsl.pylsl import LostError
+
+from ble2lsl.buffers import RingBuffer
+
+DEFAULT_DURATION = 60.0
+"""Default duration (in seconds) of recent samples kept per stream."""
+
+PULL_TIMEOUT = 0.1
+"""Maximum seconds each pull waits for samples; bounds the time to close."""
+
+RESOLVE_TIMEOUT = 2.0
+"""Default seconds to wait for a device's streams to be resolved."""
+
+NUMPY_DTYPES = {lsl.cf_float32: np.float32, lsl.cf_double64: np.float64,
+                lsl.cf_int8: np.int8, lsl.cf_int16: np.int16,
+                lsl.cf_int32: np.int32, lsl.cf_int64: np.int64}
+"""Numpy datatypes of the numeric LSL channel formats."""
+
+
+def _require_pull_into():
+    parameters = inspect.signature(lsl.StreamInlet.pull_chunk).parameters
+    if not {'dest_obj', 'min_samples', 'as_numpy'} <= set(parameters):
+        raise RuntimeError("Receiver requires pylsl 1.18.4+ (pull_chunk "
+                           "into preallocated arrays)")
+
+
+class Receiver:
+    """Receives the LSL streams of a device into ring buffers."""
+
+    def __init__(self, device_id, streams=None, duration=DEFAULT_DURATION,
+                 max_chunk=1024, timeout=RESOLVE_TIMEOUT):
+        """Resolve a device's streams and start receiving them.
+
+        Args:
+            device_id (str): Source ID of the device providing the streams.
+                For example, `'Muse-1234'`, or `'Muse-DUMMY'` for a `Dummy`.
+            streams (Iterable[str]): Names of the streams to receive, e.g.
+                `['EEG']`. By default, all numeric streams found.
+            duration (float): Seconds of recent samples to keep per stream,
+                at the stream's nominal rate (or samples, for irregular
+                streams).
+            max_chunk (int): Maximum number of samples pulled at once.
+            timeout (float): Seconds to wait for the streams to be resolved.
+                When receiving all streams, the full time is waited.
+
+        Raises:
+            IOError: If any of `streams` is not found.
+            RuntimeError: If the installed pylsl is older than 1.18.4.
+        """
+        _require_pull_into()
+        self._device_id = device_id
+        infos = self._resolve(streams, timeout)
+
+        self._stop = threading.Event()
+        self._lost = set()
+        self._inlets, self._rings, self._threads = {}, {}, {}
+        for name, info in infos.items():
+            channel_count = info.channel_count()
+            srate = info.nominal_srate()
+            capacity = max(int(duration * srate) if srate > 0
+                           else int(duration), max_chunk)
+            dtype = NUMPY_DTYPES[info.channel_format()]
+            self._inlets[name] = lsl.StreamInlet(info, max_chunklen=max_chunk)
+            # receive all samples pushed after construction
+            self._inlets[name].open_stream(timeout)
+            self._rings[name] = RingBuffer(capacity, channel_count,
+                                           dtype=dtype)
+            staging = np.empty((max_chunk, channel_count), dtype=dtype)
+            self._threads[name] = threading.Thread(
+                target=self._receive, args=(name, staging), daemon=True)
+        for thread in self._threads.values():
+            thread.start()
+
+    def latest(self, name, n_samples=None):
+        """Return views of the latest samples of a stream, and timestamps.
+
+        The views are not copies; they remain valid until another
+        `capacity - n_samples` samples have been received.
+
+        Args:
+            name (str): Name of the stream, e.g. `'EEG'`.
+            n_samples (int): Number of samples. All available by default.
+
+        Returns:
+            numpy.ndarray: Samples, with shape `(n, channel_count)`.
+            numpy.ndarray: LSL timestamps, with shape `(n,)`.
+        """
+        return self._rings[name].latest(n_samples)
+
+    def n_received(self, name):
+        """Return the total number of samples received for a stream."""
+        return self._rings[name].n_written
+
+    def close(self):
+        """Stop receiving, and close the inlets."""
+        self._stop.set()
+        for thread in self._threads.values():
+            thread.join()
+        for inlet in self._inlets.values():
+            inlet.close_stream()
+
+    @property
+    def device_id(self):
+        """Source ID of the device providing the streams."""
+        return self._device_id
+
+    @property
+    def streams(self):
+        """Names of the streams being received."""
+        return tuple(self._rings)
+
+    @property
+    def lost(self):
+        """Names of the streams no longer received, their sources lost."""
+        return tuple(name for name in self._rings if name in self._lost)
+
+    def _resolve(self, streams, timeout):
+        """Find the numeric LSL streams of the device, by name."""
+        prefix = self._device_id + '-'
+        predicate = "source_id='{}'".format(self._device_id)
+        if streams is None:
+            # wait for as many of the device's streams as appear
+            minimum = 0
+        else:
+            minimum = len(set(streams))
+            predicate += " and ({})".format(" or ".join(
+                "name='{}'".format(prefix + name) for name in set(streams)))
+        infos, skipped = {}, set()
+        for info in lsl.resolve_bypred(predicate, minimum, timeout):
+            if not info.name().startswith(prefix):
+                continue
+            name = info.name()[len(prefix):]
+            if streams is not None and name not in streams:
+                continue
+            if info.channel_format() not in NUMPY_DTYPES:
+                if streams is not None:
+                    warn("Not receiving non-numeric stream " + name)
+                skipped.add(name)
+                continue
+            infos[name] = info
+        if streams is not None:
+            missing = set(streams) - set(infos) - skipped
+            if missing:
+                raise IOError("Streams not found for {}: {}"
+                              .format(self._device_id, sorted(missing)))
+        return infos
+
+    def _receive(self, name, staging):
+        """Pull chunks of a stream into its ring buffer, until closed."""
+        inlet, ring = self._inlets[name], self._rings[name]
+        max_chunk = staging.shape[0]
+        while not self._stop.is_set():
+            try:
+                samples, timestamps = inlet.pull_chunk(
+                    timeout=PULL_TIMEOUT, max_samples=max_chunk,
+                    dest_obj=staging, min_samples=1, as_numpy=True)
+            except LostError:
+                self._lost.add(name)
+                warn("Lost the source of stream {} of {}"
+                     .format(name, self._device_id))
+                return
+            if len(timestamps):
+                ring.write(samples, timestamps)
@@ -0,0 +1,271 @@
+"""Direct-to-disk recording of streams, without passing through LSL.
+
+`RecordingSink` appends the samples and timestamps of each stream to raw
+binary files, from a background thread using large buffered writes. Each
+stream is recorded as three files in the recording directory, named by the
+device's source ID and the stream name (e.g. `Muse-1234-EEG`):
+
+    `.dat`: The samples, in C order, as `dtype` values; or for non-numeric
+        streams, one JSON-encoded sample per line.
+    `.ts`: The timestamps of the samples, as native `float64` values.
+    `.json`: The header, containing stream metadata and `n_samples`, the
+        number of samples committed to disk.
+
+A stream reopened by the same sink (e.g. when a streamer is restarted) is
+appended to its files, provided its metadata is unchanged. Otherwise, any
+existing recording of the stream in the directory is overwritten.
+
+The data files are periodically flushed and synced to disk, after which the
+header is atomically replaced. Data beyond `n_samples` may be incomplete
+(e.g. after a crash), and is ignored by `load_recording`.
+"""
+
+import json
+import os
+from queue import Queue, Empty
+import threading
+import time
+from warnings import warn
+
+import numpy as np
+
+from ble2lsl.sinks import BaseSink, chunk_timestamps
+
+DEFAULT_BUFFER_SIZE = 2 ** 20
+"""Bytes of data buffered per stream before writing to the files."""
+
+TIMESTAMP_SIZE = np.dtype(np.float64).itemsize
+"""Bytes per timestamp in the `.ts` files."""
+
+_STOP = object()
+
+
+class RecordingSink(BaseSink):
+    """Records streams to disk from a background thread."""
+
+    def __init__(self, path, streams=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 fsync_interval=1.0):
+        """Construct a `RecordingSink`.
+
+        Args:
+            path (str): Directory in which to record; created if necessary.
+            streams (Iterable[str]): Names of the streams to record.
+            buffer_size (int): Bytes buffered per stream between writes.
+            fsync_interval (float): Seconds between syncs of the files to
+                disk, after which their headers are updated.
+        """
+        super().__init__(streams=streams)
+        self._path = path
+        self._buffer_size = buffer_size
+        self._fsync_interval = fsync_interval
+        self._queue = Queue()
+        self._thread = None
+        self._streams_open = {}
+        # headers of the streams recorded by this sink, by file prefix
+        self._headers = {}
+
+    def open(self, name, info):
+        os.makedirs(self._path, exist_ok=True)
+        prefix = os.path.join(self._path,
+                              '{}-{}'.format(info["source_id"], name))
+        numeric = np.issubdtype(np.dtype(info["numpy_dtype"]), np.number)
+        header = dict(name=name,
+                      source_id=info["source_id"],
+                      type=info["type"],
+                      channel_count=info["channel_count"],
+                      nominal_srate=info["nominal_srate"],
+                      channel_format=info["channel_format"],
+                      dtype=(np.dtype(info["numpy_dtype"]).str if numeric
+                             else None),
+                      ch_names=list(info["ch_names"]),
+                      units=list(info["units"]),
+                      scale=info["scale"],
+                      offset=info["offset"],
+                      n_samples=0)
+        previous = self._headers.get(prefix)
+        if previous is not None and any(previous[key] != header[key]
+                                        for key in header
+                                        if key != "n_samples"):
+            raise ValueError("Cannot append stream {} to its recording with "
+                             "different metadata".format(name))
+        stream = _RecordedStream(prefix, header, numeric,
+                                 append=previous is not None)
+        self._headers[prefix] = header
+        self._streams_open[name] = stream
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, daemon=True)
+            self._thread.start()
+
+    def push_chunk(self, name, chunk, timestamp):
+        stream = self._streams_open[name]
+        timestamps = chunk_timestamps(timestamp, chunk.shape[0],
+                                      stream.header["nominal_srate"])
+        if stream.numeric:
+            data = chunk.astype(stream.header["dtype"], copy=False).tobytes()
+        else:
+            data = ''.join(json.dumps(sample) + '\n'
+                           for sample in chunk.tolist()).encode()
+        self._queue.put((stream, data, timestamps.tobytes(),
+                         chunk.shape[0]))
+
+    def close(self, name):
+        """Write any buffered data for a stream, and close its files.
+
+        Blocks until the stream's files are closed.
+        """
+        stream = self._streams_open.pop(name)
+        self._queue.put((stream, None, None, 0))
+        stream.closed.wait()
+        if not self._streams_open:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _write(self):
+        """Run in thread to write buffered data to disk."""
+        streams = set()
+        next_sync = time.monotonic() + self._fsync_interval
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(0, next_sync - time.monotonic()))
+            except Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                stream, data, timestamps, n_samples = item
+                if data is None:
+                    stream.close()
+                    streams.discard(stream)
+                    continue
+                streams.add(stream)
+                stream.buffer(data, timestamps, n_samples)
+                if len(stream.data_buffer) >= self._buffer_size:
+                    stream.write()
+            if time.monotonic() >= next_sync:
+                for stream in streams:
+                    stream.sync()
+                next_sync = time.monotonic() + self._fsync_interval
+
+    @property
+    def path(self):
+        """The recording directory."""
+        return self._path
+
+
+class _RecordedStream:
+    """Buffers and files for a single recorded stream."""
+
+    def __init__(self, prefix, header, numeric, append=False):
+        self.header = header
+        self.numeric = numeric
+        self.closed = threading.Event()
+        self._header_path = prefix + '.json'
+        # an appended recording continues after the samples committed,
+        # discarding any data beyond them
+        n_committed = _committed_samples(self._header_path)
+        if not append:
+            if n_committed:
+                warn("Overwriting recording {}".format(prefix))
+            n_committed = 0
+        self._data_file = open(prefix + '.dat', 'ab')
+        self._ts_file = open(prefix + '.ts', 'ab')
+        self._data_file.truncate(self._data_size(prefix + '.dat',
+                                                 n_committed))
+        self._ts_file.truncate(n_committed * TIMESTAMP_SIZE)
+        self.data_buffer = bytearray()
+        self._ts_buffer = bytearray()
+        self._n_buffered = 0
+        self._n_written = n_committed
+        self.header["n_samples"] = n_committed
+        self._write_header()
+
+    def buffer(self, data, timestamps, n_samples):
+        self.data_buffer += data
+        self._ts_buffer += timestamps
+        self._n_buffered += n_samples
+
+    def write(self):
+        """Write buffered data to the files."""
+        self._data_file.write(self.data_buffer)
+        self._ts_file.write(self._ts_buffer)
+        self._n_written += self._n_buffered
+        del self.data_buffer[:], self._ts_buffer[:]
+        self._n_buffered = 0
+
+    def sync(self):
+        """Write and sync buffered data to disk, then commit the header."""
+        self.write()
+        if self._n_written == self.header["n_samples"]:
+            return
+        for file in (self._data_file, self._ts_file):
+            file.flush()
+            os.fsync(file.fileno())
+        self.header["n_samples"] = self._n_written
+        self._write_header()
+
+    def close(self):
+        self.sync()
+        self._data_file.close()
+        self._ts_file.close()
+        self.closed.set()
+
+    def _data_size(self, data_path, n_samples):
+        """Return the size (bytes) of the first samples in a data file."""
+        if not n_samples:
+            return 0
+        if self.numeric:
+            return (n_samples * self.header["channel_count"]
+                    * np.dtype(self.header["dtype"]).itemsize)
+        with open(data_path, 'rb') as f:
+            return sum(len(next(f)) for _ in range(n_samples))
+
+    def _write_header(self):
+        """Atomically replace the header file."""
+        tmp_path = self._header_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.header, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._header_path)
+
+
+def _committed_samples(header_path):
+    """Return the number of samples committed to a recording, if any."""
+    try:
+        with open(header_path) as f:
+            return json.load(f)["n_samples"]
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def load_recording(path, source_id, name):
+    """Load a stream recorded by `RecordingSink`.
+
+    Args:
+        path (str): The recording directory.
+        source_id (str): Source ID of the recorded device.
+        name (str): Name of the recorded stream.
+
+    Returns:
+        numpy.ndarray or list: The committed samples; an array with shape
+            `(n_samples, channel_count)` for numeric streams, otherwise a
+            list of samples.
+        numpy.ndarray: The timestamps of the samples.
+        dict: The stream's header.
+    """
+    prefix = os.path.join(path, '{}-{}'.format(source_id, name))
+    with open(prefix + '.json') as f:
+        header = json.load(f)
+    n_samples = header["n_samples"]
+    timestamps = np.fromfile(prefix + '.ts', dtype=np.float64,
+                             count=n_samples)
+    if header["dtype"] is not None:
+        samples = np.fromfile(prefix + '.dat', dtype=header["dtype"],
+                              count=n_samples * header["channel_count"])
+        samples = samples.reshape((n_samples, header["channel_count"]))
+    else:
+        with open(prefix + '.dat') as f:
+            samples = [json.loads(next(f)) for _ in range(n_samples)]
+    return samples, timestamps, header
@@ -0,0 +1,212 @@
+"""Publishing of streams to shared memory, for consumers on the same host.
+
+Each stream is placed in a `multiprocessing.shared_memory` block named by
+`shared_memory_name`, holding a header followed by the mirrored sample and
+timestamp arrays of a `ble2lsl.buffers.RingBuffer`. Consumers attach to the
+block with `SharedMemoryReader`, which provides views of the latest samples
+without copying or passing through the network stack.
+
+Requires Python 3.8 or later.
+
+Header layout (`uint64`):
+    0: total number of samples written (the write cursor)
+    1: ring buffer capacity (samples)
+    2: channel count
+    3: numpy dtype character code of the samples
+    4: process ID of the writer
+
+The dtype code is written last, and is zero until the block is initialized.
+A block left behind by a writer that has exited (e.g. crashed) is replaced
+by the next writer of the same stream.
+"""
+
+import os
+from warnings import warn
+
+import numpy as np
+
+from ble2lsl.buffers import RingBuffer
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+HEADER_SIZE = 5
+"""Number of `uint64` header fields."""
+
+DEFAULT_DURATION = 60.0
+"""Default duration (in seconds) of recent samples kept in shared memory."""
+
+
+def shared_memory_name(device_id, name):
+    """Return the name of the shared memory block for a stream."""
+    return 'ble2lsl-{}-{}'.format(device_id, name).replace('/', '_')
+
+
+def _ring_from_buffer(buffer, capacity, channel_count, dtype):
+    """Construct a `RingBuffer` backed by a shared memory buffer."""
+    dtype = np.dtype(dtype)
+    header = np.ndarray((HEADER_SIZE,), dtype=np.uint64, buffer=buffer)
+    offset = header.nbytes
+    timestamps = np.ndarray((2 * capacity,), dtype=np.float64, buffer=buffer,
+                            offset=offset)
+    offset += timestamps.nbytes
+    data = np.ndarray((2 * capacity, channel_count), dtype=dtype,
+                      buffer=buffer, offset=offset)
+    ring = RingBuffer(capacity, channel_count, dtype, data=data,
+                      timestamps=timestamps, cursor=header[0:1])
+    return header, ring
+
+
+def _create(shm_name, size):
+    """Create a shared memory block, replacing any left by an exited writer.
+
+    Raises:
+        FileExistsError: If a running process is writing to the block.
+    """
+    try:
+        return shared_memory.SharedMemory(name=shm_name, create=True,
+                                          size=size)
+    except FileExistsError:
+        existing = shared_memory.SharedMemory(name=shm_name)
+    pid = 0
+    if existing.size >= 8 * HEADER_SIZE:
+        header = np.ndarray((HEADER_SIZE,), dtype=np.uint64,
+                            buffer=existing.buf)
+        pid = int(header[4])
+        del header
+    if _is_running(pid):
+        existing.close()
+        raise FileExistsError("Shared memory block {} is in use by process {}"
+                              .format(shm_name, pid))
+    warn("Replacing stale shared memory block {}".format(shm_name))
+    existing.close()
+    existing.unlink()
+    return shared_memory.SharedMemory(name=shm_name, create=True, size=size)
+
+
+def _is_running(pid):
+    """Return whether a process is running, assuming so if unknown."""
+    if os.name == 'nt':
+        # blocks are freed with their last handle, so are never stale
+        return True
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Shared memory output requires Python 3.8+ "
+                           "(multiprocessing.shared_memory)")
+
+
+class SharedMemoryRing:
+    """Writes a stream's samples into a shared memory ring buffer."""
+
+    def __init__(self, device_id, name, channel_count, dtype, capacity):
+        """Create the shared memory block for a stream.
+
+        Args:
+            device_id (str): Source ID of the device providing the stream.
+            name (str): Name of the stream.
+            channel_count (int): Number of channels in the stream.
+            dtype (str or numpy.dtype): Numeric datatype of the samples.
+            capacity (int): Number of recent samples to keep.
+
+        Raises:
+            FileExistsError: If another running process writes the stream.
+        """
+        _require_shared_memory()
+        dtype = np.dtype(dtype)
+        size = (8 * HEADER_SIZE
+                + 2 * capacity * (8 + channel_count * dtype.itemsize))
+        self._shm = _create(shared_memory_name(device_id, name), size)
+        self._header, self._ring = _ring_from_buffer(self._shm.buf, capacity,
+                                                     channel_count, dtype)
+        self._header[:3] = (0, capacity, channel_count)
+        self._header[4] = os.getpid()
+        # marks the header complete, for readers attaching concurrently
+        self._header[3] = ord(dtype.char)
+
+    def write(self, samples, timestamps):
+        """Append samples and their timestamps to the ring buffer."""
+        self._ring.write(samples, timestamps)
+
+    def close(self):
+        """Release and remove the shared memory block."""
+        del self._header, self._ring
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedMemoryReader:
+    """Provides views of the latest samples of a stream in shared memory."""
+
+    def __init__(self, device_id, name):
+        """Attach to the shared memory block of a stream.
+
+        Args:
+            device_id (str): Source ID of the device providing the stream.
+                For example, `'Muse-1234'`, or `'Muse-DUMMY'` for a `Dummy`.
+            name (str): Name of the stream, e.g. `'EEG'`.
+
+        Raises:
+            FileNotFoundError: If the block does not exist, or is not yet
+                initialized.
+        """
+        _require_shared_memory()
+        self._shm = shared_memory.SharedMemory(
+            name=shared_memory_name(device_id, name))
+        header = np.ndarray((HEADER_SIZE,), dtype=np.uint64,
+                            buffer=self._shm.buf)
+        capacity, channel_count, dtype_char = (int(v) for v in header[1:4])
+        if not dtype_char:
+            del header
+            self._shm.close()
+            raise FileNotFoundError("Shared memory of {} stream of {} not yet "
+                                    "initialized".format(name, device_id))
+        self._header, self._ring = _ring_from_buffer(self._shm.buf, capacity,
+                                                     channel_count,
+                                                     chr(dtype_char))
+        del header
+
+    def latest(self, n_samples=None):
+        """Return views of the latest samples and their timestamps.
+
+        The views are not copies; they remain valid until the writer has
+        written another `capacity - n_samples` samples.
+
+        Args:
+            n_samples (int): Number of samples. All available by default.
+
+        Returns:
+            numpy.ndarray: Samples, with shape `(n, channel_count)`.
+            numpy.ndarray: Timestamps, with shape `(n,)`.
+        """
+        return self._ring.latest(n_samples)
+
+    def close(self):
+        """Detach from the shared memory block.
+
+        Views previously returned by `latest` must be released first.
+        """
+        del self._header, self._ring
+        self._shm.close()
+
+    @property
+    def capacity(self):
+        """Maximum number of recent samples available."""
+        return self._ring.capacity
+
+    @property
+    def n_written(self):
+        """Total number of samples written by the streamer."""
+        return self._ring.n_written
@@ -0,0 +1,188 @@
+"""Destinations for the chunks pushed by `ble2lsl` streamers.
+
+`BaseStreamer` fans each chunk out to one or more sinks. By default, a single
+`LSLSink` is used, which publishes each stream through an LSL outlet; other
+sinks may be substituted or added, e.g. to serve consumers on the same host
+through shared memory.
+
+All sinks should subclass `BaseSink`, and implement:
+
+    open(name, info): Prepare to receive chunks from a stream.
+        `info` is a dict of stream metadata, as returned by
+        `BaseStreamer._stream_info`, with the keys `source_id`, `type`,
+        `channel_count`, `nominal_srate`, `channel_format`, `numpy_dtype`,
+        `chunk_size`, `ch_names`, `units`, `manufacturer`, `address`,
+        `scale`, and `offset`. A `chunk_size` of 0 indicates chunks of
+        varying size. For streams published as raw integer counts, `scale`
+        and `offset` give the conversion to physical units,
+        `scale * (raw - offset)`; otherwise they are `None`.
+    push_chunk(name, chunk, timestamp): Receive a chunk from a stream.
+        `chunk` is a 2D array (samples by channels) and `timestamp` is the
+        time of its last sample. The chunk array may be reused by the
+        streamer after `push_chunk` returns, so sinks must copy any data they
+        keep. Chunks of different streams may be pushed concurrently, by a
+        `Streamer` with `transmit_groups`.
+    close(name): Release any resources held for a stream.
+"""
+
+import numpy as np
+import pylsl as lsl
+
+from ble2lsl import sharedmem
+
+INFO_ARGS = ['type', 'channel_count', 'nominal_srate', 'channel_format']
+
+
+def chunk_timestamps(timestamp, n_samples, srate):
+    """Return the timestamps of the samples in a chunk.
+
+    Args:
+        timestamp (float): Timestamp of the last sample in the chunk.
+        n_samples (int): Number of samples in the chunk.
+        srate (float): Nominal sample rate. If zero (irregular rate), all
+            samples are given the same timestamp.
+    """
+    if not srate:
+        return np.full(n_samples, timestamp)
+    return timestamp + np.arange(1 - n_samples, 1) / srate
+
+
+class BaseSink:
+    """Abstract parent for destinations of streamed chunks."""
+
+    def __init__(self, streams=None):
+        """Construct a sink.
+
+        Args:
+            streams (Iterable[str]): Names of the streams the sink receives.
+                By default, the sink receives all of the streamer's streams.
+        """
+        self._streams = None if streams is None else set(streams)
+
+    def accepts(self, name):
+        """Whether the sink should receive chunks from the named stream."""
+        return self._streams is None or name in self._streams
+
+    def open(self, name, info):
+        """Prepare to receive chunks from a stream."""
+        raise NotImplementedError()
+
+    def push_chunk(self, name, chunk, timestamp):
+        """Receive a chunk from a stream."""
+        raise NotImplementedError()
+
+    def close(self, name):
+        """Release any resources held for a stream."""
+        raise NotImplementedError()
+
+
+class LSLSink(BaseSink):
+    """Publishes each stream through an LSL outlet."""
+
+    def __init__(self, streams=None, max_buffered=360):
+        """Construct an `LSLSink`.
+
+        Args:
+            streams (Iterable[str]): Names of the streams to publish.
+            max_buffered (int): Seconds of data buffered by each outlet.
+        """
+        super().__init__(streams=streams)
+        self._max_buffered = max_buffered
+        self._info = {}
+        self._outlets = {}
+        self._push_func = {}
+
+    def open(self, name, info):
+        lsl_info = {arg: info[arg] for arg in INFO_ARGS}
+        outlet_name = '{}-{}'.format(info["source_id"], name)
+        self._info[name] = lsl.StreamInfo(outlet_name, **lsl_info,
+                                          source_id=info["source_id"])
+        self._add_device_info(name, info)
+        self._outlets[name] = lsl.StreamOutlet(self._info[name],
+                                               chunk_size=info["chunk_size"],
+                                               max_buffered=self._max_buffered)
+
+        # numeric chunks are pushed from the array, without conversion
+        # StreamOutlet.push_chunk doesn't like single-sample lists...
+        # but want to keep using push_chunk for intra-chunk timestamps
+        # doing this beforehand to avoid a chunk size check for each push
+        if info["channel_format"] != "string":
+            self._push_func[name] = self._push_array
+        elif info["chunk_size"] == 1:
+            self._push_func[name] = self._push_chunk_as_sample
+        else:
+            self._push_func[name] = self._push_chunk
+
+    def push_chunk(self, name, chunk, timestamp):
+        self._push_func[name](name, chunk, timestamp)
+
+    def close(self, name):
+        del self._outlets[name], self._info[name], self._push_func[name]
+
+    def _push_array(self, name, chunk, timestamp):
+        self._outlets[name].push_chunk(chunk, timestamp)
+
+    def _push_chunk(self, name, chunk, timestamp):
+        self._outlets[name].push_chunk(chunk.tolist(), timestamp)
+
+    def _push_chunk_as_sample(self, name, chunk, timestamp):
+        self._outlets[name].push_sample(chunk.tolist()[0], timestamp)
+
+    def _add_device_info(self, name, info):
+        """Adds device-specific parameters to the stream's LSL info."""
+        desc = self._info[name].desc()
+        if info["manufacturer"] is not None:
+            desc.append_child_value("manufacturer", info["manufacturer"])
+        desc.append_child_value("address", info["address"])
+        if info["scale"] is not None:
+            desc.append_child_value("scale", str(info["scale"]))
+            desc.append_child_value("offset", str(info["offset"]))
+
+        channels = desc.append_child("channels")
+        for ch_name, unit in zip(info["ch_names"], info["units"]):
+            channels.append_child("channel") \
+                .append_child_value("label", ch_name) \
+                .append_child_value("unit", unit) \
+                .append_child_value("type", info["type"])
+
+
+class SharedMemorySink(BaseSink):
+    """Publishes numeric streams to shared memory ring buffers.
+
+    Consumers on the same host can read the latest samples of a stream
+    without copying, using `ble2lsl.sharedmem.SharedMemoryReader`. Streams of
+    non-numeric types (e.g. strings) are ignored.
+    """
+
+    def __init__(self, streams=None, duration=sharedmem.DEFAULT_DURATION):
+        """Construct a `SharedMemorySink`.
+
+        Args:
+            streams (Iterable[str]): Names of the streams to publish.
+            duration (float): Seconds of recent samples kept for each stream.
+        """
+        super().__init__(streams=streams)
+        self._duration = duration
+        self._rings = {}
+        self._srates = {}
+
+    def open(self, name, info):
+        dtype = np.dtype(info["numpy_dtype"])
+        if not np.issubdtype(dtype, np.number):
+            return
+        srate = info["nominal_srate"]
+        capacity = max(info["chunk_size"], int(self._duration * srate), 1)
+        self._rings[name] = sharedmem.SharedMemoryRing(
+            info["source_id"], name, info["channel_count"], dtype, capacity)
+        self._srates[name] = srate
+
+    def push_chunk(self, name, chunk, timestamp):
+        ring = self._rings.get(name)
+        if ring is not None:
+            ring.write(chunk, chunk_timestamps(timestamp, chunk.shape[0],
+                                               self._srates[name]))
+
+    def close(self, name):
+        ring = self._rings.pop(name, None)
+        if ring is not None:
+            ring.close()
@@ -0,0 +1,117 @@
+"""Tracing of chunk latency through a `Streamer`, for diagnosing lag.
+
+When a `Tracer` is passed to a `Streamer`, each chunk is stamped at four
+points on its way from the device to the sinks:
+
+    arrival: the BLE notification of the packet that completed the chunk
+        is passed to the packet handler;
+    decoded: the packet handler enqueues the decoded chunk;
+    dequeued: the transmit thread takes the chunk from the queue;
+    pushed: the chunk has been pushed to all sinks (and processors).
+
+The stamps are kept in a bounded buffer, dropping the oldest chunks once
+full, and may be exported as Chrome trace-event JSON, viewable in
+`chrome://tracing` or https://ui.perfetto.dev: each device appears as a
+process, and each stream as a thread, with `decode`, `queue` and `push`
+spans per chunk. Without a tracer, streamers only check for one per chunk.
+
+Example:
+    tracer = Tracer()
+    streamer = Streamer(muse2016, tracer=tracer)
+    ...
+    tracer.export('trace.json')
+"""
+
+from collections import deque
+import json
+import time
+
+import numpy as np
+
+DEFAULT_CAPACITY = 100000
+"""Default number of chunks for which stamps are kept."""
+
+SPANS = [('decode', 'arrival', 'decoded'),
+         ('queue', 'decoded', 'dequeued'),
+         ('push', 'dequeued', 'pushed')]
+"""Name, and start and end stamps, of the spans between stamps."""
+
+STAMPS = ['arrival', 'decoded', 'dequeued', 'pushed']
+
+
+class Tracer:
+    """Keeps the latency stamps of recent chunks from one or more devices."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, clock=time.perf_counter):
+        """Construct a `Tracer`.
+
+        Args:
+            capacity (int): Maximum number of chunks for which to keep stamps.
+            clock (function): Returns the time (in seconds) for stamping.
+        """
+        self._records = deque(maxlen=capacity)
+        self.clock = clock
+
+    def record(self, device_id, name, chunk_idx, *stamps):
+        """Add the stamps of a chunk (in order of `STAMPS`)."""
+        self._records.append((device_id, name, chunk_idx) + stamps)
+
+    def clear(self):
+        """Discard all recorded stamps."""
+        self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
+
+    def latencies(self):
+        """Return the duration of each span, per device and stream.
+
+        Returns:
+            dict[Tuple[str, str], dict[str, np.ndarray]]: Durations (s) of
+                each span in `SPANS`, and of the `'total'` time from arrival
+                to push, by device ID and stream name.
+        """
+        stamps = {}
+        for device_id, name, _, *chunk_stamps in list(self._records):
+            stamps.setdefault((device_id, name), []).append(chunk_stamps)
+        latencies = {}
+        for key, chunk_stamps in stamps.items():
+            chunk_stamps = np.array(chunk_stamps)
+            latencies[key] = {span: (chunk_stamps[:, STAMPS.index(end)]
+                                     - chunk_stamps[:, STAMPS.index(start)])
+                              for span, start, end in SPANS}
+            latencies[key]['total'] = chunk_stamps[:, -1] - chunk_stamps[:, 0]
+        return latencies
+
+    def chrome_trace(self):
+        """Return the recorded stamps as a Chrome trace-event object."""
+        events = []
+        pids, tids = {}, {}
+        for device_id, name, chunk_idx, *chunk_stamps in list(self._records):
+            if device_id not in pids:
+                pids[device_id] = len(pids) + 1
+                events.append(_metadata_event('process_name', pids[device_id],
+                                              0, device_id))
+            pid = pids[device_id]
+            if (device_id, name) not in tids:
+                tids[(device_id, name)] = len(tids) + 1
+                events.append(_metadata_event('thread_name', pid,
+                                              tids[(device_id, name)], name))
+            tid = tids[(device_id, name)]
+            for span, start, end in SPANS:
+                t_start = chunk_stamps[STAMPS.index(start)]
+                t_end = chunk_stamps[STAMPS.index(end)]
+                events.append(dict(name=span, cat=name, ph='X', pid=pid,
+                                   tid=tid, ts=1e6 * t_start,
+                                   dur=1e6 * (t_end - t_start),
+                                   args=dict(chunk_idx=chunk_idx)))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def export(self, path):
+        """Write the recorded stamps to a Chrome trace-event JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def _metadata_event(kind, pid, tid, name):
+    return dict(name=kind, ph='M', pid=pid, tid=tid, args=dict(name=name))
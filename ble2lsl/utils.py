@@ -2,6 +2,8 @@
 
 from warnings import warn
 
+import numpy as np
+
 def invert_map(dict_):
     """Invert the keys and values in a dict."""
     inverted = {v: k for k, v in dict_.items()}
@@ -22,3 +24,14 @@ def dict_partial_from_keys(keys):
     def dict_partial(values):
         return dict(zip(keys, values))
     return dict_partial
+
+
+def missing_value(dtype):
+    """Return the value that marks missing data in arrays of `dtype`.
+
+    NaN for floating point types, and the minimum value for integer types.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).min
+    return np.nan
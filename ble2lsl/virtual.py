@@ -0,0 +1,384 @@
+"""Virtual BGAPI dongle, for testing the `'bgapi'` backend without hardware.
+
+`VirtualDongle` emulates a BLED112 on a pseudo-terminal, with a single
+virtual peripheral impersonating a device from `ble2lsl.devices`. Passing
+its `port` as the `interface` of a `Streamer` exercises the real
+`pygatt.BGAPIBackend`: the dongle responds to resets, scans, connection,
+characteristic discovery and attribute writes, and once the device's
+`stream_on` command is written, sends notifications on the subscribed
+characteristics.
+
+The notifications come from an iterable of `(time, handle, packet)`, with
+times in seconds from the start of streaming; by default, synthetic data for
+each of the device's streams, encoded by the device's `PacketEncoder` at the
+streams' nominal rates (see `synthetic_packets`). A capture of real packets
+may be replayed in the same way.
+
+Requires a POSIX system (for `pty`).
+
+Example:
+    dongle = VirtualDongle(muse2016)
+    streamer = Streamer(muse2016, interface=dongle.port, scan_timeout=1)
+"""
+
+import heapq
+import os
+import pty
+import random
+import select
+from struct import pack, unpack
+import threading
+import time
+import tty
+from uuid import UUID
+
+from ble2lsl.ble2lsl import NoisySinusoids, get_default_subscriptions
+
+EVENT = 0x80
+RESPONSE = 0x00
+
+CONNECTION_HANDLE = 0
+
+UUID_PRIMARY_SERVICE = 0x2800
+UUID_CHARACTERISTIC = 0x2803
+UUID_CLIENT_CONFIG = 0x2902
+"""16-bit UUIDs of GATT attribute types, as reported in discovery."""
+
+FIRST_HANDLE = 0x10
+"""First value handle allocated to characteristics without a known handle."""
+
+
+def gatt_handles(device):
+    """Return the value handle of each characteristic of a device.
+
+    Uses the handles in the device module's `HANDLE_NAMES`, where available,
+    assigned to the UUIDs of each stream (`PARAMS["ble"]`) in order;
+    otherwise allocates handles.
+
+    Returns:
+        dict[UUID, int]: Value handle of each characteristic.
+    """
+    ble_params = device.PARAMS["ble"]
+    known_handles = {}
+    for handle, name in sorted(getattr(device, 'HANDLE_NAMES', {}).items()):
+        known_handles.setdefault(name, []).append(handle)
+    next_handle = max([FIRST_HANDLE - 3]
+                      + [max(handles) for handles in known_handles.values()])
+
+    handles = {}
+    for name in device.STREAMS + ['send']:
+        uuids = ble_params[name]
+        if isinstance(uuids, (str, bytes)):
+            uuids = [uuids]
+        for i, uuid in enumerate(uuids):
+            if not uuid or UUID(uuid) in handles:
+                continue
+            try:
+                handles[UUID(uuid)] = known_handles[name][i]
+            except (KeyError, IndexError):
+                next_handle += 3
+                handles[UUID(uuid)] = next_handle
+    return handles
+
+
+def synthetic_packets(device, subscriptions=None,
+                      chunk_iterator=NoisySinusoids):
+    """Yield the packets of synthetic data from a device, indefinitely.
+
+    Args:
+        device: A device module in `ble2lsl.devices`, with a `PacketEncoder`.
+        subscriptions (Iterable[str]): The streams for which to generate
+            data. By default, the device's default streams with nonzero
+            nominal sample rates.
+        chunk_iterator (type): Class that iterates through chunks, given the
+            chunk shape and sample rate (as for `ble2lsl.Dummy`).
+
+    Yields:
+        Tuple[float, int, bytes]: The time (in seconds from the first
+            packet), handle and contents of each packet.
+    """
+    params = device.PARAMS["streams"]
+    if subscriptions is None:
+        subscriptions = get_default_subscriptions(device, pos_rate=True)
+    encoder = device.PacketEncoder()
+    timeline = []
+    for name in subscriptions:
+        shape = (params["chunk_size"][name], params["channel_count"][name])
+        srate = params["nominal_srate"][name]
+        chunks = iter(chunk_iterator(shape, srate))
+        timeline.append((0.0, name, chunks, shape[0] / srate))
+    heapq.heapify(timeline)
+    while timeline:
+        t, name, chunks, period = heapq.heappop(timeline)
+        for handle, packet in encoder.encode(name, next(chunks)):
+            yield t, handle, packet
+        heapq.heappush(timeline, (t + period, name, chunks, period))
+
+
+class VirtualDongle:
+    """Emulates a BGAPI dongle connected to a single device."""
+
+    def __init__(self, device, address='00:55:DA:B0:00:01', name=None,
+                 packets=None, speed=1.0, unresponsive=0, loss=None):
+        """Open the pseudo-terminal, and start responding to commands.
+
+        Args:
+            device: The device module (in `ble2lsl.devices`) to impersonate.
+            address (str): MAC address of the virtual device.
+            name (str): Advertised name. By default, the device's `NAME`
+                followed by the end of `address`.
+            packets (function): Returns an iterable of
+                `(time, handle, packet)` to send, each time streaming is
+                started. Packets with a handle of `None` are sent on the
+                device's first characteristic. By default, returns
+                `synthetic_packets(device)`.
+            speed (float): Multiplies the rate at which packets are sent.
+                If `None`, packets are sent as fast as they are read.
+            unresponsive (int): Number of commands to ignore after opening,
+                e.g. to simulate a dongle that is slow to boot.
+            loss (function): Returns the fraction of notifications to drop,
+                given the current connection interval (in units of 1.25 ms),
+                e.g. to model a link that cannot carry the device's data
+                at long intervals. By default, no notifications are dropped.
+        """
+        self._device = device
+        self._address = address
+        if name is None:
+            name = '{}-{}'.format(device.NAME,
+                                  address.replace(':', '')[-4:])
+        self._name = name
+        if packets is None:
+            def packets():
+                return synthetic_packets(device)
+        self._packets = packets
+        self._speed = speed
+        self._n_unresponsive = unresponsive
+        self._loss = loss
+        self._random = random.Random(0)
+        self._interval = None
+
+        self._handles = gatt_handles(device)
+        ble_params = device.PARAMS["ble"]
+        self._default_handle = min(self._handles.values())
+        self._send_handle = self._handles[UUID(ble_params["send"])]
+        self._stream_on = bytes(ble_params["stream_on"])
+        self._stream_off = bytes(ble_params["stream_off"])
+        self._notifying = set()
+        self._connected = False
+        self._n_notifications = 0
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self._write_lock = threading.Lock()
+        self._proceed = True
+        self._scanning = threading.Event()
+        self._streaming = threading.Event()
+        self._threads = [threading.Thread(target=target, daemon=True)
+                         for target in (self._serve, self._advertise,
+                                        self._notify)]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """Stop the dongle and close the pseudo-terminal."""
+        self._proceed = False
+        self._streaming.set()
+        self._scanning.set()
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    @property
+    def port(self):
+        """Name of the serial port, to pass as a `Streamer`'s `interface`."""
+        return os.ttyname(self._slave)
+
+    @property
+    def connection_interval(self):
+        """The current connection interval, in units of 1.25 ms."""
+        return self._interval
+
+    @property
+    def n_notifications(self):
+        """Number of notifications sent."""
+        return self._n_notifications
+
+    def _serve(self):
+        """Run in thread to read and respond to commands."""
+        buffer = bytearray()
+        while self._proceed:
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            buffer += os.read(self._master, 4096)
+            while len(buffer) >= 4:
+                length = ((buffer[0] & 0x07) << 8) + buffer[1]
+                if len(buffer) < 4 + length:
+                    break
+                command = bytes(buffer[:4 + length])
+                del buffer[:4 + length]
+                if self._n_unresponsive:
+                    self._n_unresponsive -= 1
+                    continue
+                self._handle_command(command[2], command[3], command[4:])
+
+    def _handle_command(self, cls, cmd, payload):
+        """Respond to a command, by its class and command IDs."""
+        if (cls, cmd) == (0, 0):
+            # system_reset; no response
+            self._stop_streaming()
+        elif (cls, cmd) == (0, 2):
+            self._send(RESPONSE, 0, 2, _address_bytes(self._address))
+        elif (cls, cmd) == (5, 1):
+            # sm_set_bondable_mode
+            self._send(RESPONSE, 5, 1, b'')
+        elif (cls, cmd) == (5, 5):
+            # sm_get_bonds
+            self._send(RESPONSE, 5, 5, pack('<B', 0))
+        elif cls == 6 and cmd in (1, 7):
+            # gap_set_mode, gap_set_scan_parameters
+            self._send(RESPONSE, cls, cmd, pack('<H', 0))
+        elif (cls, cmd) == (6, 2):
+            # gap_discover
+            self._send(RESPONSE, 6, 2, pack('<H', 0))
+            self._scanning.set()
+        elif (cls, cmd) == (6, 4):
+            # gap_end_procedure
+            self._scanning.clear()
+            self._send(RESPONSE, 6, 4, pack('<H', 0))
+        elif (cls, cmd) == (6, 3):
+            self._connect(payload)
+        elif (cls, cmd) == (4, 3):
+            self._find_information()
+        elif cls == 4 and cmd in (5, 6):
+            # attclient_attribute_write, attclient_write_command
+            _, handle, length = unpack('<BHB', payload[:4])
+            self._send(RESPONSE, 4, cmd, pack('<BH', CONNECTION_HANDLE, 0))
+            if cmd == 5:
+                self._send(EVENT, 4, 1,
+                           pack('<BHH', CONNECTION_HANDLE, 0, handle))
+            self._write(handle, bytes(payload[4:4 + length]))
+        elif (cls, cmd) == (3, 0):
+            # connection_disconnect
+            self._send(RESPONSE, 3, 0, pack('<BH', CONNECTION_HANDLE, 0))
+            self._disconnect()
+        elif (cls, cmd) == (3, 1):
+            # connection_get_rssi
+            self._send(RESPONSE, 3, 1, pack('<Bb', CONNECTION_HANDLE, -50))
+        elif (cls, cmd) == (3, 2):
+            self._update_connection(payload)
+
+    def _connect(self, payload):
+        address = bytes(payload[:6])
+        address_type, interval_min, interval_max, timeout, latency = \
+            unpack('<BHHHH', payload[6:15])
+        self._send(RESPONSE, 6, 3, pack('<HB', 0, CONNECTION_HANDLE))
+        if address != _address_bytes(self._address):
+            # no such device; the connection attempt times out
+            return
+        self._connected = True
+        self._interval = interval_max
+        flags = 0x01 | 0x04  # connected, completed
+        self._send(EVENT, 3, 0,
+                   pack('<BB6BBHHHB', CONNECTION_HANDLE, flags, *address,
+                        address_type, interval_max, timeout, latency, 0xff))
+
+    def _update_connection(self, payload):
+        """Accept new connection parameters, taking the maximum interval."""
+        _, interval_min, interval_max, latency, timeout = \
+            unpack('<BHHHH', payload[:9])
+        self._send(RESPONSE, 3, 2, pack('<BH', CONNECTION_HANDLE, 0))
+        self._interval = interval_max
+        flags = 0x01 | 0x04 | 0x08  # connected, completed, parameters changed
+        self._send(EVENT, 3, 0,
+                   pack('<BB6BBHHHB', CONNECTION_HANDLE, flags,
+                        *_address_bytes(self._address), 0, interval_max,
+                        timeout, latency, 0xff))
+
+    def _disconnect(self):
+        self._stop_streaming()
+        if self._connected:
+            self._connected = False
+            self._send(EVENT, 3, 4, pack('<BH', CONNECTION_HANDLE, 0x16))
+
+    def _find_information(self):
+        """Report the attributes of the GATT table, in order of handle."""
+        self._send(RESPONSE, 4, 3, pack('<BH', CONNECTION_HANDLE, 0))
+        self._send_information(FIRST_HANDLE - 15,
+                               pack('<H', UUID_PRIMARY_SERVICE))
+        for uuid, handle in sorted(self._handles.items(),
+                                   key=lambda item: item[1]):
+            self._send_information(handle - 1, pack('<H', UUID_CHARACTERISTIC))
+            self._send_information(handle, uuid.bytes[::-1])
+            self._send_information(handle + 1, pack('<H', UUID_CLIENT_CONFIG))
+        self._send(EVENT, 4, 1, pack('<BHH', CONNECTION_HANDLE, 0, 0xffff))
+
+    def _send_information(self, handle, uuid_bytes):
+        self._send(EVENT, 4, 4, pack('<BHB', CONNECTION_HANDLE, handle,
+                                     len(uuid_bytes)) + uuid_bytes)
+
+    def _write(self, handle, value):
+        """Apply a write to a characteristic or its configuration."""
+        if handle - 1 in self._handles.values():
+            # client characteristic configuration
+            if value[:1] == b'\x01':
+                self._notifying.add(handle - 1)
+            else:
+                self._notifying.discard(handle - 1)
+        if handle == self._send_handle:
+            if value == self._stream_on:
+                self._streaming.set()
+            elif value == self._stream_off:
+                self._stop_streaming()
+
+    def _stop_streaming(self):
+        self._streaming.clear()
+
+    def _advertise(self):
+        """Run in thread to send scan responses while scanning."""
+        name = self._name.encode()
+        data = bytes([len(name) + 1, 0x09]) + name  # complete local name
+        address = _address_bytes(self._address)
+        while self._proceed:
+            self._scanning.wait()
+            if not self._proceed:
+                break
+            self._send(EVENT, 6, 0, pack('<bB6BBBB', -50, 0x04, *address,
+                                         0, 0xff, len(data)) + data)
+            time.sleep(0.05)
+
+    def _notify(self):
+        """Run in thread to send notifications while streaming."""
+        while self._proceed:
+            self._streaming.wait()
+            start = time.monotonic()
+            for t, handle, packet in self._packets():
+                if not (self._proceed and self._streaming.is_set()):
+                    break
+                if self._speed is not None:
+                    delay = start + t / self._speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if handle is None:
+                    handle = self._default_handle
+                if self._loss is not None:
+                    if self._random.random() < self._loss(self._interval):
+                        continue
+                if handle in self._notifying:
+                    self._send(EVENT, 4, 5,
+                               pack('<BHBB', CONNECTION_HANDLE, handle, 1,
+                                    len(packet)) + packet)
+                    self._n_notifications += 1
+
+    def _send(self, message_type, cls, cmd, payload):
+        length = len(payload)
+        header = bytes([message_type | (length >> 8 & 0x07), length & 0xff,
+                        cls, cmd])
+        with self._write_lock:
+            os.write(self._master, header + payload)
+
+
+def _address_bytes(address):
+    """Convert a MAC address string to BGAPI (little-endian) bytes."""
+    return bytes.fromhex(address.replace(':', ''))[::-1]
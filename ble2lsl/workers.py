@@ -0,0 +1,282 @@
+"""Decoding of BLE packets in worker processes.
+
+By default, a `Streamer` decodes packets on the `pygatt` notification thread
+and pushes chunks from its transmit thread, so that with many devices in one
+process, the global interpreter lock limits total throughput to one core. A
+`DecoderPool` instead forwards the raw packets of each device, in batches, to
+one of several worker processes, which run the device's `PacketHandler` and
+push the decoded chunks to the device's sinks; so aggregate decoding
+throughput scales with the number of cores.
+
+Each device is assigned to a single worker, which keeps its packets in order.
+The sinks and processors of a device are opened in the worker, so must be
+picklable; decoded chunks are available to other processes through the sinks,
+e.g. LSL outlets, or shared memory with `ble2lsl.sinks.SharedMemorySink`.
+Commands sent by packet handlers (e.g. to enable a Ganglion's accelerometer)
+are written to the device from the main process.
+
+Workers are started with the `'spawn'` method, so scripts using a pool must
+guard their entry point with `if __name__ == '__main__':`.
+
+Example:
+    pool = DecoderPool(n_workers=4)
+    streamers = [Streamer(muse2016, address=address, pool=pool)
+                 for address in addresses]
+"""
+
+import multiprocessing
+import os
+from queue import Queue
+import threading
+import traceback
+from warnings import warn
+
+import ble2lsl.devices
+from ble2lsl.ble2lsl import BaseStreamer, Streamer
+
+DEFAULT_BATCH_SIZE = 64
+"""Maximum number of packets forwarded to a worker at once."""
+
+_STOP = None
+
+
+class DecoderPool:
+    """Worker processes for decoding the packets of multiple devices."""
+
+    def __init__(self, n_workers=None, batch_size=DEFAULT_BATCH_SIZE):
+        """Start the worker processes.
+
+        Args:
+            n_workers (int): Number of worker processes. By default, the
+                number of CPUs.
+            batch_size (int): Maximum number of packets forwarded at once.
+                Packets are forwarded as soon as possible; larger batches
+                only form while the workers are busy.
+        """
+        n_workers = n_workers or os.cpu_count() or 1
+        self._batch_size = batch_size
+        context = multiprocessing.get_context('spawn')
+        self._results = context.Queue()
+        self._inboxes = [context.Queue() for _ in range(n_workers)]
+        self._workers = [context.Process(target=_decode,
+                                         args=(inbox, self._results),
+                                         daemon=True)
+                         for inbox in self._inboxes]
+        for worker in self._workers:
+            worker.start()
+
+        self._streamers = {}
+        self._assignments = {}
+        self._closed = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        # packets are forwarded from a thread, to keep BLE callbacks short
+        self._packets = Queue()
+        self._forward_thread = threading.Thread(target=self._forward,
+                                                daemon=True)
+        self._forward_thread.start()
+        self._receive_thread = threading.Thread(target=self._receive,
+                                                daemon=True)
+        self._receive_thread.start()
+
+    def register(self, streamer):
+        """Assign a connected `Streamer`'s device to a worker.
+
+        Opens the streamer's sinks in the worker.
+
+        Args:
+            streamer (ble2lsl.Streamer): The streamer, after its device
+                address and ID have been resolved.
+
+        Returns:
+            function: Callback for the device's BLE notifications, which
+                forwards `(handle, packet)` to the worker.
+        """
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            # assign to the worker with the fewest devices
+            counts = [list(self._assignments.values()).count(i)
+                      for i in range(len(self._workers))]
+            worker_idx = counts.index(min(counts))
+            self._streamers[key] = streamer
+            self._assignments[key] = worker_idx
+            self._closed[key] = threading.Event()
+        streamer._pool_key = key
+        self._inboxes[worker_idx].put(('open', key,
+                                       _worker_config(streamer)))
+
+        def process_packet(handle, packet):
+            self._packets.put((key, handle, bytes(packet)))
+        return process_packet
+
+    def unregister(self, streamer, timeout=5):
+        """Close a streamer's sinks in its worker, after any pending packets.
+
+        Blocks until the sinks are closed, and updates the streamer's
+        `missing_chunks` and `dropped_chunks` from the worker.
+        """
+        key = streamer._pool_key
+        self._packets.put((key, None, None))
+        if not self._closed[key].wait(timeout):
+            warn("Timed out closing {} in worker".format(key))
+        with self._lock:
+            del self._streamers[key], self._assignments[key]
+            del self._closed[key]
+
+    def close(self):
+        """Unregister all streamers and stop the workers."""
+        for streamer in list(self._streamers.values()):
+            self.unregister(streamer)
+        self._packets.put(_STOP)
+        self._forward_thread.join()
+        for inbox in self._inboxes:
+            inbox.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(_STOP)
+        self._receive_thread.join()
+
+    def _forward(self):
+        """Run in thread to forward batches of packets to the workers."""
+        while True:
+            item = self._packets.get()
+            if item is _STOP:
+                break
+            batches = {}
+            n_packets = 0
+            while True:
+                key, handle, packet = item
+                if packet is None:
+                    # flush this device's packets before closing it
+                    self._send_batch(key, batches.pop(key, None))
+                    worker_idx = self._assignments.get(key)
+                    if worker_idx is not None:
+                        self._inboxes[worker_idx].put(('close', key, None))
+                else:
+                    batches.setdefault(key, []).append((handle, packet))
+                n_packets += 1
+                if n_packets >= self._batch_size or self._packets.empty():
+                    break
+                item = self._packets.get()
+                if item is _STOP:
+                    self._packets.put(_STOP)
+                    break
+            for key, batch in batches.items():
+                self._send_batch(key, batch)
+
+    def _send_batch(self, key, batch):
+        """Send a batch of packets to its device's worker, if registered.
+
+        Packets that arrive after their device is unregistered are dropped.
+        """
+        worker_idx = self._assignments.get(key)
+        if batch and worker_idx is not None:
+            self._inboxes[worker_idx].put(('packets', key, batch))
+
+    def _receive(self):
+        """Run in thread to handle messages from the workers."""
+        while True:
+            message = self._results.get()
+            if message is _STOP:
+                break
+            kind, key, payload = message
+            streamer = self._streamers.get(key)
+            if streamer is None:
+                continue
+            if kind == 'command':
+                streamer.send_command(payload)
+            elif kind == 'closed':
+                if payload is not None:
+                    streamer._n_missing, streamer._n_dropped = payload
+                self._closed[key].set()
+            elif kind == 'error':
+                warn("Error decoding packets in worker:\n{}".format(payload))
+
+    @property
+    def n_workers(self):
+        """The number of worker processes."""
+        return len(self._workers)
+
+
+def _worker_config(streamer):
+    """Return the arguments to reconstruct a streamer in a worker."""
+    return dict(device_name=streamer._device.__name__.split('.')[-1],
+                device_id=streamer._device_id,
+                address=streamer._address,
+                subscriptions=streamer._subscriptions,
+                time_func=streamer._time_func,
+                ch_names=streamer._user_ch_names,
+                sinks=streamer._sinks,
+                processors=streamer._processors,
+                raw=streamer._raw,
+                internal_timestamps=streamer._internal_timestamps,
+                fill_missing=streamer._fill_missing)
+
+
+class _WorkerStreamer(Streamer):
+    """Decodes and pushes the packets of one device in a worker process."""
+
+    def __init__(self, key, results, device_name, device_id, address,
+                 internal_timestamps, fill_missing, **kwargs):
+        device = getattr(ble2lsl.devices, device_name)
+        BaseStreamer.__init__(self, device, **kwargs)
+        self._init_transmit(False, fill_missing)
+        self._internal_timestamps = internal_timestamps
+        self._transmit_queue = Queue()
+        self._transmit_queues = dict.fromkeys(self._device.STREAMS,
+                                              self._transmit_queue)
+        self._key = key
+        self._results = results
+        self._device_id = device_id
+        self._address = address
+        self._init_sinks()
+        self._packet_handler = self._device.PacketHandler(self)
+
+    def process_packets(self, packets):
+        """Decode a batch of packets, and push the resulting chunks."""
+        for handle, packet in packets:
+            self._packet_handler.process_packet(handle, packet)
+        self._push_enqueued()
+
+    def _push_enqueued(self):
+        while not self._transmit_queue.empty():
+            self._transmit_item(self._transmit_queue.get())
+
+    def send_command(self, value):
+        """Forward a command to the main process, to write to the device."""
+        self._results.put(('command', self._key, value))
+
+    def close(self):
+        """Push pending chunks, close the sinks, and return chunk counts."""
+        try:
+            self._packet_handler.flush()
+            self._push_enqueued()
+            self._close_sinks()
+        finally:
+            self._results.put(('closed', self._key,
+                               (self._n_missing, self._n_dropped)))
+
+
+def _decode(inbox, results):
+    """Run in worker process to decode the packets of assigned devices."""
+    streamers = {}
+    while True:
+        message = inbox.get()
+        if message is _STOP:
+            break
+        kind, key, payload = message
+        try:
+            if kind == 'packets':
+                streamers[key].process_packets(payload)
+            elif kind == 'open':
+                streamers[key] = _WorkerStreamer(key, results, **payload)
+            elif kind == 'close':
+                if key in streamers:
+                    streamers.pop(key).close()
+                else:
+                    # failed to open
+                    results.put(('closed', key, None))
+        except Exception:
+            results.put(('error', key, traceback.format_exc()))
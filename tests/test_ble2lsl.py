@@ -1,9 +1,12 @@
 
 import ble2lsl as b2l
 from ble2lsl.devices import *
+from ble2lsl.sinks import BaseSink
 
 import time
 
+import numpy as np
+
 import pytest
 
 @pytest.fixture(scope='module', params=b2l.devices.DEVICE_NAMES)
@@ -133,3 +136,993 @@ class TestDummy:
 
 class TestNoisySinusoids:
     pass
+
+
+class ListSink(BaseSink):
+    """Keeps copies of all pushed chunks and their timestamps."""
+
+    def __init__(self, streams=None):
+        super().__init__(streams=streams)
+        self.chunks = {}
+        self.info = {}
+
+    def open(self, name, info):
+        self.chunks[name] = []
+        self.info[name] = info
+
+    def push_chunk(self, name, chunk, timestamp):
+        self.chunks[name].append((np.copy(chunk), timestamp))
+
+    def close(self, name):
+        pass
+
+
+def run_async(coro):
+    """Run a coroutine on a new event loop, as `asyncio.run` (Python 3.7+)."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def init_sinks(streamer):
+    """Open the sinks of a `Streamer` without connecting to a device."""
+    streamer._device_id, streamer._address = "TEST", "TEST"
+    streamer._init_sinks()
+
+
+def test_fill_missing(device):
+    sink = ListSink()
+    streamer = b2l.Streamer(device, autostart=False, fill_missing=True,
+                            sinks=[sink])
+    init_sinks(streamer)
+    name = 'EEG'
+    pushed = sink.chunks[name]
+    chunk = np.ones(streamer._chunks[name].shape)
+    for chunk_idx in [10, 11, 14, 12, 14, 15]:
+        streamer._transmit_chunk(name, chunk_idx, chunk)
+
+    # chunks 12 and 13 filled, late 12 and duplicate 14 dropped
+    assert len(pushed) == 6
+    assert streamer.missing_chunks[name] == 2
+    assert streamer.dropped_chunks[name] == 2
+    assert all(np.all(np.isnan(pushed[i][0])) for i in [2, 3])
+    assert not np.any(np.isnan(pushed[4][0]))
+    timestamps = np.array([timestamp for _, timestamp in pushed])
+    assert np.allclose(np.diff(timestamps), streamer._chunk_period[name],
+                       atol=1e-6)
+
+
+def test_unwrap_idx(device):
+    streamer = b2l.Streamer(device, autostart=False)
+    handler = device.PacketHandler(streamer)
+    modulus = 2 ** 16
+    raw_ids = [modulus - 2, modulus - 1, 0, 1, 3]
+    idxs = [handler._unwrap_idx('test', raw_id, modulus) for raw_id in raw_ids]
+    assert idxs == [modulus - 2, modulus - 1, modulus, modulus + 1,
+                    modulus + 3]
+    # late arrival within the reorder window
+    assert handler._unwrap_idx('test', 2, modulus, reorder_window=4) \
+        == modulus + 2
+    assert handler._unwrap_idx('test', 4, modulus) == modulus + 4
+
+
+def test_muse_eeg_reassembly():
+    import bitstring
+    streamer = b2l.Streamer(muse2016, autostart=False)
+    handler = muse2016.PacketHandler(streamer)
+    eeg_format = muse2016.PACKET_FORMATS['EEG']
+    handles = sorted(muse2016.EEG_HANDLE_CH_IDXS)
+
+    def packet(packet_id, handle):
+        values = [muse2016.EEG_HANDLE_CH_IDXS[handle] + 2048] * 12
+        return bitstring.pack(eeg_format, packet_id, *values).bytes
+
+    # interleave packets of consecutive IDs, out of the usual order
+    for handle in handles:
+        handler.process_packet(handle, packet(7, handle))
+        if handle != handles[-1]:
+            handler.process_packet(handle, packet(6, handle))
+    handler.process_packet(handles[-1], packet(6, handles[-1]))
+
+    ch_values = muse2016.CONVERT_FUNCS['EEG'](
+        np.array([muse2016.EEG_HANDLE_CH_IDXS[handle] + 2048
+                  for handle in handles]))
+    for chunk_idx in [6, 7]:
+        name, idx, chunk = streamer._transmit_queue.get_nowait()
+        assert (name, idx) == ('EEG', chunk_idx)
+        assert np.allclose(chunk, ch_values)
+    assert streamer._transmit_queue.empty()
+    assert handler.partial_chunks == 0
+
+
+def test_muse_eeg_flush():
+    streamer = b2l.Streamer(muse2016, autostart=False,
+                            subscriptions=['EEG', 'accelerometer'])
+    handler = muse2016.PacketHandler(streamer)
+    encoder = muse2016.PacketEncoder()
+    eeg = np.zeros(streamer._chunks['EEG'].shape)
+    accelerometer = np.zeros(streamer._chunks['accelerometer'].shape)
+    queue = streamer._transmit_queue
+
+    def queued_eeg():
+        items = []
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        return [item for item in items if item[0] == 'EEG']
+
+    # last chunk of each burst is missing a channel, with no EEG after it
+    for handle, packet in encoder.encode('EEG', eeg)[:-1]:
+        handler.process_packet(handle, packet)
+    time.sleep(muse2016.EEG_REASSEMBLY_TIMEOUT)
+    for handle, packet in encoder.encode('accelerometer', accelerometer):
+        handler.process_packet(handle, packet)
+    (_, _, chunk), = queued_eeg()
+    assert np.isnan(chunk).any(axis=0).sum() == 1
+
+    for handle, packet in encoder.encode('EEG', eeg)[:-1]:
+        handler.process_packet(handle, packet)
+    assert not queued_eeg()
+    handler.flush()
+    (_, idx, chunk), = queued_eeg()
+    assert idx == 1
+    assert np.isnan(chunk).any(axis=0).sum() == 1
+    assert handler.partial_chunks == 2
+
+
+def test_muse_eeg_flush_arrival():
+    import itertools
+    from ble2lsl.tracing import Tracer
+    tracer = Tracer(clock=itertools.count().__next__)
+    streamer = b2l.Streamer(muse2016, autostart=False, tracer=tracer,
+                            subscriptions=['EEG', 'accelerometer'])
+    handler = muse2016.PacketHandler(streamer)
+    encoder = muse2016.PacketEncoder()
+    eeg = np.zeros(streamer._chunks['EEG'].shape)
+    accelerometer = np.zeros(streamer._chunks['accelerometer'].shape)
+    queue = streamer._transmit_queue
+
+    # partial chunk flushed on a later, non-EEG packet
+    eeg_packets = encoder.encode('EEG', eeg)[:-1]
+    for handle, packet in eeg_packets:
+        handler.trace_packet(handle, packet)
+    last_arrival = handler._arrival_time
+    time.sleep(muse2016.EEG_REASSEMBLY_TIMEOUT)
+    for handle, packet in encoder.encode('accelerometer', accelerometer):
+        handler.trace_packet(handle, packet)
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    (_, _, _, (arrival, _)), = [item for item in items if item[0] == 'EEG']
+    assert arrival == last_arrival < handler._arrival_time
+
+
+def test_raw_output(device):
+    name = 'EEG'
+    params = device.PARAMS['streams']
+    sink = ListSink()
+    dummy = b2l.Dummy(device, autostart=False, raw=[name], sinks=[sink])
+    assert dummy._chunks[name].dtype == params['raw_channel_format'][name]
+    info = sink.info[name]
+    assert info['channel_format'] == params['raw_channel_format'][name]
+    assert info['scale'] == params['raw_scale'][name]
+    assert info['offset'] == params['raw_offset'][name]
+    assert all(sink.info[other]['scale'] is None
+               for other in dummy.subscriptions if other != name)
+    dummy.close()
+    with pytest.raises(ValueError):
+        b2l.Dummy(device, autostart=False, raw=[device.STREAMS[-1]])
+
+
+def test_muse_raw_eeg():
+    import bitstring
+    streamer = b2l.Streamer(muse2016, autostart=False, raw=['EEG'])
+    handler = muse2016.PacketHandler(streamer)
+    values = list(range(2000, 2012))
+    for handle in muse2016.EEG_HANDLE_CH_IDXS:
+        packet = bitstring.pack(muse2016.PACKET_FORMATS['EEG'], 3, *values)
+        handler.process_packet(handle, packet.bytes)
+    name, idx, chunk = streamer._transmit_queue.get_nowait()
+    assert chunk.dtype == np.int16
+    assert np.array_equal(chunk, np.repeat(np.array(values)[:, None], 5, 1))
+
+
+def test_decoder_pool():
+    import bitstring
+    from ble2lsl.sharedmem import SharedMemoryReader
+    from ble2lsl.sinks import SharedMemorySink
+    from ble2lsl.workers import DecoderPool
+    pool = DecoderPool(n_workers=2)
+    streamer = b2l.Streamer(muse2016, subscriptions=['EEG'], autostart=False,
+                            sinks=[SharedMemorySink()], pool=pool)
+    streamer._device_id, streamer._address = "POOLTEST", "TEST"
+    process_packet = pool.register(streamer)
+    n_chunks = 10
+    for packet_id in [*range(4), *range(5, n_chunks)]:
+        for handle, ch_idx in muse2016.EEG_HANDLE_CH_IDXS.items():
+            values = [2048 + ch_idx] * 12
+            packet = bitstring.pack(muse2016.PACKET_FORMATS['EEG'],
+                                    packet_id, *values)
+            process_packet(handle, packet.bytes)
+
+    deadline = time.time() + 30
+    reader = None
+    while time.time() < deadline:
+        try:
+            reader = reader or SharedMemoryReader("POOLTEST", 'EEG')
+            if reader.n_written == (n_chunks - 1) * 12:
+                break
+        except FileNotFoundError:
+            pass
+        time.sleep(0.05)
+    samples, _ = reader.latest()
+    assert samples.shape == ((n_chunks - 1) * 12, 5)
+    assert np.allclose(samples, 0.48828125 * np.arange(5))
+    del samples
+    reader.close()
+    pool.unregister(streamer)
+    assert streamer.missing_chunks['EEG'] == 1
+    # late packets of an unregistered device are dropped
+    process_packet(handle, packet.bytes)
+    pool._packets.put((streamer._pool_key, None, None))
+    while not pool._packets.empty():
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert pool._forward_thread.is_alive()
+    pool.close()
+
+
+def test_virtual_dongle():
+    from ble2lsl.virtual import VirtualDongle
+    dongle = VirtualDongle(muse2016)
+    sink = ListSink()
+    streamer = b2l.Streamer(muse2016, interface=dongle.port, scan_timeout=0.3,
+                            subscriptions=['EEG'], sinks=[sink])
+    time.sleep(1)
+    streamer.disconnect()
+    dongle.close()
+    assert streamer._device_id == 'Muse-0001'
+    assert len(sink.chunks['EEG']) > 10
+    assert dongle.n_notifications >= 5 * len(sink.chunks['EEG'])
+    chunk, _ = sink.chunks['EEG'][-1]
+    assert not np.any(np.isnan(chunk))
+
+
+def test_runtime_subscriptions():
+    from ble2lsl.virtual import VirtualDongle
+    dongle = VirtualDongle(muse2016)
+    sink = ListSink()
+    streamer = b2l.Streamer(muse2016, interface=dongle.port, scan_timeout=0.3,
+                            subscriptions=['EEG'], sinks=[sink])
+    time.sleep(0.5)
+    streamer.subscribe('accelerometer')
+    time.sleep(0.5)
+    streamer.unsubscribe('EEG')
+    n_eeg_chunks = len(sink.chunks['EEG'])
+    n_acc_chunks = len(sink.chunks['accelerometer'])
+    time.sleep(0.5)
+    streamer.disconnect()
+    dongle.close()
+    assert streamer.subscriptions == ('accelerometer',)
+    assert n_eeg_chunks > 10 and n_acc_chunks > 5
+    assert len(sink.chunks['EEG']) == n_eeg_chunks
+    assert len(sink.chunks['accelerometer']) > n_acc_chunks
+    # timing of the accelerometer stream is independent of EEG
+    timestamps = [timestamp for _, timestamp in sink.chunks['accelerometer']]
+    assert np.allclose(np.diff(timestamps),
+                       streamer._chunk_period['accelerometer'])
+    with pytest.raises(ValueError):
+        streamer.subscribe('not a stream')
+
+
+def test_restart_cycles():
+    import threading
+    import tracemalloc
+    from ble2lsl.virtual import VirtualDongle
+    dongle = VirtualDongle(muse2016)
+    dummy_sink, streamer_sink = ListSink(), ListSink()
+    dummy = b2l.Dummy(muse2016, subscriptions=['EEG'], autostart=False,
+                      device_id='Muse-CYCLES', sinks=[dummy_sink])
+    streamer = b2l.Streamer(muse2016, interface=dongle.port, scan_timeout=0.3,
+                            subscriptions=['EEG'], sinks=[streamer_sink])
+    time.sleep(0.3)
+    n_threads = threading.active_count()
+    tracemalloc.start()
+    try:
+        for _ in range(300):
+            dummy.start()
+            dummy.stop()
+            dummy_sink.chunks['EEG'].clear()
+            streamer.stop()
+            streamer.start()
+        assert threading.active_count() == n_threads
+        assert tracemalloc.get_traced_memory()[0] < 100000
+    finally:
+        tracemalloc.stop()
+    time.sleep(0.3)
+    assert len(streamer_sink.chunks['EEG']) > 0
+
+    # reconnect, and stream again after disconnection
+    streamer.disconnect()
+    assert threading.active_count() == n_threads - 2
+    streamer.connect()
+    streamer.start()
+    time.sleep(0.3)
+    streamer.close()
+    dongle.close()
+    assert len(streamer_sink.chunks['EEG']) > 0
+    assert not any(thread.is_alive() for thread in dummy._threads.values())
+
+
+class SlowSink(ListSink):
+    """Stalls on each push of the streams given."""
+
+    def __init__(self, slow_streams, delay):
+        super().__init__()
+        self.slow_streams = slow_streams
+        self.delay = delay
+
+    def push_chunk(self, name, chunk, timestamp):
+        if name in self.slow_streams:
+            time.sleep(self.delay)
+        super().push_chunk(name, chunk, timestamp)
+
+
+def test_transmit_groups():
+    from ble2lsl.tracing import Tracer
+    from ble2lsl.virtual import VirtualDongle
+    with pytest.raises(ValueError):
+        b2l.Streamer(muse2016, autostart=False, transmit_groups=[['EGG']])
+    with pytest.raises(ValueError):
+        b2l.Streamer(muse2016, autostart=False,
+                     transmit_groups=[['EEG'], ['EEG', 'gyroscope']])
+
+    dongle = VirtualDongle(muse2016)
+    sink = SlowSink(['accelerometer'], 0.2)
+    tracer = Tracer()
+    streamer = b2l.Streamer(muse2016, interface=dongle.port, scan_timeout=0.3,
+                            subscriptions=['EEG', 'accelerometer'],
+                            sinks=[sink], tracer=tracer,
+                            transmit_groups=[['EEG']])
+    assert len(streamer._transmit_threads) == 2
+    time.sleep(1.5)
+    n_chunks = {name: len(chunks) for name, chunks in sink.chunks.items()}
+    sink.delay = 0
+    streamer.disconnect()
+    dongle.close()
+    # EEG is pushed at its nominal rate (~21 chunks/s), unlike accelerometer
+    assert n_chunks['EEG'] > 20
+    assert n_chunks['accelerometer'] < 10
+    latency = tracer.latencies()[('Muse-0001', 'EEG')]['total']
+    assert np.max(latency) < 0.1
+
+
+def test_transmit_priority():
+    class OrderSink(SlowSink):
+        def push_chunk(self, name, chunk, timestamp):
+            super().push_chunk(name, chunk, timestamp)
+            order.append(name)
+
+    order = []
+    streamer = b2l.Streamer(muse2016, autostart=False,
+                            subscriptions=['EEG', 'accelerometer'],
+                            sinks=[OrderSink(['EEG'], 0.01)],
+                            transmit_groups=[['EEG']])
+    init_sinks(streamer)
+    for chunk_idx in range(5):
+        for name in ['accelerometer', 'EEG']:
+            chunk = np.ones(streamer._chunks[name].shape)
+            streamer._transmit_queues[name].put((name, chunk_idx, chunk))
+    streamer._start_transmit()
+    streamer._stop_transmit()
+    for thread in streamer._transmit_threads:
+        thread.join(b2l.STOP_TIMEOUT)
+    # accelerometer waits on the slower EEG chunks enqueued before it
+    assert order == ['EEG'] * 5 + ['accelerometer'] * 5
+
+
+def test_interval_controller():
+    from ble2lsl.interval import IntervalController
+    controller = IntervalController.for_device(ganglion, clean_windows=2)
+    limits = ganglion.PARAMS['ble']['interval_limits']
+
+    def loss(interval):
+        return 0.1 if interval > 8 else 0.0
+
+    intervals = []
+    for _ in range(40):
+        interval = controller.interval_range[1]
+        interval_range, _ = controller.update(
+            {'EEG': 100}, {'EEG': int(100 * loss(interval))})
+        if interval_range is not None:
+            assert limits[0] <= interval_range[0] <= interval_range[1]
+            assert interval_range[1] <= limits[1]
+            intervals.append(interval_range[1])
+    # tightens to a clean interval, then relaxes less and less often
+    assert intervals[0] < ganglion.PARAMS['ble']['interval_max']
+    assert loss(intervals[0]) == 0
+    assert 2 <= len(intervals) < 10
+
+
+def test_adapt_interval():
+    from ble2lsl.virtual import VirtualDongle
+    dongle = VirtualDongle(ganglion,
+                           loss=lambda interval: 0.2 if interval > 8 else 0)
+    streamer = b2l.Streamer(ganglion, interface=dongle.port, scan_timeout=0.3,
+                            subscriptions=['EEG'], sinks=[ListSink()],
+                            adapt_interval=True, adapt_period=0.3)
+    time.sleep(1.5)
+    streamer.disconnect()
+    dongle.close()
+    assert streamer.missing_chunks['EEG'] > 0
+    assert dongle.connection_interval <= 8
+    assert streamer.connection_interval[1] == dongle.connection_interval
+
+
+def test_adapter_pool():
+    from ble2lsl.adapters import AdapterPool
+    from ble2lsl.virtual import VirtualDongle
+    dongles = [VirtualDongle(muse2016, address='00:55:DA:B0:00:0{}'.format(i))
+               for i in range(2)]
+    adapters = AdapterPool([dongle.port for dongle in dongles])
+    streamers = [b2l.Streamer(muse2016, adapters=adapters, scan_timeout=0.3,
+                              subscriptions=['EEG'], sinks=[ListSink()])
+                 for _ in dongles]
+    # one device is assigned to each adapter
+    assert {streamer.address for streamer in streamers} \
+        == {'00:55:DA:B0:00:00', '00:55:DA:B0:00:01'}
+    time.sleep(1.1)
+    stats = adapters.throughput()
+    assert [adapter['connections'] for adapter in stats] == [1, 1]
+    assert all(adapter['rate'] > 0 for adapter in stats)
+    for streamer in streamers:
+        streamer.disconnect()
+    assert [adapter['connections'] for adapter in adapters.throughput()] \
+        == [0, 0]
+    adapters.close()
+    for dongle in dongles:
+        dongle.close()
+
+
+def test_tracing(tmp_path):
+    import json
+    from ble2lsl.tracing import SPANS, Tracer
+    from ble2lsl.virtual import VirtualDongle
+    dongle = VirtualDongle(muse2016)
+    tracer = Tracer(capacity=20)
+    streamer = b2l.Streamer(muse2016, interface=dongle.port, scan_timeout=0.3,
+                            subscriptions=['EEG', 'accelerometer'],
+                            sinks=[ListSink()], tracer=tracer)
+    time.sleep(1)
+    streamer.disconnect()
+    dongle.close()
+    assert len(tracer) == 20
+    latencies = tracer.latencies()
+    assert set(latencies) <= {('Muse-0001', 'EEG'),
+                              ('Muse-0001', 'accelerometer')}
+    for spans in latencies.values():
+        for span, _, _ in SPANS:
+            assert np.all(spans[span] >= 0)
+        assert np.allclose(sum(spans[span] for span, _, _ in SPANS),
+                           spans['total'])
+
+    tracer.export(tmp_path / 'trace.json')
+    with open(tmp_path / 'trace.json') as f:
+        events = json.load(f)['traceEvents']
+    assert sum(event['ph'] == 'X' for event in events) == 20 * len(SPANS)
+    with pytest.raises(ValueError):
+        b2l.Streamer(muse2016, autostart=False, tracer=tracer, pool=object())
+
+
+def test_ganglion_samples_from_deltas():
+    last_sample = np.random.randint(-2 ** 23, 2 ** 23, 4).astype(float)
+    deltas = np.random.randint(-2 ** 18, 2 ** 18, (5, 2, 4)).astype(float)
+    samples = ganglion.samples_from_deltas(last_sample, deltas)
+    assert samples.shape == (10, 4)
+    sample = np.copy(last_sample)
+    for i, delta in enumerate(deltas.reshape((-1, 4))):
+        sample -= delta
+        assert np.array_equal(samples[i], sample)
+
+
+def test_muse_packet_encoder():
+    streamer = b2l.Streamer(muse2016, autostart=False)
+    handler = muse2016.PacketHandler(streamer)
+    encoder = muse2016.PacketEncoder(first_packet_id=2 ** 16 - 1)
+    eeg = np.random.uniform(-900, 900, (12, 5))
+    accelerometer = np.random.uniform(-1, 1, (3, 3))
+    message = '{"hn":"Muse-1234","sn":"0000-0000-0000","bp":90}'
+    packets = (encoder.encode('EEG', eeg) + encoder.encode('EEG', eeg)
+               + encoder.encode('accelerometer', accelerometer)
+               + encoder.encode('status', message))
+    for handle, packet in packets:
+        assert len(packet) == 20
+        handler.process_packet(handle, packet)
+    chunks = [streamer._transmit_queue.get_nowait() for _ in range(4)]
+    assert [chunk[:2] for chunk in chunks] == [
+        ('EEG', 2 ** 16 - 1), ('EEG', 2 ** 16), ('accelerometer', 2 ** 16 - 1),
+        ('status', -1)]
+    assert np.allclose(chunks[0][2], eeg, atol=0.49 / 2)
+    assert np.allclose(chunks[2][2], accelerometer, atol=0.0001 / 2)
+    assert chunks[3][2][0, 0] == message
+
+
+def test_muse_status_fields():
+    streamer = b2l.Streamer(muse2016, autostart=False,
+                            subscriptions=['status', 'status_fields'])
+    handler = muse2016.PacketHandler(streamer)
+    encoder = muse2016.PacketEncoder()
+    # multibyte characters may span packets
+    message = ('{"hn":"Müse-1234","sn":"0000-0000-0000","bp":82,"ts":0,'
+               '"ps":32,"rc":0,"id":"éèê"}')
+    interrupted = encoder.encode('status', '{"hn":"Muse-1234","sn":"0')[:1]
+    for handle, packet in interrupted + encoder.encode('status', message):
+        handler.process_packet(handle, packet)
+    status = streamer._transmit_queue.get_nowait()
+    fields = streamer._transmit_queue.get_nowait()
+    assert streamer._transmit_queue.empty()
+    assert status[:2] == ('status', -1)
+    assert status[2][0, 0] == message
+    assert fields[:2] == ('status_fields', -1)
+    assert fields[2].dtype == np.float32
+    assert np.array_equal(fields[2], [[82, 32, 0, np.nan, np.nan]],
+                          equal_nan=True)
+
+
+@pytest.mark.parametrize('compression', [18, 19])
+def test_ganglion_packet_encoder(compression):
+    deltas = ganglion.quantize_deltas(
+        np.random.randint(-2 ** 20, 2 ** 20, (2, 4)), compression)
+    decompress = getattr(ganglion,
+                         'decompress_deltas_{}bit'.format(compression))
+    assert np.array_equal(
+        decompress(ganglion.compress_deltas(deltas, compression)), deltas)
+
+    streamer = b2l.Streamer(ganglion, subscriptions=['EEG'], raw=['EEG'],
+                            autostart=False)
+    handler = ganglion.PacketHandler(streamer)
+    encoder = ganglion.PacketEncoder(compression)
+    samples = np.cumsum(np.random.randint(-5000, 5000, (302, 4)), axis=0)
+    for handle, packet in encoder.encode(
+            'EEG', samples * ganglion.SCALE_FACTOR['EEG']):
+        handler.process_packet(handle, packet)
+    chunks = [streamer._transmit_queue.get_nowait() for _ in range(302)]
+    assert [idx for _, idx, _ in chunks] == list(range(302))
+    decoded = np.concatenate([chunk for _, _, chunk in chunks])
+    assert np.array_equal(decoded[0], samples[0])
+    assert np.all(np.abs(decoded - samples) <= 1)
+
+
+def test_steady_state_allocations(device):
+    import tracemalloc
+    name = 'EEG'
+    streamer = b2l.Streamer(device, subscriptions=[name], autostart=False,
+                            sinks=[b2l.sinks.LSLSink()])
+    streamer._device_id, streamer._address = "ALLOCTEST", "TEST"
+    streamer._init_sinks()
+    handler = device.PacketHandler(streamer)
+    encoder = device.PacketEncoder()
+    params = device.PARAMS['streams']
+    chunk_shape = (params['chunk_size'][name], params['channel_count'][name])
+    packets = [encoder.encode(name, 100 * np.random.randn(*chunk_shape))
+               for _ in range(300)]
+
+    def numpy_traced():
+        # array data allocated on this thread (not by other tests' threads)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, __file__, all_frames=True,
+                                domain=np.lib.tracemalloc_domain)])
+        return sum(trace.size for trace in snapshot.traces)
+
+    # referenced, so that new chunks would not take the IDs of freed ones
+    queued = {}
+    tracemalloc.start(25)
+    try:
+        sizes = []
+        for i, chunk_packets in enumerate(packets):
+            for handle, packet in chunk_packets:
+                handler.process_packet(handle, packet)
+            while not streamer._transmit_queue.empty():
+                item = streamer._transmit_queue.get_nowait()
+                queued[id(item[2])] = item[2]
+                streamer._transmit_item(item)
+            # after warm-up, every few chunks (snapshots are slow)
+            if i >= 100 and i % 10 == 0:
+                sizes.append(numpy_traced())
+    finally:
+        tracemalloc.stop()
+    assert len(set(sizes)) == 1
+    # chunks are recycled, not allocated
+    assert len(queued) <= 2
+    streamer._close_sinks()
+
+
+def test_shared_memory(device):
+    from ble2lsl.sharedmem import SharedMemoryReader
+    dummy = b2l.Dummy(device, autostart=False, shared_memory=True)
+    name = 'EEG'
+    reader = SharedMemoryReader(dummy._device_id, name)
+    chunk_size = device.PARAMS['streams']['chunk_size'][name]
+    n_chunks = reader.capacity // chunk_size + 3
+    chunk_iter = iter(dummy._chunk_iter[name])
+    chunks = [next(chunk_iter) for _ in range(n_chunks)]
+    for i, chunk in enumerate(chunks):
+        dummy._chunks[name] = chunk
+        dummy._push_chunk(name, float(i))
+    assert reader.n_written == n_chunks * chunk_size
+
+    samples, timestamps = reader.latest(2 * chunk_size)
+    assert not samples.flags.owndata
+    assert np.allclose(samples, np.concatenate(chunks[-2:]), atol=1e-5)
+    assert timestamps[-1] == n_chunks - 1
+    assert np.all(np.diff(timestamps) > 0)
+    assert len(reader.latest()[0]) == reader.capacity
+    del samples, timestamps
+    reader.close()
+    dummy.close()
+
+
+def test_shared_memory_stale():
+    import os
+    import subprocess
+    import sys
+    from multiprocessing import shared_memory
+    from ble2lsl.sharedmem import (HEADER_SIZE, SharedMemoryRing,
+                                   shared_memory_name)
+    if os.name == 'nt':
+        pytest.skip("blocks are not left behind on Windows")
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    block = shared_memory.SharedMemory(
+        name=shared_memory_name('Muse-STALE', 'EEG'), create=True, size=64)
+    header = np.ndarray((HEADER_SIZE,), dtype=np.uint64, buffer=block.buf)
+    header[4] = exited.pid
+    with pytest.warns(UserWarning, match="stale"):
+        ring = SharedMemoryRing('Muse-STALE', 'EEG', 5, np.float32, 16)
+    # now written by this (running) process
+    with pytest.raises(FileExistsError, match="ble2lsl-Muse-STALE-EEG"):
+        SharedMemoryRing('Muse-STALE', 'EEG', 5, np.float32, 16)
+    del header
+    block.close()
+    ring.close()
+
+
+def test_receiver(device):
+    from ble2lsl.receiver import Receiver
+    device_id = '{}-RECEIVER'.format(device.NAME)
+    dummy = b2l.Dummy(device, autostart=False, device_id=device_id)
+    name = 'EEG'
+    receiver = Receiver(device_id, streams=[name], duration=1.0)
+    assert receiver.streams == (name,)
+    chunk_size = device.PARAMS['streams']['chunk_size'][name]
+    chunk_iter = iter(dummy._chunk_iter[name])
+    chunks = [next(chunk_iter) for _ in range(5)]
+    for i, chunk in enumerate(chunks):
+        dummy._chunks[name] = chunk
+        dummy._push_chunk(name, float(i))
+    deadline = time.time() + 5
+    while (receiver.n_received(name) < 5 * chunk_size
+           and time.time() < deadline):
+        time.sleep(0.01)
+    assert receiver.n_received(name) == 5 * chunk_size
+
+    samples, timestamps = receiver.latest(name, 2 * chunk_size)
+    assert not samples.flags.owndata
+    assert np.allclose(samples, np.concatenate(chunks[-2:]), atol=1e-5)
+    assert timestamps[-1] == 4.0
+    receiver.close()
+    dummy.close()
+
+
+def test_receiver_requires_pull_into(monkeypatch):
+    import pylsl
+    from ble2lsl.receiver import Receiver
+
+    def pull_chunk(self, timeout=0.0, max_samples=1024, dest_obj=None):
+        pass
+
+    # as in pylsl < 1.18.4
+    monkeypatch.setattr(pylsl.StreamInlet, 'pull_chunk', pull_chunk)
+    with pytest.raises(RuntimeError):
+        Receiver('Muse-OLD')
+
+
+def test_receiver_lost():
+    from pylsl.util import LostError
+    from ble2lsl.receiver import Receiver
+
+    def pull_lost(**kwargs):
+        raise LostError("the stream has been lost.")
+
+    device_id = 'Muse-LOST'
+    dummy = b2l.Dummy(muse2016, autostart=False, device_id=device_id)
+    receiver = Receiver(device_id, streams=['EEG', 'accelerometer'])
+    assert receiver.lost == ()
+    with pytest.warns(UserWarning, match="Lost"):
+        receiver._inlets['EEG'].pull_chunk = pull_lost
+        receiver._threads['EEG'].join(5)
+    assert not receiver._threads['EEG'].is_alive()
+    assert receiver.lost == ('EEG',)
+    receiver.close()
+    dummy.close()
+
+
+def test_async_chunks(device):
+    import asyncio
+    name = 'EEG'
+    sink = ListSink()
+    dummy = b2l.Dummy(device, autostart=False, sinks=[sink])
+    chunk_size, n_channels = dummy._chunks[name].shape
+    srate = device.PARAMS['streams']['nominal_srate'][name]
+
+    async def consume(n_chunks):
+        received = []
+        chunks = dummy.chunks([name])
+        try:
+            async for item in chunks:
+                received.append(item)
+                if len(received) == n_chunks:
+                    break
+        finally:
+            await chunks.aclose()
+        return received
+
+    dummy.start()
+    received = run_async(consume(5))
+    dummy.close()
+    # detached from the streamer once the consumer stops
+    assert dummy.sinks == (sink,)
+    assert [item_name for item_name, _, _ in received] == [name] * 5
+    for _, timestamps, chunk in received:
+        assert chunk.shape == (chunk_size, n_channels)
+        assert np.allclose(np.diff(timestamps), 1 / srate)
+    assert len(sink.chunks[name]) >= 5
+
+    # a consumer falling behind misses the oldest chunks
+    async def fall_behind():
+        from ble2lsl.aio import AsyncSink
+        async_sink = AsyncSink(max_chunks=2)
+        async_sink.open(name, dict(nominal_srate=srate))
+        chunk = np.zeros((chunk_size, n_channels))
+        with pytest.warns(UserWarning):
+            for i in range(5):
+                chunk[:] = i
+                async_sink.push_chunk(name, chunk, float(i))
+        assert async_sink.dropped_chunks == 3
+        return [await async_sink.__anext__() for _ in range(2)]
+
+    assert [chunk[0, 0] for _, _, chunk in run_async(fall_behind())] \
+        == [3, 4]
+
+    # a consumer whose loop closes without closing the iterator is detached
+    dummy = b2l.Dummy(device, autostart=False, sinks=[sink])
+    dummy.start()
+    loop = asyncio.new_event_loop()
+    chunks = dummy.chunks([name])
+    loop.run_until_complete(chunks.__anext__())
+    loop.close()
+    time.sleep(0.2)
+    assert dummy.sinks == (sink,)
+    n_pushed = len(sink.chunks[name])
+    time.sleep(0.2)
+    assert len(sink.chunks[name]) > n_pushed
+    dummy.close()
+
+
+def test_loadgen(device):
+    from ble2lsl.loadgen import run_devices
+    device_name = device.__name__.split('.')[-1]
+    result = run_devices([(device_name, 'LOADTEST-0'),
+                          (device_name, 'LOADTEST-1')], 2.0, sink='none')
+    assert set(result['rates']) == {'LOADTEST-0', 'LOADTEST-1'}
+    for _, rates in result['rates'].values():
+        nominal_srate = device.PARAMS['streams']['nominal_srate']['EEG']
+        assert abs(rates['EEG'] / nominal_srate - 1) < 0.1
+    assert len(result['latencies']) and np.all(result['latencies'] >= 0)
+
+
+def test_sinks(device):
+    sinks = [b2l.sinks.LSLSink(), ListSink(streams=['EEG'])]
+    dummy = b2l.Dummy(device, autostart=False, sinks=sinks)
+    assert dummy.sinks == tuple(sinks)
+    for name in dummy.subscriptions:
+        dummy._push_chunk(name, 0.0)
+    assert list(sinks[1].chunks) == ['EEG']
+    assert len(sinks[1].chunks['EEG']) == 1
+    assert set(sinks[0]._outlets) == set(dummy.subscriptions)
+    dummy.close()
+    assert not sinks[0]._outlets
+
+
+def test_recording_sink(device, tmp_path):
+    from ble2lsl.recording import RecordingSink, load_recording
+    sink = RecordingSink(str(tmp_path), buffer_size=1024)
+    dummy = b2l.Dummy(device, autostart=False, sinks=[sink])
+    name = 'EEG'
+    chunk_iter = iter(dummy._chunk_iter[name])
+    chunks = [next(chunk_iter) for _ in range(50)]
+    for i, chunk in enumerate(chunks):
+        dummy._chunks[name] = chunk
+        dummy._push_chunk(name, float(i))
+    dummy.close()
+
+    samples, timestamps, header = load_recording(str(tmp_path),
+                                                 dummy._device_id, name)
+    assert header["n_samples"] == len(samples) == len(timestamps)
+    assert np.allclose(samples, np.concatenate(chunks), atol=1e-5)
+    chunk_size = device.PARAMS['streams']['chunk_size'][name]
+    assert np.allclose(timestamps[chunk_size - 1::chunk_size],
+                       np.arange(len(chunks)))
+
+
+def test_recording_restart(tmp_path):
+    from ble2lsl.recording import RecordingSink, load_recording
+    name = 'EEG'
+    recording_sink, list_sink = RecordingSink(str(tmp_path)), ListSink()
+    dummy = b2l.Dummy(muse2016, subscriptions=[name], autostart=False,
+                      sinks=[recording_sink, list_sink])
+    recorded = recording_sink._streams_open[name]
+    for _ in range(2):
+        dummy.start()
+        time.sleep(0.2)
+        dummy.stop()
+    # stopping leaves the streams open
+    assert recording_sink._streams_open[name] is recorded
+    pushed = list(list_sink.chunks[name])
+    # reopened after closing, the recording is continued
+    dummy.close()
+    dummy.start()
+    time.sleep(0.2)
+    dummy.close()
+    pushed += list_sink.chunks[name]
+
+    samples, timestamps, header = load_recording(str(tmp_path),
+                                                 dummy._device_id, name)
+    assert header["n_samples"] == len(samples) == len(timestamps)
+    assert np.allclose(samples, np.concatenate([c for c, _ in pushed]),
+                       atol=1e-5)
+    chunk_size = muse2016.PARAMS['streams']['chunk_size'][name]
+    assert np.allclose(timestamps[chunk_size - 1::chunk_size],
+                       [timestamp for _, timestamp in pushed])
+
+    # another sink starts a new recording; changed metadata is not appended
+    new_sink = RecordingSink(str(tmp_path))
+    with pytest.warns(UserWarning, match="Overwriting"):
+        dummy = b2l.Dummy(muse2016, subscriptions=[name], autostart=False,
+                          sinks=[new_sink], raw=[name])
+    dummy.close()
+    samples, _, header = load_recording(str(tmp_path), dummy._device_id,
+                                        name)
+    assert header["n_samples"] == len(samples) == 0
+    with pytest.raises(ValueError):
+        b2l.Dummy(muse2016, subscriptions=[name], autostart=False,
+                  sinks=[new_sink])
+
+
+@pytest.mark.parametrize('use_scipy', [True, False])
+def test_iir_filter(device, use_scipy, monkeypatch):
+    from ble2lsl import processing
+    if not use_scipy:
+        monkeypatch.setattr(processing, '_scipy_sosfilt', None)
+    elif processing._scipy_sosfilt is None:
+        pytest.skip("scipy not installed")
+    name = 'EEG'
+    srate = device.PARAMS['streams']['nominal_srate'][name]
+    sink = ListSink()
+    filters = [processing.IIRFilter(band=(None, 20)),
+               processing.IIRFilter(band=(None, 20), replace=True)]
+    dummy = b2l.Dummy(device, subscriptions=[name], autostart=False,
+                      sinks=[sink], processors={name: filters})
+    assert set(sink.chunks) == {name, name + '-filtered'}
+
+    chunk_shape = dummy._chunks[name].shape
+    t = np.arange(200 * chunk_shape[0]) / srate
+    # DC offset plus a component in the stopband
+    signal = 100 + np.sin(2 * np.pi * 0.4 * srate * t)
+    signal = np.tile(signal[:, np.newaxis], (1, chunk_shape[1]))
+    for i, chunk in enumerate(np.split(signal, 200)):
+        dummy._chunks[name] = chunk
+        dummy._push_chunk(name, float(i))
+    for out_name in [name, name + '-filtered']:
+        filtered = np.concatenate([c for c, _ in sink.chunks[out_name]])
+        assert filtered.shape == signal.shape
+        assert np.allclose(filtered, 100, rtol=0, atol=0.1)
+    dummy.close()
+
+
+def test_iir_filter_raw(device):
+    from ble2lsl.processing import BandPower, IIRFilter
+    from ble2lsl.utils import missing_value
+    name = 'EEG'
+    params = device.PARAMS['streams']
+    sink = ListSink()
+    dummy = b2l.Dummy(device, subscriptions=[name], autostart=False,
+                      raw=[name], sinks=[sink],
+                      processors={name: [IIRFilter(band=(None, 20)),
+                                         BandPower(window=0.5, hop=0.1)]})
+    out_name = name + '-filtered'
+    assert sink.info[out_name]['scale'] is None
+    assert sink.info[out_name]['offset'] is None
+
+    dtype = params['raw_channel_format'][name]
+    chunk = np.full(dummy._chunks[name].shape, 100, dtype=dtype)
+    missing = np.full(chunk.shape, missing_value(dtype), dtype=dtype)
+    n_chunks = int(params['nominal_srate'][name] / chunk.shape[0]) + 1
+    raw_chunks = [chunk, chunk, missing] + [chunk] * n_chunks
+    for i, raw_chunk in enumerate(raw_chunks):
+        dummy._chunks[name] = raw_chunk
+        dummy._push_chunk(name, float(i))
+    filtered = [c for c, _ in sink.chunks[out_name]]
+    # in units, from the steady state of the first sample of each run
+    expected = params['raw_scale'][name] * (100 - params['raw_offset'][name])
+    for i in [0, 1, 3]:
+        assert np.allclose(filtered[i], expected, rtol=1e-5)
+    assert np.all(np.isnan(filtered[2]))
+    # the missing chunk is masked in band powers, not taken as samples
+    powers = np.concatenate([c for c, _ in sink.chunks[name + '-bandpower']])
+    assert np.isnan(powers).any()
+    assert np.nanmax(powers) < 1e-6
+    dummy.close()
+
+
+def test_decimator(device):
+    from ble2lsl.processing import Decimator
+    name, factor = 'EEG', 4
+    srate = device.PARAMS['streams']['nominal_srate'][name]
+    sink = ListSink()
+    dummy = b2l.Dummy(device, subscriptions=[name], autostart=False,
+                      sinks=[sink], processors={name: [Decimator(factor)]})
+    out_name = name + '-decimated'
+    assert sink.info[out_name]['nominal_srate'] == srate / factor
+
+    chunk_iter = iter(dummy._chunk_iter[name])
+    chunk_size = dummy._chunks[name].shape[0]
+    n_chunks = 10 * factor
+    for i in range(n_chunks):
+        dummy._chunks[name] = next(chunk_iter)
+        # timestamp of the chunk's last sample
+        dummy._push_chunk(name, ((i + 1) * chunk_size - 1) / srate)
+
+    decimated = np.concatenate([c for c, _ in sink.chunks[out_name]])
+    assert decimated.shape == (n_chunks * chunk_size // factor,
+                               dummy._chunks[name].shape[1])
+    # last timestamps of chunks fall on the decimated sample times
+    timestamps = np.array([t for _, t in sink.chunks[out_name]]) * srate
+    assert np.allclose(timestamps % factor, 0)
+    dummy.close()
+
+
+def test_band_power(device):
+    from ble2lsl.processing import BandPower
+    name = 'EEG'
+    srate = device.PARAMS['streams']['nominal_srate'][name]
+    sink = ListSink()
+    dummy = b2l.Dummy(device, subscriptions=[name], autostart=False,
+                      sinks=[sink], processors={name: [BandPower()]})
+    out_name = name + '-bandpower'
+    info = sink.info[out_name]
+    n_channels = dummy._chunks[name].shape[1]
+    assert info['channel_count'] == 5 * n_channels
+    assert info['ch_names'][:2] == ('{}_delta'.format(
+        device.PARAMS['streams']['ch_names'][name][0]),
+        '{}_theta'.format(device.PARAMS['streams']['ch_names'][name][0]))
+
+    # 10 Hz sinusoid: power concentrated in the alpha band
+    chunk_size = dummy._chunks[name].shape[0]
+    n_chunks = int(3 * srate) // chunk_size
+    t = np.arange(n_chunks * chunk_size) / srate
+    signal = np.tile(np.sin(2 * np.pi * 10 * t)[:, np.newaxis],
+                     (1, n_channels))
+    for i, chunk in enumerate(np.split(signal, n_chunks)):
+        dummy._chunks[name] = chunk
+        dummy._push_chunk(name, t[(i + 1) * chunk_size - 1])
+    powers = np.concatenate([c for c, _ in sink.chunks[out_name]])
+    # one output per hop, once the first window is full
+    assert len(powers) == (n_chunks * chunk_size - srate) // (srate / 4) + 1
+    powers = powers.reshape((len(powers), n_channels, 5))
+    assert np.all(np.argmax(powers, axis=2) == 2)
+    # total power of a unit sinusoid is 1/2
+    assert np.allclose(powers.sum(axis=2), 0.5, rtol=0.1)
+    dummy.close()